@@ -12,3 +12,11 @@ class CoreferrerResultsSerializer(serializers.Serializer):
     author = AuthorSerializer()
     references = ReferenceResultSerializer(many=True)
     backreferences = ReferenceResultSerializer(many=True)
+
+
+class CoreferrerSummarySerializer(serializers.Serializer):
+    author = AuthorSerializer(source='*')
+    references_count = serializers.IntegerField(source='reference_count')
+    backreferences_count = serializers.IntegerField(source='backreference_count')
+    score = serializers.IntegerField()
+    h_index = serializers.IntegerField()
@@ -3,7 +3,8 @@ from collections import namedtuple
 
 from haystack.query import SearchQuerySet
 
-from main_assistant.models import Author, Reference
+from main_assistant.citation_graph import get_citation_graph
+from main_assistant.models import Author, Reference, AuthorMetrics
 
 LIMIT_AUTHOR_SEARCH = 100
 MIN_SIMILARITY = 0.30
@@ -56,3 +57,78 @@ def find_coreferrers(original_author):
     coreferrers.sort(key=lambda x: (len(x.references) + len(x.backreferences)) *
                                    len(x.references) * len(x.backreferences), reverse=True)
     return coreferrers
+
+
+def find_coreferrers_aggregated(original_author_id):
+    """Same coreferrers as find_coreferrers, with only the reference counts, computed by the database."""
+    coreferrers = Author.objects.raw('''
+        WITH own_articles AS (
+            SELECT article_id
+            FROM main_assistant_article_authors
+            WHERE author_id = %s
+        ), reference_counts AS (
+            SELECT relation_t.author_id, COUNT(reference_t.id) AS reference_count
+            FROM main_assistant_reference reference_t
+            JOIN own_articles
+                ON reference_t.referring_id = own_articles.article_id
+            JOIN main_assistant_article_authors relation_t
+                ON reference_t.referred_id = relation_t.article_id
+            GROUP BY relation_t.author_id
+        ), backreference_counts AS (
+            SELECT relation_t.author_id, COUNT(reference_t.id) AS backreference_count
+            FROM main_assistant_reference reference_t
+            JOIN own_articles
+                ON reference_t.referred_id = own_articles.article_id
+            JOIN main_assistant_article_authors relation_t
+                ON reference_t.referring_id = relation_t.article_id
+            WHERE relation_t.author_id <> %s
+            GROUP BY relation_t.author_id
+        )
+        SELECT main_assistant_author.*, reference_count, backreference_count,
+               (reference_count + backreference_count) * reference_count * backreference_count AS score,
+               COALESCE(metrics_t.h_index, 0) AS h_index
+        FROM reference_counts
+        JOIN backreference_counts
+            ON reference_counts.author_id = backreference_counts.author_id
+        JOIN main_assistant_author
+            ON reference_counts.author_id = main_assistant_author.id
+        LEFT JOIN main_assistant_authormetrics metrics_t
+            ON reference_counts.author_id = metrics_t.author_id
+        ORDER BY score DESC, main_assistant_author.id;
+    ''', [original_author_id, original_author_id])
+    return list(coreferrers)
+
+
+def find_coreferrers_from_graph(original_author_id):
+    """Same results as find_coreferrers_aggregated, answered by the in-memory citation graph if it is available."""
+    graph = get_citation_graph()
+    if graph is None:
+        return find_coreferrers_aggregated(original_author_id)
+    coreferrers = graph.coreferrers(original_author_id)
+    authors = Author.objects.in_bulk([entry[0] for entry in coreferrers])
+    h_indexes = dict(AuthorMetrics.objects.filter(author_id__in=authors.keys()).values_list('author_id', 'h_index'))
+    results = []
+    for author_id, reference_count, backreference_count, score in coreferrers:
+        # authors deleted after the snapshot
+        author = authors.get(author_id)
+        if author is None:
+            continue
+        author.reference_count = reference_count
+        author.backreference_count = backreference_count
+        author.score = score
+        author.h_index = h_indexes.get(author_id, 0)
+        results.append(author)
+    return results
+
+
+def sort_by_h_index(coreferrers):
+    coreferrers.sort(key=lambda x: (-x.h_index, -x.score, x.pk))
+    return coreferrers
+
+
+def find_coreferrer_references(original_author, coreferrer):
+    references = Reference.objects.select_related('referring', 'referred') \
+        .filter(referring__authors=original_author, referred__authors=coreferrer)
+    backreferences = Reference.objects.select_related('referring', 'referred') \
+        .filter(referring__authors=coreferrer, referred__authors=original_author)
+    return coreferrer_entry(coreferrer, list(references), list(backreferences))
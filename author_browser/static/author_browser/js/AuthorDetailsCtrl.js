@@ -51,19 +51,35 @@ AuthorDetailsCtrl = angular.module('pubAssistantClient').controller('AuthorDetai
              });
      }
 
+     $scope.getCoreferrerReferences = function(coreferrer) {
+        if (coreferrer.details || coreferrer.detailsRequestPending) return;
+        coreferrer.detailsRequestError = false;
+        coreferrer.detailsRequestPending = true;
+        $http.get(urls.authorCoreferrerReferencesUrl, {params: {'id': $scope.id, 'coreferrer': coreferrer.author.id}}).then(
+             function successCallback(response) {
+                 coreferrer.detailsRequestPending = false;
+                 coreferrer.details = response.data;
+             }, function failCallback(response) {
+                 coreferrer.detailsRequestPending = false;
+                 coreferrer.detailsRequestError = true;
+             });
+     }
+
      $scope.triggerReferences = function(coreferrer) {
-        if (coreferrer.references.show) {
-            coreferrer.references.show = false;
+        if (coreferrer.showReferences) {
+            coreferrer.showReferences = false;
         } else {
-            coreferrer.references.show = true;
+            coreferrer.showReferences = true;
+            $scope.getCoreferrerReferences(coreferrer);
         }
      }
 
      $scope.triggerBackreferences = function(coreferrer) {
-        if (coreferrer.backreferences.show) {
-             coreferrer.backreferences.show = false;
+        if (coreferrer.showBackreferences) {
+             coreferrer.showBackreferences = false;
          } else {
-             coreferrer.backreferences.show = true;
+             coreferrer.showBackreferences = true;
+             $scope.getCoreferrerReferences(coreferrer);
          }
      }
 
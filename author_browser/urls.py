@@ -8,4 +8,5 @@ urlpatterns = [
     url(r'^author_search$', views.author_search, name='author_search'),
     url(r'^author_articles$', views.author_articles, name='author_articles'),
     url(r'^author_coreferrers$', views.author_coreferrers, name='author_coreferrers'),
+    url(r'^author_coreferrer_references$', views.author_coreferrer_references, name='author_coreferrer_references'),
 ]
@@ -1,13 +1,14 @@
 import logging
 
-from django.db.models import Count
+from django.conf import settings
 from django.shortcuts import render
 from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from author_browser.serializers import CoreferrerResultsSerializer
-from author_browser.services import search_authors, find_coreferrers
+from author_browser.serializers import CoreferrerResultsSerializer, CoreferrerSummarySerializer
+from author_browser.services import search_authors, find_coreferrers_aggregated, find_coreferrer_references, \
+    find_coreferrers_from_graph, sort_by_h_index
 from main_assistant.models import Author, Article
 from main_assistant.serializers import ArticleSerializer, AuthorSerializer
 from main_assistant.utils import RangeHeaderPaginator
@@ -55,7 +56,7 @@ def author_articles(request):
             return Response('id parameter not int type', status=status.HTTP_400_BAD_REQUEST)
     sort = request.query_params.get('sort')
     if sort is not None and sort == 'citations':
-        qs = Article.objects.filter(authors__pk=id).annotate(cited=Count('is_referred')).order_by('cited')
+        qs = Article.objects.filter(authors__pk=id).order_by('-cited_count', 'id')
     else:
         qs = Article.objects.filter(authors__pk=id).order_by('title')
     return RangeHeaderPaginator(qs, ArticleSerializer).get_response(request)
@@ -71,6 +72,29 @@ def author_coreferrers(request):
             id = int(id_param)
         except (ValueError, TypeError):
             return Response('id parameter not int type', status=status.HTTP_400_BAD_REQUEST)
+    if settings.CITATION_GRAPH_ENABLED:
+        coreferrers = find_coreferrers_from_graph(id)
+    else:
+        coreferrers = find_coreferrers_aggregated(id)
+    sort = request.query_params.get('sort')
+    if sort is not None and sort == 'h_index':
+        coreferrers = sort_by_h_index(coreferrers)
+    return RangeHeaderPaginator(coreferrers, CoreferrerSummarySerializer).get_response(request)
+
+
+@api_view(['GET'])
+def author_coreferrer_references(request):
+    id_param = request.query_params.get('id')
+    coreferrer_param = request.query_params.get('coreferrer')
+    if id_param is None or coreferrer_param is None:
+        return Response('id or coreferrer parameter missing', status=status.HTTP_400_BAD_REQUEST)
+    else:
+        try:
+            id = int(id_param)
+            coreferrer_id = int(coreferrer_param)
+        except (ValueError, TypeError):
+            return Response('id or coreferrer parameter not int type', status=status.HTTP_400_BAD_REQUEST)
     author = Author.objects.get(pk=id)
-    coreferrers = find_coreferrers(author)
-    return Response(CoreferrerResultsSerializer(coreferrers, many=True).data)
+    coreferrer = Author.objects.get(pk=coreferrer_id)
+    entry = find_coreferrer_references(author, coreferrer)
+    return Response(CoreferrerResultsSerializer(entry).data)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2016-10-08 11:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('main_assistant', '0006_publicationyearcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingKeyword',
+            fields=[
+                ('keyword', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trend', serialize=False, to='main_assistant.Keyword')),
+                ('rank', models.IntegerField(db_index=True)),
+                ('score', models.FloatField()),
+                ('growth', models.FloatField()),
+                ('acceleration', models.FloatField()),
+                ('phase', models.CharField(choices=[('0', 'innovation_trigger'), ('1', 'peak_of_inflated_expectations'), ('4', 'plateau_of_productivity'), ('3', 'slope_of_enlightenment'), ('2', 'trough_of_disillusionment')], db_index=True, max_length=1)),
+                ('recent_count', models.IntegerField()),
+                ('peak_year', models.IntegerField()),
+            ],
+        ),
+    ]
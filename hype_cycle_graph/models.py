@@ -1,3 +1,24 @@
 from django.db import models
 
-# Create your models here.
+from main_assistant.models import Keyword
+from main_assistant.utils import ChoiceEnum
+
+
+class HypePhase(ChoiceEnum):
+    innovation_trigger = 0
+    peak_of_inflated_expectations = 1
+    trough_of_disillusionment = 2
+    slope_of_enlightenment = 3
+    plateau_of_productivity = 4
+
+
+class TrendingKeyword(models.Model):
+    keyword = models.OneToOneField(Keyword, related_name='trend', primary_key=True)
+    rank = models.IntegerField(db_index=True)
+    score = models.FloatField()
+    # yearly change of the keyword's share in all articles, relative to its mean share
+    growth = models.FloatField()
+    acceleration = models.FloatField()
+    phase = models.CharField(max_length=1, choices=HypePhase.choices(), db_index=True)
+    recent_count = models.IntegerField()
+    peak_year = models.IntegerField()
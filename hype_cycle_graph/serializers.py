@@ -0,0 +1,13 @@
+from rest_framework import serializers
+
+from hype_cycle_graph.models import TrendingKeyword
+from main_assistant.serializers import KeywordSerializer
+
+
+class TrendingKeywordSerializer(serializers.ModelSerializer):
+    keyword = KeywordSerializer()
+    phase = serializers.CharField(source='get_phase_display')
+
+    class Meta:
+        model = TrendingKeyword
+        fields = ('keyword', 'rank', 'score', 'growth', 'acceleration', 'phase', 'recent_count', 'peak_year')
@@ -1,54 +1,217 @@
 import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import date
 
-from django.db import connection
-from haystack.query import SearchQuerySet
+import numpy as np
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Sum
 
-from main_assistant.models import Keyword, Publication
-from main_assistant.utils import convert
+from main_assistant.models import Keyword, Publication, KeywordYearCount, PublicationYearCount
+from main_assistant.utils import convert, PrefixIndex
+from hype_cycle_graph.models import TrendingKeyword, HypePhase
 
 LIMIT_KEYWORD_SEARCH = 100
 LIMIT_PUBLICATION_SEARCH = 50
 
+HISTORY_YEARS = 20
+TREND_YEARS = 6
+PEAK_RATIO = 0.9
+PLATEAU_GROWTH = 0.05
+EXPORT_CHUNK_SIZE = 100000
+TRENDING_BATCH_SIZE = 10000
+
+AUTOCOMPLETE_GENERATION_KEY = 'autocomplete_generation'
+GENERATION_CHECK_PERIOD = 60
+
 logger = logging.getLogger(__name__)
 
+autocomplete_entry = namedtuple('autocomplete_entry', ['keywords', 'publications', 'generation'])
+autocomplete_indexes = None
+autocomplete_checked = 0
+autocomplete_builder = None
+autocomplete_builder_lock = threading.Lock()
+
+
+def build_keyword_index():
+    start = time.time()
+    entries = [{'id': iden, 'keyword': keyword, 'occurrence_count': occurrence_count}
+               for iden, keyword, occurrence_count in
+               Keyword.objects.qualified_keywords().values_list('id', 'keyword', 'occurrence_count').iterator()]
+    index = PrefixIndex(entries, 'keyword', 'occurrence_count', LIMIT_KEYWORD_SEARCH)
+    logger.debug('Keyword prefix index of %d keywords built in %.5fs', len(index), time.time() - start)
+    return index
+
+
+def build_publication_index():
+    start = time.time()
+    article_counts = dict(PublicationYearCount.objects.filter(publication__is_journal=True)
+                          .values_list('publication_id').annotate(num=Sum('count')))
+    entries = [{'id': iden, 'name': name, 'identifier': identifier, 'article_count': article_counts.get(iden, 0)}
+               for iden, name, identifier in
+               Publication.objects.filter(is_journal=True).values_list('id', 'name', 'identifier').iterator()]
+    index = PrefixIndex(entries, 'name', 'article_count', LIMIT_PUBLICATION_SEARCH)
+    logger.debug('Publication prefix index of %d journals built in %.5fs', len(index), time.time() - start)
+    return index
+
+
+def refresh_autocomplete():
+    """Makes every web process rebuild its autocompletion indexes on the next generation check."""
+    if not cache.add(AUTOCOMPLETE_GENERATION_KEY, 1, timeout=None):
+        cache.incr(AUTOCOMPLETE_GENERATION_KEY)
+
+
+def build_autocomplete_indexes(generation):
+    global autocomplete_indexes
+    try:
+        autocomplete_indexes = autocomplete_entry(build_keyword_index(), build_publication_index(), generation)
+    except Exception:
+        logger.exception('Building autocompletion indexes of generation %d failed', generation)
+    finally:
+        connection.close()
+
+
+def start_autocomplete_build(generation):
+    global autocomplete_builder
+    with autocomplete_builder_lock:
+        if autocomplete_builder is None or not autocomplete_builder.is_alive():
+            logger.debug('Autocompletion indexes outdated, building generation %d', generation)
+            autocomplete_builder = threading.Thread(target=build_autocomplete_indexes, args=(generation,),
+                                                    daemon=True)
+            autocomplete_builder.start()
+
+
+def get_autocomplete_indexes():
+    """Returns the autocompletion indexes of this process, None until the first ones are built.
+
+    Every GENERATION_CHECK_PERIOD the generation is compared with the one bumped by refresh_autocomplete, and
+    outdated indexes are rebuilt by a background thread while the old ones keep answering queries.
+    """
+    global autocomplete_checked
+    now = time.time()
+    if now - autocomplete_checked >= GENERATION_CHECK_PERIOD:
+        autocomplete_checked = now
+        generation = cache.get(AUTOCOMPLETE_GENERATION_KEY, 0)
+        if autocomplete_indexes is None or autocomplete_indexes.generation != generation:
+            start_autocomplete_build(generation)
+    return autocomplete_indexes
+
 
 def search_publications(submitted_text):
-    sqs_results = SearchQuerySet().models(Publication).filter(name=submitted_text).filter(is_journal=True).load_all()[
-                  0:LIMIT_PUBLICATION_SEARCH]
-    results = [r.object for r in sqs_results]
-    return results
+    indexes = get_autocomplete_indexes()
+    return indexes.publications.search(submitted_text) if indexes else []
 
 
 def search_keywords(submitted_text):
-    sqs_results = SearchQuerySet().models(Keyword).filter(content=submitted_text).load_all()[0:LIMIT_KEYWORD_SEARCH]
-    results = [r.object for r in sqs_results]
-    return results
+    indexes = get_autocomplete_indexes()
+    return indexes.keywords.search(submitted_text) if indexes else []
 
 
 def get_hype_graph_data(keyword_id, journal_ids=None):
+    keyword_id = convert(keyword_id, int)
+    return get_hype_graph_series([keyword_id], journal_ids)[keyword_id]
+
+
+def get_yearly_article_totals(journal_ids=None):
+    counts = PublicationYearCount.objects.all()
+    if journal_ids is not None:
+        counts = counts.filter(publication_id__in=journal_ids)
+    return {year: num for year, num in counts.values_list('year').annotate(num=Sum('count'))}
+
+
+def get_hype_graph_series(keyword_ids, journal_ids=None, normalize=False):
+    counts = KeywordYearCount.objects.filter(keyword_id__in=keyword_ids)
+    if journal_ids is not None:
+        counts = counts.filter(publication_id__in=journal_ids)
+    rows = counts.values_list('keyword_id', 'year').annotate(num=Sum('count'))
+    series = {keyword_id: {} for keyword_id in keyword_ids}
+    for keyword_id, year, num in rows:
+        series[keyword_id][year] = num
+    if normalize:
+        totals = get_yearly_article_totals(journal_ids)
+        for year_counts in series.values():
+            for year, num in year_counts.items():
+                year_counts[year] = num / totals[year] if totals.get(year) else 0.0
+    return series
+
+
+def export_keyword_year_matrix(first_year, last_year):
+    """Returns ids of qualified keywords and a matrix of their article counts, one row per keyword, one column per year."""
     cursor = connection.cursor()
-    # reset_queries()
-    if journal_ids is None:
-        cursor.execute('''
-        SELECT (EXTRACT(year FROM issue_date)) AS "year", COUNT("main_assistant_article"."id") AS "num"
-        FROM "main_assistant_article"
-        INNER JOIN "main_assistant_article_keywords"
-            ON ("main_assistant_article"."id" = "main_assistant_article_keywords"."article_id")
-        WHERE ("main_assistant_article_keywords"."keyword_id" = %s)
-        GROUP BY (EXTRACT(year FROM issue_date));
-        ''', [keyword_id])
-    else:
-        cursor.execute('''
-        SELECT (EXTRACT(year FROM issue_date)) AS "year", COUNT("main_assistant_article"."id") AS "num"
-        FROM "main_assistant_article"
-        INNER JOIN "main_assistant_article_keywords"
-            ON ("main_assistant_article"."id" = "main_assistant_article_keywords"."article_id")
-        WHERE ("main_assistant_article_keywords"."keyword_id" = %s
-            AND "main_assistant_article"."publication_id" IN (SELECT U0."id"
-                                                              FROM "main_assistant_publication" U0
-                                                              WHERE U0."id" IN %s))
-        GROUP BY (EXTRACT(year FROM issue_date));
-        ''', [keyword_id, tuple(iden for iden in journal_ids)])
-    # logger.debug('{}'.format(connection.queries))
-    res_dict = {convert(row[0], int): row[1] for row in cursor.fetchall()}
-    return res_dict
+    cursor.execute('''
+        SELECT count_t.keyword_id, count_t.year, SUM(count_t.count)
+        FROM main_assistant_keywordyearcount count_t
+        JOIN main_assistant_keyword keyword_t
+            ON count_t.keyword_id = keyword_t.id
+        WHERE keyword_t.occurrence_count >= %s AND LENGTH(keyword_t.keyword) >= %s
+            AND count_t.year BETWEEN %s AND %s
+        GROUP BY count_t.keyword_id, count_t.year;
+    ''', [Keyword.objects.MIN_REFERENCE_COUNT, Keyword.objects.MIN_KEYWORD_LENGTH, first_year, last_year])
+    chunks = [np.zeros((0, 3), dtype=np.int64)]
+    rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+    while rows:
+        chunks.append(np.array(rows, dtype=np.int64))
+        rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+    rows = np.concatenate(chunks)
+    keyword_ids, keyword_indices = np.unique(rows[:, 0], return_inverse=True)
+    matrix = np.zeros((len(keyword_ids), last_year - first_year + 1))
+    np.add.at(matrix, (keyword_indices, rows[:, 1] - first_year), rows[:, 2])
+    return keyword_ids, matrix
+
+
+def compute_keyword_trends(matrix, year_totals):
+    # work on the keyword's share in all articles, so that the growth of the database itself is not a trend
+    shares = matrix / np.maximum(year_totals, 1)
+    recent = shares[:, -TREND_YEARS:]
+    # least squares fits of a + bt and a + bt + ct^2 to the recent years of every keyword at once,
+    # t = 0 is the last year
+    t = np.arange(1 - recent.shape[1], 1, dtype=float)
+    linear = np.linalg.pinv(np.stack([np.ones_like(t), t], axis=1)).dot(recent.T)
+    quadratic = np.linalg.pinv(np.stack([np.ones_like(t), t, t ** 2], axis=1)).dot(recent.T)
+    mean_share = recent.mean(axis=1)
+    scale = np.where(mean_share > 0, mean_share, 1)
+    growth = linear[1] / scale
+    acceleration = 2 * quadratic[2] / scale
+    recent_count = matrix[:, -TREND_YEARS:].sum(axis=1)
+    peak = shares.argmax(axis=1)
+    peak_share = shares[np.arange(len(shares)), peak]
+    current_share = np.maximum(quadratic[0], 0)
+    near_peak = current_share >= PEAK_RATIO * peak_share
+    phase = np.select(
+        [recent_count == 0,
+         (np.abs(growth) < PLATEAU_GROWTH) & (np.abs(acceleration) < PLATEAU_GROWTH),
+         near_peak & (growth > 0) & (acceleration >= 0),
+         near_peak,
+         growth < 0],
+        [HypePhase.trough_of_disillusionment.value,
+         HypePhase.plateau_of_productivity.value,
+         HypePhase.innovation_trigger.value,
+         HypePhase.peak_of_inflated_expectations.value,
+         HypePhase.trough_of_disillusionment.value],
+        default=HypePhase.slope_of_enlightenment.value)
+    score = growth * np.log1p(recent_count)
+    return {'score': score, 'growth': growth, 'acceleration': acceleration, 'phase': phase,
+            'recent_count': recent_count, 'peak': peak}
+
+
+def update_trending_keywords():
+    start = time.time()
+    last_year = date.today().year - 1
+    first_year = last_year - HISTORY_YEARS + 1
+    keyword_ids, matrix = export_keyword_year_matrix(first_year, last_year)
+    logger.debug('Exported %d keyword year series in %.5fs', len(keyword_ids), time.time() - start)
+    totals = get_yearly_article_totals()
+    year_totals = np.array([totals.get(year, 0) for year in range(first_year, last_year + 1)], dtype=float)
+    trends = compute_keyword_trends(matrix, year_totals)
+    order = np.argsort(-trends['score'], kind='mergesort')
+    entries = [TrendingKeyword(keyword_id=int(keyword_ids[i]), rank=rank, score=float(trends['score'][i]),
+                               growth=float(trends['growth'][i]), acceleration=float(trends['acceleration'][i]),
+                               phase=str(trends['phase'][i]), recent_count=int(trends['recent_count'][i]),
+                               peak_year=first_year + int(trends['peak'][i]))
+               for rank, i in enumerate(order)]
+    with transaction.atomic():
+        TrendingKeyword.objects.all().delete()
+        TrendingKeyword.objects.bulk_create(entries, batch_size=TRENDING_BATCH_SIZE)
+    logger.info('Computed trends of %d keywords in %.5fs', len(entries), time.time() - start)
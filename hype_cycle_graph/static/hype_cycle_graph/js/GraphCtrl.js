@@ -168,8 +168,8 @@ GraphCtrl = angular.module('pubAssistantClient').controller('GraphCtrl', ['$scop
         $scope.generateGraphData();
     };
 
-    $scope.fillDataForKeyword = function(keyword) {
-        params = {keyword: keyword.id};
+    $scope.graphDataParams = function(keywordIds) {
+        params = {keywords: keywordIds.join()};
         if (Object.keys($scope.selectedPublications).length > 0) {
             var publication_ids = [];
             for (var key in $scope.selectedPublications) {
@@ -178,24 +178,38 @@ GraphCtrl = angular.module('pubAssistantClient').controller('GraphCtrl', ['$scop
             }
             params['publications'] = publication_ids.join();
         }
+        return params;
+    };
+
+    $scope.fillDataForKeywords = function(keywords) {
+        if (keywords.length == 0) return;
+        var params = $scope.graphDataParams(keywords.map(function(keyword) { return keyword.id; }));
 //        $log.debug('"publications":' + params['publications']);
         $scope.publicationRequestError = false;
         $scope.graphDataRequestPending = true;
         $http.get(urls.graphDataUrl, {params: params}).then(
             function successCallback(response) {
                 $scope.graphDataRequestPending = false;
-                $scope.mergeSeriesData(keyword.keyword, response.data)
+                for (var i = 0; i < keywords.length; i++) {
+                    $scope.mergeSeriesData(keywords[i].keyword, response.data[keywords[i].id]);
+                }
             }, function failCallback(response) {
                 $scope.graphDataRequestPending = false;
                 $scope.publicationRequestError = true;
             });
     };
 
+    $scope.fillDataForKeyword = function(keyword) {
+        $scope.fillDataForKeywords([keyword]);
+    };
+
     $scope.refillData = function() {
         $scope.series = [];
         $scope.graph_object = {};
+        var keywords = [];
         for (key in $scope.selectedKeywords) {
-            $scope.fillDataForKeyword($scope.selectedKeywords[key])
+            keywords.push($scope.selectedKeywords[key]);
         }
+        $scope.fillDataForKeywords(keywords);
     }
 }]);
\ No newline at end of file
@@ -0,0 +1,13 @@
+from celery import shared_task
+
+
+@shared_task
+def update_trending_keywords_periodic():
+    from hype_cycle_graph.services import update_trending_keywords
+    update_trending_keywords()
+
+
+@shared_task
+def refresh_autocomplete_periodic():
+    from hype_cycle_graph.services import refresh_autocomplete
+    refresh_autocomplete()
@@ -1,3 +1,20 @@
-from django.test import TestCase
+import numpy as np
+from django.test import SimpleTestCase
 
-# Create your tests here.
+from hype_cycle_graph.models import HypePhase
+from hype_cycle_graph.services import compute_keyword_trends
+
+
+class KeywordTrendsTests(SimpleTestCase):
+    def test_compute_keyword_trends(self):
+        matrix = np.array([[0, 0, 0, 0, 1, 2, 4, 8, 16, 32],
+                           [0, 0, 0, 0, 32, 16, 8, 4, 2, 1],
+                           [10, 10, 10, 10, 10, 10, 10, 10, 10, 10],
+                           [0, 0, 0, 0, 1, 5, 10, 12, 12, 11]], dtype=float)
+        trends = compute_keyword_trends(matrix, np.full(matrix.shape[1], 100.0))
+        self.assertEqual([HypePhase.innovation_trigger.value, HypePhase.trough_of_disillusionment.value,
+                          HypePhase.plateau_of_productivity.value, HypePhase.peak_of_inflated_expectations.value],
+                         list(trends['phase']))
+        self.assertEqual(0, np.argmax(trends['score']))
+        self.assertLess(trends['growth'][1], 0)
+        self.assertEqual([9, 4, 0, 7], list(trends['peak']))
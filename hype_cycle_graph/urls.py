@@ -6,5 +6,6 @@ urlpatterns = [
     url(r'^keyword_search$', views.keyword_search, name='keyword_search'),
     url(r'^publication_search$', views.publication_search, name='publication_search'),
     url(r'^graph_data$', views.graph_data, name='graph_data'),
+    url(r'^trending_keywords$', views.trending_keywords, name='trending_keywords'),
     url(r'^graph_partial$', views.graph_partial, name='graph_partial'),
 ]
\ No newline at end of file
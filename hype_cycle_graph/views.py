@@ -1,23 +1,41 @@
 import logging
 
 from django.shortcuts import render
+from rest_framework import status
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 
-from main_assistant.serializers import KeywordSerializer, PublicationSerializer
-from hype_cycle_graph.services import search_keywords, get_hype_graph_data, search_publications
+from hype_cycle_graph.models import TrendingKeyword, HypePhase
+from hype_cycle_graph.serializers import TrendingKeywordSerializer
+from main_assistant.utils import RangeHeaderPaginator
+from hype_cycle_graph.services import search_keywords, get_hype_graph_data, search_publications, \
+    get_hype_graph_series
 
 logger = logging.getLogger(__name__)
 
+MAX_COMPARED_KEYWORDS = 50
+LIMIT_TRENDING_KEYWORDS = 100
+
 
 @api_view(['GET'])
 def graph_data(request, format=None):
     if request.method == 'GET':
         keyword_id = request.query_params.get('keyword')
+        keyword_ids = request.query_params.get('keywords')
         publication_ids = request.query_params.get('publications')
         if publication_ids:
             publication_ids = publication_ids.split(',')
-        data = get_hype_graph_data(keyword_id, publication_ids)
+        if keyword_ids is None:
+            data = get_hype_graph_data(keyword_id, publication_ids)
+            return Response(data)
+        try:
+            keyword_ids = [int(iden) for iden in keyword_ids.split(',')]
+        except (ValueError, TypeError):
+            return Response('keywords parameter not a list of ints', status=status.HTTP_400_BAD_REQUEST)
+        if len(keyword_ids) > MAX_COMPARED_KEYWORDS:
+            return Response('too many keywords', status=status.HTTP_400_BAD_REQUEST)
+        normalize = request.query_params.get('normalize') in ('1', 'true')
+        data = get_hype_graph_series(keyword_ids, publication_ids, normalize)
         return Response(data)
 
 
@@ -26,7 +44,7 @@ def keyword_search(request, format=None):
     if request.method == 'GET':
         query_text = request.query_params.get('query')
         keywords = search_keywords(query_text)
-        return Response(KeywordSerializer(keywords, many=True).data)
+        return Response([{'id': keyword['id'], 'keyword': keyword['keyword']} for keyword in keywords])
 
 
 @api_view(['GET'])
@@ -34,7 +52,22 @@ def publication_search(request, format=None):
     if request.method == 'GET':
         query_text = request.query_params.get('query')
         publications = search_publications(query_text)
-        return Response(PublicationSerializer(publications, many=True).data)
+        return Response([{'id': publication['id'], 'name': publication['name'],
+                          'identifier': publication['identifier']} for publication in publications])
+
+
+@api_view(['GET'])
+def trending_keywords(request, format=None):
+    trends = TrendingKeyword.objects.select_related('keyword').order_by('rank')
+    phase = request.query_params.get('phase')
+    if phase is not None:
+        try:
+            trends = trends.filter(phase=HypePhase[phase].value)
+        except KeyError:
+            return Response('unknown phase', status=status.HTTP_400_BAD_REQUEST)
+    if not request.META.get('HTTP_RANGE'):
+        trends = trends[0:LIMIT_TRENDING_KEYWORDS]
+    return RangeHeaderPaginator(trends, TrendingKeywordSerializer).get_response(request)
 
 
 def graph_partial(request):
@@ -0,0 +1,117 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import namedtuple
+
+from django.conf import settings
+
+from main_assistant.network import WebAccessService
+from main_assistant.utils import normalize_url
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_STATUSES = (200,)
+
+archived_response = namedtuple('archived_response', ['url', 'status', 'headers', 'content', 'session'])
+
+
+class ResponseArchive:
+    """Gzipped response bodies in files sharded by the hash of their normalized URL.
+
+    Every file holds a JSON line with the requested and final URL, status and headers, followed by the body.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, url):
+        digest = hashlib.sha1(normalize_url(url).encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:4], digest + '.gz')
+
+    def store(self, url, response):
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        meta = {'url': url, 'final_url': str(response.url), 'status': response.status,
+                'headers': {'Content-Type': response.headers.get('Content-Type', '')}, 'stored': time.time()}
+        # written aside and renamed, so that readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as f:
+                f.write(json.dumps(meta).encode())
+                f.write(b'\n')
+                f.write(response.content)
+            os.replace(temp_path, path)
+        except OSError:
+            os.unlink(temp_path)
+            raise
+
+    def load(self, url):
+        try:
+            with gzip.open(self.path(url), 'rb') as f:
+                meta = json.loads(f.readline().decode())
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        return archived_response(meta['final_url'], meta['status'], meta['headers'], content, None)
+
+
+class ArchivingWebAccess(WebAccessService):
+    """Wraps a web access service, archiving successful responses.
+
+    In 'record' mode every page is fetched and archived, in 'replay' mode archived pages are served from disk
+    and only the missing ones are fetched (and archived).
+    """
+    RECORD = 'record'
+    REPLAY = 'replay'
+
+    def __init__(self, web, archive, mode=RECORD):
+        # web may be a lazy object, it is only touched on use
+        self._web = web
+        self._archive = archive
+        self.mode = mode
+
+    @property
+    def timeout(self):
+        return self._web.timeout
+
+    @property
+    def user_agent(self):
+        return self._web.user_agent
+
+    async def get(self, address, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        if self.mode == self.REPLAY:
+            response = await loop.run_in_executor(None, self._archive.load, address)
+            if response is not None:
+                return response
+        response = await self._web.get(address, *args, **kwargs)
+        if getattr(response, 'status', None) in ARCHIVED_STATUSES and hasattr(response, 'content'):
+            try:
+                await loop.run_in_executor(None, self._archive.store, address, response)
+            except OSError:
+                logger.exception('Could not archive response of %s', address)
+        return response
+
+    async def get_session(self, *args, **kwargs):
+        return await self._web.get_session(*args, **kwargs)
+
+    def blacklist(self, session):
+        # replayed responses have no session
+        if session is not None:
+            self._web.blacklist(session)
+
+
+def archived(web):
+    """Wraps the web access service of a provider in an archive if RESPONSE_ARCHIVE_DIR is set.
+
+    main_assistant.services applies it to the web service of every provider at import, so it must not build
+    lazy services: isinstance would, it reads their __class__.
+    """
+    if not settings.RESPONSE_ARCHIVE_DIR or issubclass(type(web), ArchivingWebAccess):
+        return web
+    return ArchivingWebAccess(web, ResponseArchive(settings.RESPONSE_ARCHIVE_DIR), settings.RESPONSE_ARCHIVE_MODE)
@@ -0,0 +1,364 @@
+"""End to end scraping benchmark against a synthetic digital library and fake proxies on localhost.
+
+Pages, injected errors and proxy failures are derived from the seed and the request, so runs with the same
+parameters do the same work and their metrics can be compared; see the benchmark_scraper command.
+"""
+import asyncio
+import logging
+import random
+import time
+
+import aiohttp
+import aiohttp.server
+from aiohttp import web
+from django.db import connection
+from django_redis import get_redis_connection
+from lxml import html
+
+from main_assistant.db_executor import get_database_executor
+from main_assistant.ingestion import scraped_article
+from main_assistant.models import Article, Publication
+from main_assistant.network import ProxyListService, ProxySessionService, ProxyWebAccess, WebAccessService
+from main_assistant.services import BaseProvider, ScrapException
+from main_assistant.utils import ExtractionSpec, XPathField
+
+logger = logging.getLogger(__name__)
+
+HOST = '127.0.0.1'
+AUTHORS = 500
+KEYWORDS = 200
+REFERENCES_PER_ARTICLE = 10
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class SyntheticLibrary:
+    """aiohttp server of article pages /article/<number> with authors, keywords and references to other articles.
+
+    Every response is delayed by about latency seconds, error_rate of them fail with 500 and requests above
+    rate_limit per second are refused with 429 and a Retry-After header.
+    """
+
+    def __init__(self, articles, latency=0.05, error_rate=0.0, rate_limit=None, seed=0):
+        self.articles = articles
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.seed = seed
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+        self._attempts = {}
+        self._tokens = rate_limit
+        self._refilled = None
+        self._app = None
+        self._handler = None
+        self._server = None
+        self.url = None
+
+    async def start(self):
+        loop = asyncio.get_event_loop()
+        self._app = web.Application(loop=loop)
+        self._app.router.add_route('GET', '/', self.index)
+        self._app.router.add_route('GET', '/article/{number}', self.article)
+        self._handler = self._app.make_handler(access_log=None)
+        self._server = await loop.create_server(self._handler, HOST, 0)
+        self.url = 'http://{}:{}'.format(HOST, self._server.sockets[0].getsockname()[1])
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self._handler.finish_connections(1.0)
+        await self._app.finish()
+
+    def _take_token(self):
+        if self.rate_limit is None:
+            return True
+        now = time.time()
+        if self._refilled is not None:
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._refilled) * self.rate_limit)
+        self._refilled = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    async def index(self, request):
+        return web.Response(body=b'<html><body>synthetic library</body></html>',
+                            headers={'Content-Type': 'text/html; charset=utf-8'})
+
+    async def article(self, request):
+        self.requests += 1
+        number = int(request.match_info['number'])
+        attempt = self._attempts.get(number, 0)
+        self._attempts[number] = attempt + 1
+        # decisions depend on the request, not on the order in which concurrent requests arrive
+        rng = random.Random('{}:{}:{}'.format(self.seed, number, attempt))
+        await asyncio.sleep(self.latency * (0.5 + rng.random()))
+        if not self._take_token():
+            self.throttled += 1
+            return web.Response(status=429, headers={'Retry-After': '1'})
+        if rng.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=500)
+        if number >= self.articles:
+            return web.Response(status=404)
+        return web.Response(body=self.page(number).encode(), headers={'Content-Type': 'text/html; charset=utf-8'})
+
+    def page(self, number):
+        rng = random.Random('{}:{}'.format(self.seed, number))
+        authors = ''.join('<li class="author">Author {}</li>'.format(rng.randrange(AUTHORS))
+                          for _ in range(rng.randint(1, 4)))
+        keywords = ''.join('<li class="keyword">keyword {}</li>'.format(rng.randrange(KEYWORDS))
+                           for _ in range(rng.randint(2, 6)))
+        references = ''.join('<a class="reference" data-id="{0}" href="/article/{0}">[{0}]</a>'.format(referred)
+                             for referred in rng.sample(range(self.articles), min(REFERENCES_PER_ARTICLE,
+                                                                                  self.articles))
+                             if referred != number)
+        return '''<html><body>
+            <h1>Synthetic article {number}</h1>
+            <time datetime="{year}-{month:02d}-01"></time>
+            <ul>{authors}</ul>
+            <p class="abstract">{abstract}</p>
+            <ul>{keywords}</ul>
+            <div>{references}</div>
+        </body></html>'''.format(number=number, year=rng.randint(1990, 2016), month=rng.randint(1, 12),
+                                 authors=authors, keywords=keywords, references=references,
+                                 abstract=' '.join('word{}'.format(rng.randrange(1000)) for _ in range(150)))
+
+
+class FakeProxyProtocol(aiohttp.server.ServerHttpProtocol):
+    def __init__(self, proxy, **kwargs):
+        super().__init__(**kwargs)
+        self._proxy = proxy
+
+    async def handle_request(self, message, payload):
+        proxy = self._proxy
+        proxy.requests += 1
+        # the request line of a proxied request holds the absolute URL
+        attempt = proxy.attempts.get(message.path, 0)
+        proxy.attempts[message.path] = attempt + 1
+        rng = random.Random('{}:{}:{}'.format(proxy.seed, message.path, attempt))
+        await asyncio.sleep(proxy.latency * (0.5 + rng.random()))
+        if rng.random() < proxy.failure_rate:
+            proxy.failures += 1
+            self.transport.close()
+            return
+        async with proxy.session.get(message.path) as upstream:
+            body = await upstream.read()
+        response = aiohttp.Response(self.writer, upstream.status, http_version=message.version)
+        for header in ('Content-Type', 'Retry-After'):
+            if header in upstream.headers:
+                response.add_header(header, upstream.headers[header])
+        response.add_header('Content-Length', str(len(body)))
+        response.send_headers()
+        response.write(body)
+        await response.write_eof()
+        self.keep_alive(not message.should_close)
+
+
+class FakeProxy:
+    """HTTP proxy forwarding requests after about latency seconds, failure_rate of them are dropped.
+
+    attempts counts the requests of every URL. Sharing it between the proxies of a run makes the fate of the n-th
+    attempt at a URL independent of the proxy it goes through.
+    """
+
+    def __init__(self, index, latency=0.01, failure_rate=0.0, seed=0, attempts=None):
+        self.index = index
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.attempts = {} if attempts is None else attempts
+        self.requests = 0
+        self.failures = 0
+        self.session = None
+        self._server = None
+        self.url = None
+
+    async def start(self):
+        loop = asyncio.get_event_loop()
+        self.session = aiohttp.ClientSession(loop=loop)
+        self._server = await loop.create_server(lambda: FakeProxyProtocol(self, loop=loop), HOST, 0)
+        self.url = 'http://{}:{}'.format(HOST, self._server.sockets[0].getsockname()[1])
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        self.session.close()
+
+
+class LocalProxyListService(ProxyListService):
+    """Proxy list of the fake proxies only, tested against the synthetic library instead of the internet."""
+
+    def __init__(self, proxies, test_url, *args, **kwargs):
+        self._local_proxies = proxies
+        self.TEST_URL = test_url
+        super().__init__(*args, **kwargs)
+
+    async def _refresh_proxies(self):
+        for proxy in self._local_proxies:
+            self._add_proxy(ProxyWebAccess(proxy=proxy, test_url=self.TEST_URL, timeout=self.timeout))
+
+
+class TimingWebAccess(WebAccessService):
+    """Wraps a web access service, recording the duration of every get, retries included."""
+
+    def __init__(self, web):
+        super().__init__(timeout=web.timeout, user_agent=web.user_agent)
+        self._web = web
+        self.latencies = []
+
+    async def get(self, address, *args, **kwargs):
+        start = time.time()
+        try:
+            return await self._web.get(address, *args, **kwargs)
+        finally:
+            self.latencies.append(time.time() - start)
+
+    async def get_session(self, *args, **kwargs):
+        return await self._web.get_session(*args, **kwargs)
+
+    def blacklist(self, session):
+        self._web.blacklist(session)
+
+
+class SyntheticProvider(BaseProvider):
+    """Provider of the synthetic library, configured by run_benchmark."""
+    PROVIDER_NAME = 'Synthetic benchmark library'
+    URL_PATTERN = r'^http://127\.0\.0\.1:\d+/article/'
+    ARTICLES_PER_COROUTINE = 50
+    MAX_COROUTINES_ACTIVE = 8
+    SPEC = ExtractionSpec(title=XPathField('//h1/text()', strip=True),
+                          issue_date=XPathField('//time/@datetime'),
+                          authors=XPathField('//li[@class="author"]/text()', index=None),
+                          abstract=XPathField('//p[@class="abstract"]/text()', strip=True, default=''),
+                          keywords=XPathField('//li[@class="keyword"]/text()', index=None),
+                          references=XPathField('//a[@class="reference"]/@data-id', index=None))
+    web = None
+    library_url = None
+    total_articles = 0
+    publication_id = None
+
+    @classmethod
+    def update_status(cls):
+        library = cls.get_or_create()
+        library.total_articles = cls.total_articles
+        library.save(update_fields=['total_articles'])
+        cls.publication_id = Publication.objects.get_or_create(
+            identifier='synthetic', defaults={'name': cls.PROVIDER_NAME, 'location': cls.library_url,
+                                              'is_journal': True, 'digital_library': library})[0].pk
+        return True
+
+    @classmethod
+    def parse_document(cls, content, url):
+        record = cls.SPEC.extract(html.fromstring(content))
+        if record['title'] is None:
+            raise ScrapException('{} has no title'.format(url))
+        number = url.rsplit('/', 1)[-1]
+        return scraped_article('synthetic:' + number, number, record['title'], url, record['abstract'],
+                               record['issue_date'], None, record['authors'], record['keywords'],
+                               [(referred, True) for referred in record['references']])
+
+    @classmethod
+    async def download_article(cls, number):
+        response = await cls.web.get('{}/article/{}'.format(cls.library_url, number))
+        if getattr(response, 'status', None) != 200:
+            raise ScrapException('article {} not fetched'.format(number))
+        await cls.add_single_document(response)
+
+    @classmethod
+    async def add_single_document(cls, document_r):
+        """Parses a fetched article page and hands the record to the writer, returns it."""
+        document = (await cls.parse(document_r))._replace(publication_id=cls.publication_id)
+        await cls.get_writer().add(document)
+        return document
+
+    @classmethod
+    async def add_referenced_document(cls, document_r):
+        document = await cls.add_single_document(document_r)
+        # the referring article needs the saved one
+        await cls.get_writer().flush()
+        return await get_database_executor().run(Article.objects.get, identifier=document.identifier)
+
+
+def rows_written():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_stat_clear_snapshot();')
+        cursor.execute('''
+            SELECT tup_inserted + tup_updated + tup_deleted
+            FROM pg_stat_database
+            WHERE datname = current_database();
+        ''')
+        return cursor.fetchone()[0]
+
+
+def clear_leases():
+    redis = get_redis_connection('default')
+    keys = redis.keys('scraping_lease*:{}*'.format(SyntheticProvider.PROVIDER_NAME))
+    if keys:
+        redis.delete(*keys)
+
+
+async def run_benchmark(articles=1000, latency=0.05, error_rate=0.0, rate_limit=None, proxies=4, proxy_latency=0.01,
+                        proxy_failure_rate=0.0, seed=0):
+    """Scrapes the whole synthetic library through the fake proxies into the current database, returns metrics."""
+    loop = asyncio.get_event_loop()
+    executor = get_database_executor()
+    library = SyntheticLibrary(articles, latency, error_rate, rate_limit, seed)
+    proxy_attempts = {}
+    fake_proxies = [FakeProxy(index, proxy_latency, proxy_failure_rate, seed, proxy_attempts)
+                    for index in range(proxies)]
+    await library.start()
+    for proxy in fake_proxies:
+        await proxy.start()
+    try:
+        proxy_service = LocalProxyListService([proxy.url for proxy in fake_proxies], library.url + '/')
+        web = TimingWebAccess(ProxySessionService(proxy_service, timeout=ProxyListService.DEFAULT_TIMEOUT,
+                                                  rng=random.Random(seed)))
+        SyntheticProvider.web = web
+        SyntheticProvider.library_url = library.url
+        SyntheticProvider.total_articles = articles
+        await loop.run_in_executor(None, clear_leases)
+        await executor.run(SyntheticProvider.update_status)
+        written_before = await executor.run(rows_written)
+        calls_before = executor.stats()['completed']
+        start = time.time()
+        await SyntheticProvider.download_articles_coroutine()
+        elapsed = time.time() - start
+        # the statistics collector lags behind the writes
+        await asyncio.sleep(1)
+        written = await executor.run(rows_written) - written_before
+        calls = executor.stats()['completed'] - calls_before
+        saved = await executor.run(Article.objects.filter(publication_id=SyntheticProvider.publication_id).count)
+    finally:
+        for proxy in fake_proxies:
+            await proxy.stop()
+        await library.stop()
+    fetched = len(library._attempts)
+    return {
+        'parameters': {'articles': articles, 'latency': latency, 'error_rate': error_rate, 'rate_limit': rate_limit,
+                       'proxies': proxies, 'proxy_latency': proxy_latency, 'proxy_failure_rate': proxy_failure_rate,
+                       'seed': seed},
+        'elapsed': elapsed,
+        'articles_saved': saved,
+        'articles_per_s': saved / elapsed,
+        'fetches': len(web.latencies),
+        'fetch_latency_p50': percentile(web.latencies, 0.5),
+        'fetch_latency_p99': percentile(web.latencies, 0.99),
+        'server_requests': library.requests,
+        'server_errors': library.errors,
+        'server_throttled': library.throttled,
+        'proxy_requests': sum(proxy.requests for proxy in fake_proxies),
+        'proxy_failures': sum(proxy.failures for proxy in fake_proxies),
+        'retries': library.requests - fetched + sum(proxy.failures for proxy in fake_proxies),
+        'db_calls': calls,
+        'db_calls_per_s': calls / elapsed,
+        'db_rows_written': written,
+        'db_rows_written_per_s': written / elapsed,
+    }
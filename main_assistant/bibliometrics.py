@@ -0,0 +1,108 @@
+import io
+import logging
+import time
+
+import numpy as np
+from django.db import connection, transaction
+
+from main_assistant.citation_graph import get_citation_graph, build_citation_graph, fetch_array
+
+logger = logging.getLogger(__name__)
+
+DAMPING = 0.85
+TOLERANCE = 1e-10
+MAX_ITERATIONS = 100
+
+
+def h_indexes(article_authors, citations):
+    """Returns the h-index and the total citation count of every author (column) of the incidence matrix."""
+    pairs = article_authors.tocoo()
+    authors = pairs.col
+    article_citations = citations[pairs.row]
+    # group by author, most cited articles first, then number the articles within each group
+    order = np.lexsort((-article_citations, authors))
+    authors = authors[order]
+    article_citations = article_citations[order]
+    group_starts = np.flatnonzero(np.r_[True, authors[1:] != authors[:-1]])
+    group_sizes = np.diff(np.r_[group_starts, len(authors)])
+    ranks = np.arange(len(authors)) - np.repeat(group_starts, group_sizes) + 1
+    qualifying = article_citations >= ranks
+    h = np.zeros(article_authors.shape[1], dtype=np.int64)
+    np.maximum.at(h, authors[qualifying], ranks[qualifying])
+    totals = np.bincount(authors, weights=article_citations, minlength=article_authors.shape[1]).astype(np.int64)
+    return h, totals
+
+
+def pagerank(cites, nodes, damping=DAMPING, tolerance=TOLERANCE, max_iterations=MAX_ITERATIONS):
+    """Power iteration over the citation matrix; nodes is a boolean mask of existing articles."""
+    out_degree = np.asarray(cites.sum(axis=1)).ravel()
+    inverse_degree = np.where(out_degree > 0, 1.0 / np.maximum(out_degree, 1), 0.0)
+    dangling = nodes & (out_degree == 0)
+    teleport = nodes / nodes.sum()
+    cited_by = cites.T.tocsr()
+    rank = teleport.copy()
+    for iteration in range(max_iterations):
+        new_rank = damping * cited_by.dot(rank * inverse_degree) \
+                   + (damping * rank[dangling].sum() + 1 - damping) * teleport
+        change = np.abs(new_rank - rank).sum()
+        rank = new_rank
+        if change < tolerance:
+            break
+    logger.debug('PageRank finished after %d iterations, change %g', iteration + 1, change)
+    return rank
+
+
+def copy_rows(table, columns, rows):
+    data = io.StringIO()
+    for row in rows:
+        data.write('\t'.join(str(value) for value in row))
+        data.write('\n')
+    data.seek(0)
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {};'.format(table))
+        cursor.copy_from(data, table, columns=columns)
+
+
+def update_bibliometrics():
+    start = time.time()
+    graph = get_citation_graph()
+    # the loaded graph may lag the tables by a refresh period
+    if graph is None or not graph.refresh():
+        graph = build_citation_graph()
+    cites = graph.matrix('cites')
+    article_authors = graph.matrix('article_authors')
+    rows = fetch_array('''
+        SELECT id, COALESCE(publication_id, -1)
+        FROM main_assistant_article;
+    ''', [], 2)
+    # articles past the graph's id headroom have no references yet, they are picked up after the next rebuild
+    rows = rows[rows[:, 0] < graph.article_count]
+    article_ids, publication_ids = rows[:, 0], rows[:, 1]
+    if len(article_ids) == 0:
+        return
+    nodes = np.zeros(graph.article_count, dtype=bool)
+    nodes[article_ids] = True
+    citations = np.asarray(cites.sum(axis=0)).ravel()
+
+    h, author_citations = h_indexes(article_authors, citations)
+    authors = np.flatnonzero(np.diff(article_authors.tocsc().indptr))
+    ranks = pagerank(cites, nodes)
+    published = publication_ids >= 0
+    publication_count = int(publication_ids.max()) + 1 if published.any() else 0
+    publication_ranks = np.bincount(publication_ids[published], weights=ranks[article_ids[published]],
+                                    minlength=publication_count)
+    publication_citations = np.bincount(publication_ids[published], weights=citations[article_ids[published]],
+                                        minlength=publication_count)
+    publications = np.unique(publication_ids[published])
+    logger.info('Computed bibliometric indicators in %.5fs', time.time() - start)
+
+    with transaction.atomic():
+        copy_rows('main_assistant_authormetrics', ('author_id', 'h_index', 'citations'),
+                  zip(authors, h[authors], author_citations[authors]))
+        copy_rows('main_assistant_articlemetrics', ('article_id', 'pagerank'),
+                  zip(article_ids, ranks[article_ids]))
+        copy_rows('main_assistant_publicationmetrics', ('publication_id', 'pagerank', 'citations'),
+                  zip(publications, publication_ranks[publications],
+                      publication_citations[publications].astype(np.int64)))
+    logger.info('Stored bibliometric indicators of %d authors, %d articles and %d publications in %.5fs',
+                len(authors), len(article_ids), len(publications), time.time() - start)
@@ -0,0 +1,401 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+FETCH_CHUNK_SIZE = 100000
+# spare rows and columns, so that articles and authors added after a snapshot fit into the delta matrices
+ID_HEADROOM = 1.1
+MAX_DELTA_REFERENCES = 1000000
+REFRESH_PERIOD = 60
+MATRIX_NAMES = ('cites', 'article_authors')
+# how long a row may take to commit after taking its id, and how many ids back a new snapshot reads again
+IN_FLIGHT_WINDOW = 10 * 60
+SNAPSHOT_ID_TAIL = 100000
+INVALIDATED_KEY = 'citation_graph_invalidated'
+
+
+def fetch_array(query, params, columns):
+    """Returns the integer rows of query as an int64 array of the given number of columns."""
+    cursor = connection.cursor()
+    cursor.execute(query, params)
+    chunks = [np.zeros((0, columns), dtype=np.int64)]
+    rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+    while rows:
+        chunks.append(np.array(rows, dtype=np.int64))
+        rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+    return np.concatenate(chunks)
+
+
+def fetch_pairs(query, params):
+    """Returns the (id, first column, second column) rows of query as three int64 arrays."""
+    rows = fetch_array(query, params, 3)
+    return rows[:, 0], rows[:, 1], rows[:, 2]
+
+
+def fetch_references(after_id=0):
+    return fetch_pairs('''
+        SELECT id, referring_id, referred_id
+        FROM main_assistant_reference
+        WHERE id > %s;
+    ''', [after_id])
+
+
+def fetch_authorships(after_id=0):
+    return fetch_pairs('''
+        SELECT id, article_id, author_id
+        FROM main_assistant_article_authors
+        WHERE id > %s;
+    ''', [after_id])
+
+
+def max_id(ids):
+    return int(ids.max()) if len(ids) else 0
+
+
+def invalidate_citation_graph():
+    """Makes the graphs of the snapshots built until now stale, for rows removed from the reference tables."""
+    cache.set(INVALIDATED_KEY, time.time(), timeout=None)
+
+
+class RowCursor:
+    """Id watermark of a table read repeatedly, which does not skip rows committed below ids read already.
+
+    Ids are taken from the sequence on insert but rows become visible on commit, so a slow transaction may add
+    a row below the greatest id read. The watermark trails by IN_FLIGHT_WINDOW: it is the greatest id of the
+    read made that long ago, and the rows above it are read again (the caller recognises them by content).
+    """
+
+    def __init__(self, watermark):
+        self.watermark = watermark
+        self._reads = []
+
+    def read(self, ids, now):
+        """Records a read of the rows above the watermark with the given ids."""
+        greatest = max(max_id(ids), self._reads[-1][1] if self._reads else self.watermark)
+        self._reads.append((now, greatest))
+        while now - self._reads[0][0] >= IN_FLIGHT_WINDOW:
+            self.watermark = max(self.watermark, self._reads.pop(0)[1])
+
+
+def save_matrix(path, name, matrix):
+    for part in ('data', 'indices', 'indptr'):
+        np.save(os.path.join(path, '{}_{}.npy'.format(name, part)), getattr(matrix, part))
+
+
+def load_matrix(path, name, shape):
+    """Memory-maps a CSR matrix written by save_matrix."""
+    parts = [np.load(os.path.join(path, '{}_{}.npy'.format(name, part)), mmap_mode='r')
+             for part in ('data', 'indices', 'indptr')]
+    return sparse.csr_matrix(tuple(parts), shape=shape, copy=False)
+
+
+@contextmanager
+def snapshot_lock(directory):
+    """Serializes building and saving snapshots in directory between processes."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def incidence_matrix(rows, columns, shape):
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int32), (rows, columns)), shape=shape)
+    matrix.sum_duplicates()
+    return matrix
+
+
+class CitationGraph:
+    """Citation graph held in CSR adjacency matrices.
+
+    cites is the article x article matrix of references, article_authors the article x author incidence matrix.
+    Both are stored in a snapshot (memory-mapped on load) and a small in-memory delta, which collects rows
+    added to the database afterwards; queries multiply by both parts. The snapshot keeps the transposed matrices
+    too, so that no process copies the whole graph to follow references backwards. A graph whose delta outgrew
+    it is stale, until a rebuilt snapshot replaces it. So is a graph invalidated after it was built, since
+    refreshes only add rows.
+    """
+
+    def __init__(self, base, reference_watermark, authorship_watermark, built, base_transposed=None):
+        self._base = base
+        self._reference_cursor = RowCursor(reference_watermark)
+        self._authorship_cursor = RowCursor(authorship_watermark)
+        self._built = built
+        self._delta = {name: sparse.csr_matrix(matrix.shape, dtype=np.int32) for name, matrix in base.items()}
+        self._delta_references = 0
+        self._base_transposed = base_transposed or {}
+        self._delta_transposed = {}
+        self._refreshed = time.time()
+        self._stale = False
+        self._snapshot_path = None
+
+    @property
+    def article_count(self):
+        return self._base['cites'].shape[0]
+
+    @property
+    def author_count(self):
+        return self._base['article_authors'].shape[1]
+
+    @classmethod
+    def build(cls):
+        start = time.time()
+        reference_ids, referring, referred = fetch_references()
+        authorship_ids, articles, authors = fetch_authorships()
+        article_count = int(max(max_id(referring), max_id(referred), max_id(articles)) * ID_HEADROOM) + 1
+        author_count = int(max_id(authors) * ID_HEADROOM) + 1
+        base = {
+            'cites': incidence_matrix(referring, referred, (article_count, article_count)),
+            'article_authors': incidence_matrix(articles, authors, (article_count, author_count)),
+        }
+        # transactions still in flight may commit rows below the greatest ids read
+        graph = cls(base, max(0, max_id(reference_ids) - SNAPSHOT_ID_TAIL),
+                    max(0, max_id(authorship_ids) - SNAPSHOT_ID_TAIL), start)
+        logger.info('Built citation graph of %d references and %d authorships in %.5fs', len(reference_ids),
+                    len(authorship_ids), time.time() - start)
+        return graph
+
+    def save(self, directory):
+        """Writes a new snapshot version and atomically points directory/current at it.
+
+        The caller holds snapshot_lock(directory), so the versions older than this one are no longer current.
+        """
+        version = str(int(time.time() * 1000))
+        path = os.path.join(directory, version)
+        os.makedirs(path)
+        meta = {'reference_watermark': self._reference_cursor.watermark,
+                'authorship_watermark': self._authorship_cursor.watermark, 'built': self._built, 'shapes': {}}
+        for name in MATRIX_NAMES:
+            matrix = self.matrix(name)
+            meta['shapes'][name] = matrix.shape
+            save_matrix(path, name, matrix)
+            save_matrix(path, name + '_transposed', matrix.T.tocsr())
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        link = os.path.join(directory, 'current')
+        temporary_link = '{}.{}.tmp'.format(link, uuid.uuid4().hex)
+        os.symlink(version, temporary_link)
+        os.replace(temporary_link, link)
+        # other processes may still have the old files mapped, unlinking them is safe nevertheless
+        for old_version in os.listdir(directory):
+            if old_version.isdigit() and int(old_version) < int(version):
+                shutil.rmtree(os.path.join(directory, old_version), ignore_errors=True)
+        self._snapshot_path = os.path.realpath(path)
+
+    @classmethod
+    def load(cls, directory):
+        path = os.path.realpath(os.path.join(directory, 'current'))
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        base, base_transposed = {}, {}
+        for name in MATRIX_NAMES:
+            shape = tuple(meta['shapes'][name])
+            base[name] = load_matrix(path, name, shape)
+            base_transposed[name] = load_matrix(path, name + '_transposed', shape[::-1])
+        graph = cls(base, meta['reference_watermark'], meta['authorship_watermark'], meta['built'], base_transposed)
+        graph._snapshot_path = path
+        return graph
+
+    @property
+    def snapshot_path(self):
+        return self._snapshot_path
+
+    def refresh(self):
+        """Adds references and authorships inserted since the last refresh. Returns False if a rebuild is needed."""
+        now = time.time()
+        invalidated = cache.get(INVALIDATED_KEY)
+        if invalidated is not None and invalidated >= self._built:
+            self._stale = True
+            return False
+        reference_ids, referring, referred = fetch_references(self._reference_cursor.watermark)
+        authorship_ids, articles, authors = fetch_authorships(self._authorship_cursor.watermark)
+        self._refreshed = now
+        if max(max_id(referring), max_id(referred), max_id(articles)) >= self.article_count \
+                or max_id(authors) >= self.author_count:
+            self._stale = True
+            return False
+        # rows above the watermarks were partly read before, both tables hold distinct pairs
+        new_references = self._missing('cites', referring, referred)
+        new_authorships = self._missing('article_authors', articles, authors)
+        if self._delta_references + int(new_references.sum()) > MAX_DELTA_REFERENCES:
+            self._stale = True
+            return False
+        if new_references.any():
+            self._delta['cites'] = self._delta['cites'] + incidence_matrix(
+                referring[new_references], referred[new_references], self._base['cites'].shape)
+            self._delta_references += int(new_references.sum())
+            self._delta_transposed.pop('cites', None)
+        if new_authorships.any():
+            self._delta['article_authors'] = self._delta['article_authors'] + incidence_matrix(
+                articles[new_authorships], authors[new_authorships], self._base['article_authors'].shape)
+            self._delta_transposed.pop('article_authors', None)
+        self._reference_cursor.read(reference_ids, now)
+        self._authorship_cursor.read(authorship_ids, now)
+        return True
+
+    def _missing(self, name, rows, columns):
+        """Mask of the (row, column) entries which are zero in both parts of a matrix."""
+        if not len(rows):
+            return np.zeros(0, dtype=bool)
+        present = np.asarray(self._base[name][rows, columns]).ravel() \
+            + np.asarray(self._delta[name][rows, columns]).ravel()
+        return present == 0
+
+    @property
+    def refreshed(self):
+        return self._refreshed
+
+    @property
+    def stale(self):
+        return self._stale
+
+    def matrix(self, name):
+        """Whole 'cites' or 'article_authors' matrix, snapshot and delta summed."""
+        return (self._base[name] + self._delta[name]).tocsr()
+
+    def _parts(self, name, transposed=False):
+        if not transposed:
+            return self._base[name], self._delta[name]
+        # a built graph transposes its snapshot part once, the delta part again after every refresh that changed it
+        if name not in self._base_transposed:
+            self._base_transposed[name] = self._base[name].T.tocsr()
+        if name not in self._delta_transposed:
+            self._delta_transposed[name] = self._delta[name].T.tocsr()
+        return self._base_transposed[name], self._delta_transposed[name]
+
+    def _multiply(self, vector, name, transposed=False):
+        """Product of a 1 x n sparse row vector and a matrix (both of its parts)."""
+        base, delta = self._parts(name, transposed)
+        return (vector.dot(base) + vector.dot(delta)).tocsr()
+
+    def _author_articles(self, author_id):
+        base, delta = self._parts('article_authors', transposed=True)
+        return (base[author_id] + delta[author_id]).tocsr()
+
+    def _has_article(self, article_id):
+        return 0 <= article_id < self.article_count
+
+    def _article_vector(self, article_id):
+        return sparse.csr_matrix(([1], ([0], [article_id])), shape=(1, self.article_count), dtype=np.int32)
+
+    @staticmethod
+    def _to_dict(vector):
+        vector = vector.tocsr()
+        vector.sum_duplicates()
+        return {int(i): int(v) for i, v in zip(vector.indices, vector.data) if v}
+
+    def referred_authors(self, author_id):
+        """author id -> number of references from author_id's articles to that author's articles."""
+        cited_articles = self._multiply(self._author_articles(author_id), 'cites')
+        return self._to_dict(self._multiply(cited_articles, 'article_authors'))
+
+    def referring_authors(self, author_id):
+        """author id -> number of references from that author's articles to author_id's articles."""
+        citing_articles = self._multiply(self._author_articles(author_id), 'cites', transposed=True)
+        return self._to_dict(self._multiply(citing_articles, 'article_authors'))
+
+    def coreferrers(self, author_id):
+        """(author id, references, backreferences, score) tuples ordered like find_coreferrers."""
+        if not 0 <= author_id < self.author_count:
+            return []
+        references = self.referred_authors(author_id)
+        backreferences = self.referring_authors(author_id)
+        backreferences.pop(author_id, None)
+        results = []
+        for coreferrer_id in references.keys() & backreferences.keys():
+            ref_count, backref_count = references[coreferrer_id], backreferences[coreferrer_id]
+            results.append((coreferrer_id, ref_count, backref_count,
+                            (ref_count + backref_count) * ref_count * backref_count))
+        results.sort(key=lambda x: (-x[3], x[0]))
+        return results
+
+    def cocited_articles(self, article_id):
+        """article id -> number of articles citing both article_id and that article."""
+        if not self._has_article(article_id):
+            return {}
+        citing = self._multiply(self._article_vector(article_id), 'cites', transposed=True)
+        cocited = self._to_dict(self._multiply(citing, 'cites'))
+        cocited.pop(article_id, None)
+        return cocited
+
+    def coupled_articles(self, article_id):
+        """article id -> number of references article_id shares with that article (bibliographic coupling)."""
+        if not self._has_article(article_id):
+            return {}
+        cited = self._multiply(self._article_vector(article_id), 'cites')
+        coupled = self._to_dict(self._multiply(cited, 'cites', transposed=True))
+        coupled.pop(article_id, None)
+        return coupled
+
+    def citation_distance(self, source_id, target_id, max_depth=6):
+        """Length of the shortest undirected citation path between two articles, None if longer than max_depth.
+
+        Articles added after the snapshot past its id headroom are not in the graph, so they are not reached.
+        """
+        if not self._has_article(source_id) or not self._has_article(target_id):
+            return None
+        visited = self._article_vector(source_id)
+        frontier = visited
+        for depth in range(1, max_depth + 1):
+            reached = self._multiply(frontier, 'cites') + self._multiply(frontier, 'cites', transposed=True)
+            reached = reached.tocsr()
+            reached.data[:] = 1
+            frontier = (reached - reached.multiply(visited)).tocsr()
+            frontier.eliminate_zeros()
+            if frontier.nnz == 0:
+                return None
+            if frontier[0, target_id]:
+                return depth
+            visited = (visited + frontier).tocsr()
+        return None
+
+
+citation_graph = None
+
+
+def build_citation_graph():
+    """Builds and saves a new snapshot. Scans the reference tables, so it belongs to tasks and commands."""
+    global citation_graph
+    with snapshot_lock(settings.CITATION_GRAPH_DIR):
+        graph = CitationGraph.build()
+        graph.save(settings.CITATION_GRAPH_DIR)
+    citation_graph = graph
+    return graph
+
+
+def get_citation_graph():
+    """Returns the graph of the current snapshot, refreshed every REFRESH_PERIOD.
+
+    Never builds one, that is left to rebuild_citation_graph_periodic: returns None while there is no snapshot
+    or the graph is stale (see invalidate_citation_graph), and callers fall back to querying the database.
+    """
+    global citation_graph
+    current_path = os.path.realpath(os.path.join(settings.CITATION_GRAPH_DIR, 'current'))
+    if (citation_graph is None or citation_graph.snapshot_path != current_path) and os.path.exists(current_path):
+        try:
+            citation_graph = CitationGraph.load(settings.CITATION_GRAPH_DIR)
+            logger.debug('Loaded citation graph snapshot %s', citation_graph.snapshot_path)
+        except (FileNotFoundError, KeyError):
+            # replaced while loading, or written by an older version until the next rebuild
+            logger.debug('Could not load citation graph snapshot %s', current_path)
+    if citation_graph is None:
+        return None
+    if not citation_graph.stale and time.time() - citation_graph.refreshed >= REFRESH_PERIOD \
+            and not citation_graph.refresh():
+        logger.info('Citation graph delta too large or invalidated, waiting for a rebuilt snapshot')
+    return None if citation_graph.stale else citation_graph
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import OperationalError, close_old_connections, connection
+from psycopg2 import errorcodes
+
+logger = logging.getLogger(__name__)
+
+RETRIED_ERRORS = (errorcodes.SERIALIZATION_FAILURE, errorcodes.DEADLOCK_DETECTED)
+MAX_RETRIES = 3
+STATS_KEY_PREFIX = 'db_executor_stats:'
+STATS_PUBLISH_PERIOD = 10
+STATS_TIMEOUT = 5 * 60
+
+
+def call_with_retries(fn, *args, **kwargs):
+    """Calls fn, repeating it when its transaction is rolled back by a serialization failure or a deadlock."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            return fn(*args, **kwargs)
+        except OperationalError as e:
+            if attempt == MAX_RETRIES or getattr(e.__cause__, 'pgcode', None) not in RETRIED_ERRORS:
+                raise
+            logger.debug('Retrying %s after %s', getattr(fn, '__name__', fn), e)
+
+
+class DatabaseExecutor:
+    """Thread pool for the blocking database calls of the scraper, one connection per thread.
+
+    At most max_workers calls run and max_queued wait for a thread; further callers are suspended in run until
+    a place frees up, which pauses the download coroutines instead of piling parsed pages up in memory.
+    """
+
+    def __init__(self, max_workers, max_queued):
+        self.max_workers = max_workers
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = None
+        self._loop = None
+        self._in_flight = 0
+        self._waiting = 0
+        self._completed = 0
+        self._wait_time = 0.0
+        self._queue_time = 0.0
+        self._max_wait_time = 0.0
+        self._published = 0
+
+    def _get_slots(self):
+        loop = asyncio.get_event_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.max_workers + self.max_queued, loop=loop)
+        return self._slots
+
+    async def run(self, fn, *args, **kwargs):
+        slots = self._get_slots()
+        self._waiting += 1
+        start = time.time()
+        try:
+            await slots.acquire()
+        finally:
+            self._waiting -= 1
+        submitted = time.time()
+        wait_time = submitted - start
+        self._wait_time += wait_time
+        self._max_wait_time = max(self._max_wait_time, wait_time)
+        self._in_flight += 1
+        started = None
+
+        def call():
+            nonlocal started
+            started = time.time()
+            # pool threads outlive requests, so the per-request cleanup of broken or expired connections is done here
+            close_old_connections()
+            return call_with_retries(fn, *args, **kwargs)
+
+        try:
+            return await self._loop.run_in_executor(self._executor, call)
+        finally:
+            slots.release()
+            self._in_flight -= 1
+            self._completed += 1
+            self._queue_time += (started or time.time()) - submitted
+            self._publish_stats()
+
+    def stats(self):
+        completed = max(self._completed, 1)
+        return {
+            'workers': self.max_workers,
+            'max_queued': self.max_queued,
+            'running': min(self._in_flight, self.max_workers),
+            'queued': max(self._in_flight - self.max_workers, 0),
+            'waiting': self._waiting,
+            'completed': self._completed,
+            'average_wait_time': self._wait_time / completed,
+            'max_wait_time': self._max_wait_time,
+            'average_queue_time': self._queue_time / completed,
+        }
+
+    def shutdown(self):
+        """Closes the database connections of the worker threads and stops them."""
+        # the barrier makes every worker thread take exactly one of the calls
+        barrier = threading.Barrier(self.max_workers)
+
+        def close():
+            barrier.wait()
+            connection.close()
+
+        for future in [self._executor.submit(close) for _ in range(self.max_workers)]:
+            future.result()
+        self._executor.shutdown()
+
+    def _publish_stats(self):
+        now = time.time()
+        if now - self._published >= STATS_PUBLISH_PERIOD:
+            self._published = now
+            cache.set('{}{}:{}'.format(STATS_KEY_PREFIX, socket.gethostname(), os.getpid()), self.stats(),
+                      timeout=STATS_TIMEOUT)
+
+
+def published_stats():
+    """Last stats published by the executors of all scraping processes, keyed by host:pid."""
+    stats = cache.get_many(cache.keys(STATS_KEY_PREFIX + '*'))
+    return {key[len(STATS_KEY_PREFIX):]: value for key, value in stats.items()}
+
+
+database_executor = None
+
+
+def get_database_executor():
+    global database_executor
+    if database_executor is None:
+        database_executor = DatabaseExecutor(settings.SCRAPER_DB_WORKERS, settings.SCRAPER_DB_QUEUE)
+    return database_executor
+
+
+def close_database_executor():
+    global database_executor
+    if database_executor is not None:
+        database_executor.shutdown()
+        database_executor = None
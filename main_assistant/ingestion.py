@@ -0,0 +1,358 @@
+import asyncio
+import logging
+import time
+from collections import namedtuple, Counter, OrderedDict
+
+from django.db import connection, transaction
+
+from main_assistant.citation_graph import invalidate_citation_graph
+from main_assistant.db_executor import get_database_executor
+from main_assistant.known_documents import remember_documents
+from main_assistant.models import DigitalLibrary, KeywordYearCount, PublicationYearCount, Reference
+
+logger = logging.getLogger(__name__)
+
+# arbitrary first key of the advisory locks serializing inserts of an author name, Author.full_name is not unique
+AUTHOR_LOCK_KEY = 7301
+BATCH_SIZE = 500
+# scraped columns of a replaced article; the denormalized citation counts are kept
+REPLACE_ARTICLE_SQL = '''
+    DO UPDATE SET internal_identifier = EXCLUDED.internal_identifier, title = EXCLUDED.title,
+                  location = EXCLUDED.location, abstract = EXCLUDED.abstract, issue_date = EXCLUDED.issue_date,
+                  publication_id = EXCLUDED.publication_id
+'''
+
+# authors and keywords are lists of names, references a list of (location, is internal identifier) pairs
+scraped_article = namedtuple('scraped_article',
+                             ['identifier', 'internal_identifier', 'title', 'location', 'abstract', 'issue_date',
+                              'publication_id', 'authors', 'keywords', 'references'])
+
+
+def values_sql(rows):
+    """VALUES list placeholders and flat arguments for a list of equally long tuples."""
+    placeholders = ','.join('({})'.format(','.join('%s' for _ in row)) for row in rows)
+    return placeholders, [value for row in rows for value in row]
+
+
+def insert_articles(cursor, documents, replace=False):
+    """Inserts articles not saved yet, returns identifier -> id of the inserted ones.
+
+    If replace is set, saved articles are overwritten with the scraped data and returned too.
+    """
+    values, arguments = values_sql([(d.identifier, d.internal_identifier or '', d.title, d.location,
+                                     d.abstract or '', d.issue_date, d.publication_id) for d in documents])
+    cursor.execute('''
+        INSERT INTO main_assistant_article (identifier, internal_identifier, title, location, abstract, issue_date,
+                                            publication_id, cited_count, references_count)
+        SELECT identifier, internal_identifier, title, location, abstract, issue_date::date, publication_id::integer,
+               0, 0
+        FROM (VALUES {}) AS input_t (identifier, internal_identifier, title, location, abstract, issue_date,
+                                     publication_id)
+        ON CONFLICT (identifier) {}
+        RETURNING identifier, id;
+    '''.format(values, REPLACE_ARTICLE_SQL if replace else 'DO NOTHING'), arguments)
+    return dict(cursor.fetchall())
+
+
+def detach_articles(cursor, documents):
+    """Unlinks the keywords and authors of saved articles about to be replaced, with their share of the keyword
+    occurrence counts and the year summaries, so that they are added again like new articles.
+    """
+    cursor.execute('''
+        SELECT id
+        FROM main_assistant_article
+        WHERE identifier IN %s;
+    ''', [tuple(d.identifier for d in documents)])
+    article_ids = tuple(row[0] for row in cursor.fetchall())
+    if not article_ids:
+        return
+    # loaded citation graphs cannot drop the deleted authorships, they wait for a rebuilt snapshot
+    invalidate_citation_graph()
+    KeywordYearCount.objects.remove_articles(article_ids)
+    PublicationYearCount.objects.remove_articles(article_ids)
+    cursor.execute('''
+        WITH unlinked_t AS (
+            DELETE FROM main_assistant_article_keywords
+            WHERE article_id IN %s
+            RETURNING keyword_id
+        )
+        INSERT INTO main_assistant_keywordoccurrencedelta (keyword_id, delta)
+        SELECT keyword_id, -COUNT(*)
+        FROM unlinked_t
+        GROUP BY keyword_id;
+        DELETE FROM main_assistant_article_authors
+        WHERE article_id IN %s;
+    ''', [article_ids, article_ids])
+
+
+def upsert_keywords(cursor, counts):
+    """Inserts new keywords with their counts and appends deltas for the others, returns keyword -> id.
+
+    Saved keywords are not updated, popular ones would otherwise serialize all writers on their row locks;
+    KeywordOccurrenceDelta.objects.fold adds the deltas later.
+    """
+    if not counts:
+        return {}
+    values, arguments = values_sql(sorted(counts.items()))
+    cursor.execute('''
+        INSERT INTO main_assistant_keyword (keyword, occurrence_count)
+        VALUES {}
+        ON CONFLICT (keyword) DO NOTHING
+        RETURNING keyword, id;
+    '''.format(values), arguments)
+    ids = dict(cursor.fetchall())
+    existing = [(keyword, count) for keyword, count in sorted(counts.items()) if keyword not in ids]
+    if existing:
+        values, arguments = values_sql(existing)
+        cursor.execute('''
+            WITH input_t (keyword, count) AS (
+                VALUES {}
+            ), ids_t AS (
+                SELECT keyword_t.keyword, keyword_t.id, input_t.count
+                FROM input_t
+                JOIN main_assistant_keyword keyword_t
+                    ON keyword_t.keyword = input_t.keyword
+            ), deltas_t AS (
+                INSERT INTO main_assistant_keywordoccurrencedelta (keyword_id, delta)
+                SELECT id, count
+                FROM ids_t
+            )
+            SELECT keyword, id
+            FROM ids_t;
+        '''.format(values), arguments)
+        ids.update(cursor.fetchall())
+    return ids
+
+
+def get_or_create_authors(names):
+    """Returns full name -> id, inserting the authors not saved yet.
+
+    Runs outside of a transaction: locks the names, in hash order, for the lookup and the inserts, which commit in a
+    transaction of their own. The lock is taken before that transaction's snapshot, so it sees the authors inserted
+    by the previous holder, and only writers of the same author names wait for each other.
+    """
+    if not names:
+        return {}
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT pg_advisory_lock(%s, name_hash)
+            FROM (SELECT DISTINCT hashtext(name) AS name_hash
+                  FROM unnest(%s::text[]) AS name
+                  ORDER BY name_hash) AS hashes_t;
+        ''', [AUTHOR_LOCK_KEY, sorted(names)])
+        try:
+            with transaction.atomic():
+                cursor.execute('''
+                    SELECT full_name, MIN(id)
+                    FROM main_assistant_author
+                    WHERE full_name IN %s
+                    GROUP BY full_name;
+                ''', [tuple(names)])
+                ids = dict(cursor.fetchall())
+                missing = sorted(names - ids.keys())
+                if missing:
+                    values, arguments = values_sql([(name,) for name in missing])
+                    cursor.execute('''
+                        INSERT INTO main_assistant_author (full_name)
+                        VALUES {}
+                        RETURNING full_name, id;
+                    '''.format(values), arguments)
+                    ids.update(cursor.fetchall())
+        finally:
+            cursor.execute('''
+                SELECT pg_advisory_unlock(%s, name_hash)
+                FROM (SELECT DISTINCT hashtext(name) AS name_hash
+                      FROM unnest(%s::text[]) AS name) AS hashes_t;
+            ''', [AUTHOR_LOCK_KEY, sorted(names)])
+    return ids
+
+
+def insert_links(cursor, table, column, pairs):
+    if not pairs:
+        return
+    values, arguments = values_sql(sorted(pairs))
+    cursor.execute('''
+        INSERT INTO {} (article_id, {})
+        VALUES {}
+        ON CONFLICT DO NOTHING;
+    '''.format(table, column, values), arguments)
+
+
+def insert_references(cursor, pairs):
+    """Inserts (referring id, referred id) pairs not saved yet, returns the created ones."""
+    if not pairs:
+        return []
+    values, arguments = values_sql(sorted(pairs))
+    cursor.execute('''
+        INSERT INTO main_assistant_reference (referring_id, referred_id)
+        VALUES {}
+        ON CONFLICT DO NOTHING
+        RETURNING referring_id, referred_id;
+    '''.format(values), arguments)
+    return cursor.fetchall()
+
+
+def resolve_references(cursor, rows, library_id):
+    """Saves references of the new articles, returns the created (referring id, referred id) pairs.
+
+    Internal identifiers are looked up among articles of the library; references which cannot be resolved this way
+    are saved as SavedReferences, to be handled by the reference sweep.
+    """
+    if not rows:
+        return []
+    values, arguments = values_sql(rows)
+    cursor.execute('''
+        WITH input_t (referring_id, location, is_internal) AS (
+            VALUES {}
+        ), resolved_t AS (
+            SELECT input_t.referring_id, input_t.location, article_t.id AS referred_id
+            FROM input_t
+            JOIN main_assistant_article article_t
+                ON input_t.is_internal AND article_t.internal_identifier = input_t.location
+            JOIN main_assistant_publication publication_t
+                ON article_t.publication_id = publication_t.id
+            WHERE publication_t.digital_library_id = %s
+        ), saved_t AS (
+            INSERT INTO main_assistant_savedreference (referring_id, referred_location,
+                                                       referred_location_is_internal_identifier)
+            SELECT DISTINCT input_t.referring_id, input_t.location, input_t.is_internal
+            FROM input_t
+            WHERE NOT EXISTS (SELECT 1
+                              FROM resolved_t
+                              WHERE resolved_t.referring_id = input_t.referring_id
+                                  AND resolved_t.location = input_t.location)
+            ON CONFLICT DO NOTHING
+        )
+        INSERT INTO main_assistant_reference (referring_id, referred_id)
+        SELECT DISTINCT referring_id, referred_id
+        FROM resolved_t
+        ON CONFLICT DO NOTHING
+        RETURNING referring_id, referred_id;
+    '''.format(values), arguments + [library_id])
+    return cursor.fetchall()
+
+
+# an internal identifier is resolved only if both the referring and the referred article belong to the library
+RESOLVE_SAVED_REFERENCES_SQL = '''
+    WITH resolved_t AS (
+        DELETE FROM main_assistant_savedreference saved_t
+        USING main_assistant_article article_t
+        WHERE {}
+            AND (NOT saved_t.referred_location_is_internal_identifier
+                 AND saved_t.referred_location = article_t.location
+                 OR saved_t.referred_location_is_internal_identifier
+                 AND article_t.internal_identifier <> ''
+                 AND saved_t.referred_location = article_t.internal_identifier
+                 AND article_t.publication_id IN (SELECT id
+                                                  FROM main_assistant_publication
+                                                  WHERE digital_library_id = %s)
+                 AND EXISTS (SELECT 1
+                             FROM main_assistant_article referring_t
+                             JOIN main_assistant_publication publication_t
+                                 ON referring_t.publication_id = publication_t.id
+                             WHERE referring_t.id = saved_t.referring_id
+                                 AND publication_t.digital_library_id = %s))
+        RETURNING saved_t.referring_id, article_t.id AS referred_id
+    )
+    INSERT INTO main_assistant_reference (referring_id, referred_id)
+    SELECT DISTINCT referring_id, referred_id
+    FROM resolved_t
+    ON CONFLICT DO NOTHING
+    RETURNING referring_id, referred_id;
+'''
+
+
+def resolve_saved_references_after(cursor, after_id, library_id):
+    """Turns SavedReferences pointing at articles with an id greater than after_id into references.
+
+    Returns the created pairs. Run once per block of downloaded articles, see BaseProvider.resolve_saved_references.
+    """
+    cursor.execute(RESOLVE_SAVED_REFERENCES_SQL.format('article_t.id > %s'), [after_id, library_id, library_id])
+    return cursor.fetchall()
+
+
+def write_articles(documents, library_id, replace=False):
+    """Saves a batch of scraped articles with their authors, keywords and references in a few statements.
+
+    Articles whose identifier is already saved are skipped, or replaced if replace is set: their keywords and authors
+    are those scraped again, references are only added. Returns identifier -> id of the written articles.
+    """
+    documents = list(OrderedDict((d.identifier, d) for d in documents).values())
+    if not documents:
+        return {}
+    # authors of articles which turn out to be saved already or fail to be written are left without articles
+    author_ids = get_or_create_authors({name for d in documents for name in d.authors})
+    with transaction.atomic(), connection.cursor() as cursor:
+        if replace:
+            detach_articles(cursor, documents)
+        article_ids = insert_articles(cursor, documents, replace)
+        documents = [d for d in documents if d.identifier in article_ids]
+        if not documents:
+            return article_ids
+        keyword_counts = Counter(keyword for d in documents for keyword in set(d.keywords))
+        keyword_ids = upsert_keywords(cursor, keyword_counts)
+        insert_links(cursor, 'main_assistant_article_keywords', 'keyword_id',
+                     {(article_ids[d.identifier], keyword_ids[keyword]) for d in documents for keyword in d.keywords})
+        insert_links(cursor, 'main_assistant_article_authors', 'author_id',
+                     {(article_ids[d.identifier], author_ids[name]) for d in documents for name in d.authors})
+        pairs = resolve_references(cursor, sorted({(article_ids[d.identifier], location, bool(is_internal))
+                                                   for d in documents
+                                                   for location, is_internal in d.references}), library_id)
+        Reference.objects.update_counts(pairs)
+        KeywordYearCount.objects.add_articles(article_ids.values())
+        PublicationYearCount.objects.add_articles(article_ids.values())
+    return article_ids
+
+
+class ArticleWriter:
+    """Write-behind buffer of scraped articles of one digital library, saved in batches by write_articles.
+
+    Saved articles are replaced while replace is set, e.g. when pages are parsed again.
+    """
+
+    def __init__(self, library_name, batch_size=BATCH_SIZE, replace=False):
+        self._library_name = library_name
+        self._library_id = None
+        self._batch_size = batch_size
+        self.replace = replace
+        self._buffer = []
+        self._pending = set()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    async def add(self, document):
+        self._buffer.append(document)
+        if len(self._buffer) >= self._batch_size:
+            await self.flush()
+
+    async def flush(self):
+        """Saves the buffered articles and waits for batches written concurrently, which may hold the caller's.
+
+        Raises if any of them fails. The articles of a failed batch go back to the buffer, so every caller which
+        added some of them either sees the failure or saves them with its own flush.
+        """
+        documents, self._buffer = self._buffer, []
+        if documents:
+            future = asyncio.ensure_future(self._write_batch(documents))
+            self._pending.add(future)
+            future.add_done_callback(self._pending.discard)
+        if self._pending:
+            await asyncio.gather(*self._pending)
+
+    async def _write_batch(self, documents):
+        try:
+            return await get_database_executor().run(self.write, documents)
+        except Exception:
+            self._buffer[:0] = documents
+            raise
+
+    def write(self, documents):
+        start = time.time()
+        if self._library_id is None:
+            self._library_id = DigitalLibrary.objects.get(name=self._library_name).pk
+        article_ids = write_articles(documents, self._library_id, self.replace)
+        remember_documents(self._library_name, [d for d in documents if d.identifier in article_ids])
+        logger.debug('Saved %d of %d buffered articles in %.5fs', len(article_ids), len(documents),
+                     time.time() - start)
+        return article_ids
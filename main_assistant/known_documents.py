@@ -0,0 +1,146 @@
+import logging
+import threading
+import time
+
+from django.db import connection
+
+from main_assistant.models import Article
+from main_assistant.utils import BloomFilter, normalize_url
+
+logger = logging.getLogger(__name__)
+
+ERROR_RATE = 0.01
+# room for the articles added until the next rebuild
+CAPACITY_HEADROOM = 1.5
+MIN_CAPACITY = 100000
+REBUILD_PERIOD = 60 * 60
+MIN_BUILD_INTERVAL = 60
+FETCH_CHUNK_SIZE = 100000
+
+
+def location_key(url):
+    return 'location:' + normalize_url(url)
+
+
+def internal_identifier_key(library_name, internal_identifier):
+    return 'internal:{}:{}'.format(library_name, internal_identifier)
+
+
+class KnownDocuments:
+    """Bloom filter of the normalized locations and the internal identifiers of saved articles.
+
+    Lets document_from_url skip the database lookup for most references to unknown documents and the fetch
+    for references to known ones. Bits set concurrently by two threads may get lost, which only costs a fetch.
+    """
+
+    def __init__(self, capacity):
+        self._filter = BloomFilter(capacity, ERROR_RATE)
+        self.built = time.time()
+
+    @classmethod
+    def build(cls):
+        start = time.time()
+        known = cls(max(int(Article.objects.count() * 2 * CAPACITY_HEADROOM), MIN_CAPACITY))
+        cursor = connection.cursor()
+        cursor.execute('''
+            SELECT article_t.location, article_t.internal_identifier, library_t.name
+            FROM main_assistant_article article_t
+            LEFT JOIN main_assistant_publication publication_t
+                ON article_t.publication_id = publication_t.id
+            LEFT JOIN main_assistant_digitallibrary library_t
+                ON publication_t.digital_library_id = library_t.id;
+        ''')
+        rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+        while rows:
+            for location, internal_identifier, library_name in rows:
+                known.add(location, internal_identifier, library_name)
+            rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+        logger.info('Known documents filter of %d keys built in %.5fs', len(known._filter), time.time() - start)
+        return known
+
+    @property
+    def full(self):
+        return len(self._filter) >= self._filter.capacity
+
+    def add(self, location, internal_identifier, library_name):
+        if location:
+            self._filter.add(location_key(location))
+        if internal_identifier and library_name:
+            self._filter.add(internal_identifier_key(library_name, internal_identifier))
+
+    def might_contain(self, url, library_name=None, internal_identifier=None):
+        return location_key(url) in self._filter or bool(internal_identifier) and bool(library_name) \
+            and internal_identifier_key(library_name, internal_identifier) in self._filter
+
+
+known_documents = None
+known_documents_lock = threading.Lock()
+known_documents_builder = None
+known_documents_build_started = 0
+# documents saved while a filter is being built, possibly after its scan, added to it once built
+documents_saved_during_build = None
+
+
+def build_known_documents():
+    global known_documents, documents_saved_during_build
+    try:
+        known = KnownDocuments.build()
+        with known_documents_lock:
+            for document in documents_saved_during_build:
+                known.add(*document)
+            known_documents = known
+    except Exception:
+        logger.exception('Building the known documents filter failed')
+    finally:
+        with known_documents_lock:
+            documents_saved_during_build = None
+        connection.close()
+
+
+def get_known_documents():
+    """Returns the filter, None until the first one is built.
+
+    The filter is built by a background thread, again every REBUILD_PERIOD and when it gets over capacity (with a
+    higher false positive rate meanwhile); at most once per MIN_BUILD_INTERVAL, so that failing builds are not
+    repeated in a loop.
+    """
+    global known_documents_builder, known_documents_build_started, documents_saved_during_build
+    known = known_documents
+    now = time.time()
+    if (known is None or known.full or now - known.built >= REBUILD_PERIOD) \
+            and now - known_documents_build_started >= MIN_BUILD_INTERVAL:
+        with known_documents_lock:
+            if known_documents_builder is None or not known_documents_builder.is_alive():
+                known_documents_build_started = now
+                documents_saved_during_build = []
+                known_documents_builder = threading.Thread(target=build_known_documents, daemon=True)
+                known_documents_builder.start()
+    return known
+
+
+def remember_documents(library_name, documents):
+    """Adds freshly saved scraped_articles to the filter, if this process has built or is building one."""
+    documents = [(document.location, document.internal_identifier, library_name) for document in documents]
+    with known_documents_lock:
+        if documents_saved_during_build is not None:
+            documents_saved_during_build.extend(documents)
+    known = known_documents
+    if known is not None:
+        for document in documents:
+            known.add(*document)
+
+
+def find_known_document(url, library_name=None, internal_identifier=None):
+    """Returns the saved article at url (or with the internal identifier in the library), None if there is none.
+
+    Until the filter is built every URL may be known, and the database is asked.
+    """
+    known = get_known_documents()
+    if known is not None and not known.might_contain(url, library_name, internal_identifier):
+        return None
+    article = Article.objects.extra(where=['md5(location) IN (md5(%s), md5(%s))'],
+                                    params=[url, normalize_url(url)]).first()
+    if article is None and internal_identifier and library_name:
+        article = Article.objects.filter(internal_identifier=internal_identifier,
+                                         publication__digital_library__name=library_name).first()
+    return article
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import uuid
+
+from django_redis import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+LEASE_TIMEOUT = 300
+RENEW_PERIOD = LEASE_TIMEOUT / 3
+MAX_RANGE_FAILURES = 3
+FAILURES_TIMEOUT = 24 * 60 * 60
+
+# both only act if the lease is still held with the caller's token
+RENEW_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+'''
+RELEASE_SCRIPT = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+
+
+def lease_indexes(gaps, range_size):
+    """Yields indexes of the fixed ranges [index * range_size, (index + 1) * range_size) overlapping the sorted gaps."""
+    last = None
+    for start, size in gaps:
+        for index in range(max(start // range_size, -1 if last is None else last + 1),
+                           (start + size - 1) // range_size + 1):
+            last = index
+            yield index
+
+
+class Lease:
+    def __init__(self, scheduler, index, token):
+        self.scheduler = scheduler
+        self.index = index
+        self.token = token
+        self.lost = False
+        self._renewal = None
+
+    @property
+    def start(self):
+        return self.index * self.scheduler.range_size
+
+    @property
+    def end(self):
+        return self.start + self.scheduler.range_size
+
+    def start_renewal(self):
+        self._renewal = asyncio.ensure_future(self._renew_periodically())
+
+    async def _renew_periodically(self):
+        loop = asyncio.get_event_loop()
+        while not self.lost:
+            await asyncio.sleep(RENEW_PERIOD)
+            try:
+                renewed = await loop.run_in_executor(None, self.scheduler.renew, self)
+            except Exception:
+                logger.exception('Could not renew lease of range %d of %s', self.index, self.scheduler.name)
+                continue
+            if not renewed:
+                logger.warning('Lease of range %d of %s lost', self.index, self.scheduler.name)
+                self.lost = True
+
+    def stop_renewal(self):
+        if self._renewal is not None:
+            self._renewal.cancel()
+
+
+class LeaseScheduler:
+    """Hands out expiring Redis leases on fixed ranges of article numbers, so that many workers can scrape a library.
+
+    Ranges are aligned to multiples of range_size, so that all workers agree on them whatever progress they see.
+    A worker holding a lease renews it while downloading; the lease of a crashed worker expires and the range,
+    still missing from the library's progress, is leased by the next worker passing by.
+    """
+
+    def __init__(self, name, range_size):
+        self.name = name
+        self.range_size = range_size
+        self._redis = get_redis_connection('default')
+        self._renew_script = self._redis.register_script(RENEW_SCRIPT)
+        self._release_script = self._redis.register_script(RELEASE_SCRIPT)
+
+    def _key(self, index):
+        return 'scraping_lease:{}:{}'.format(self.name, index)
+
+    @property
+    def _failures_key(self):
+        return 'scraping_lease_failures:{}'.format(self.name)
+
+    def acquire(self, index):
+        """Returns a Lease on the range, None if it is held by another worker or has failed too many times."""
+        failures = self._redis.hget(self._failures_key, index)
+        if failures is not None and int(failures) >= MAX_RANGE_FAILURES:
+            return None
+        token = uuid.uuid4().hex
+        if self._redis.set(self._key(index), token, nx=True, px=int(LEASE_TIMEOUT * 1000)):
+            return Lease(self, index, token)
+        return None
+
+    def renew(self, lease):
+        return bool(self._renew_script(keys=[self._key(lease.index)], args=[lease.token, int(LEASE_TIMEOUT * 1000)]))
+
+    def release(self, lease):
+        lease.stop_renewal()
+        self._release_script(keys=[self._key(lease.index)], args=[lease.token])
+
+    def fail(self, lease):
+        """Releases the lease for an immediate retry by any worker, up to MAX_RANGE_FAILURES times a day."""
+        self.release(lease)
+        with self._redis.pipeline() as pipe:
+            pipe.hincrby(self._failures_key, lease.index, 1)
+            pipe.expire(self._failures_key, FAILURES_TIMEOUT)
+            pipe.execute()
@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test.runner import DiscoverRunner
+
+from main_assistant.benchmark import run_benchmark
+from main_assistant.db_executor import close_database_executor
+from main_assistant.utils import run_async
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Scrapes a synthetic library served on localhost through fake proxies into a scratch test database, ' \
+           'printing throughput, latency, database and retry metrics as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--articles', type=int, default=1000)
+        parser.add_argument('--latency', type=float, default=0.05, help='Mean server latency in seconds.')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of pages failing with 500.')
+        parser.add_argument('--rate-limit', type=float, default=None,
+                            help='Requests per second above which the server answers 429.')
+        parser.add_argument('--proxies', type=int, default=4)
+        parser.add_argument('--proxy-latency', type=float, default=0.01)
+        parser.add_argument('--proxy-failure-rate', type=float, default=0.0,
+                            help='Share of requests on which a proxy drops the connection.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        # the benchmark writes thousands of articles, never into the real database
+        runner = DiscoverRunner(verbosity=0, interactive=False)
+        old_config = runner.setup_databases()
+        try:
+            metrics = run_async(run_benchmark(
+                articles=options['articles'], latency=options['latency'], error_rate=options['error_rate'],
+                rate_limit=options['rate_limit'], proxies=options['proxies'], proxy_latency=options['proxy_latency'],
+                proxy_failure_rate=options['proxy_failure_rate'], seed=options['seed']))
+        finally:
+            close_database_executor()
+            runner.teardown_databases(old_config)
+        self.stdout.write(json.dumps(metrics, indent=2, sort_keys=True))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from main_assistant.citation_graph import build_citation_graph
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Builds a new snapshot of the in-memory citation graph.'
+
+    def handle(self, *args, **options):
+        graph = build_citation_graph()
+        self.stdout.write('Citation graph snapshot saved to {}'.format(graph.snapshot_path))
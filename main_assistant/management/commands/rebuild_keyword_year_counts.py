@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from main_assistant.models import KeywordYearCount, PublicationYearCount
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Recomputes the per year article and keyword histogram tables used by the hype cycle graph.'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            KeywordYearCount.objects.rebuild()
+            PublicationYearCount.objects.rebuild()
+        self.stdout.write('{} keyword year counts and {} publication year counts computed'.format(
+            KeywordYearCount.objects.count(), PublicationYearCount.objects.count()))
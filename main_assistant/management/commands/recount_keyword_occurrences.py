@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max
+
+from main_assistant.models import Keyword
+
+KEYWORDS_PER_RANGE = 50000
+
+
+def recount_range(first_id, last_id):
+    try:
+        return Keyword.objects.recount_occurrences(first_id, last_id)
+    finally:
+        # every worker thread has its own connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Recomputes Keyword.occurrence_count from the article keywords, in parallel over ranges of keyword ids.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        max_id = Keyword.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        ranges = [(first_id, first_id + KEYWORDS_PER_RANGE - 1)
+                  for first_id in range(1, max_id + 1, KEYWORDS_PER_RANGE)]
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            corrected = sum(executor.map(lambda bounds: recount_range(*bounds), ranges))
+        self.stdout.write('Occurrence counts of {} keywords corrected'.format(corrected))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main_assistant.archive import ArchivingWebAccess
+from main_assistant.services import providers_map
+
+
+class Command(BaseCommand):
+    args = ''
+    help = 'Parses all articles of a digital library again, serving the pages from the response archive.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('provider', choices=sorted(providers_map.keys()))
+
+    def handle(self, *args, **options):
+        provider = providers_map[options['provider']]
+        if not isinstance(provider.web, ArchivingWebAccess):
+            raise CommandError('{} does not archive responses, set RESPONSE_ARCHIVE_DIR'.format(provider.__name__))
+        provider.web.mode = ArchivingWebAccess.REPLAY
+        incomplete = provider.download_articles(reprocess=True)
+        if incomplete:
+            raise CommandError('Ranges {} of {} articles were not reprocessed'.format(
+                ', '.join(map(str, incomplete)), provider.ARTICLES_PER_LEASE))
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2016-10-02 12:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_assistant', '0004_plpython_procedures'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeywordYearCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(blank=True, null=True)),
+                ('count', models.IntegerField(default=0)),
+                ('keyword', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='year_counts', to='main_assistant.Keyword')),
+                ('publication', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='keyword_year_counts', to='main_assistant.Publication')),
+            ],
+        ),
+        # NULLs are distinct in unique constraints, hence the expression index (used by ON CONFLICT in add_articles)
+        migrations.RunSQL(
+            sql='\n            CREATE UNIQUE INDEX main_assistant_keywordyearcount_uniq\n            ON main_assistant_keywordyearcount (keyword_id, COALESCE(publication_id, -1), COALESCE(year, -1));\n        ',
+            reverse_sql='\n            DROP INDEX IF EXISTS main_assistant_keywordyearcount_uniq;\n        ',
+        ),
+        migrations.RunSQL(
+            sql='\n            INSERT INTO main_assistant_keywordyearcount (keyword_id, publication_id, year, count)\n            SELECT relation_t.keyword_id, article_t.publication_id,\n                   EXTRACT(year FROM article_t.issue_date)::integer, COUNT(article_t.id)\n            FROM main_assistant_article article_t\n            JOIN main_assistant_article_keywords relation_t\n                ON article_t.id = relation_t.article_id\n            GROUP BY relation_t.keyword_id, article_t.publication_id, EXTRACT(year FROM article_t.issue_date);\n        ',
+            reverse_sql='',
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2016-10-04 18:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_assistant', '0005_keywordyearcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PublicationYearCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(blank=True, null=True)),
+                ('count', models.IntegerField(default=0)),
+                ('publication', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='year_counts', to='main_assistant.Publication')),
+            ],
+        ),
+        migrations.RunSQL(
+            sql='\n            CREATE UNIQUE INDEX main_assistant_publicationyearcount_uniq\n            ON main_assistant_publicationyearcount (COALESCE(publication_id, -1), COALESCE(year, -1));\n        ',
+            reverse_sql='\n            DROP INDEX IF EXISTS main_assistant_publicationyearcount_uniq;\n        ',
+        ),
+        migrations.RunSQL(
+            sql='\n            INSERT INTO main_assistant_publicationyearcount (publication_id, year, count)\n            SELECT article_t.publication_id, EXTRACT(year FROM article_t.issue_date)::integer, COUNT(article_t.id)\n            FROM main_assistant_article article_t\n            GROUP BY article_t.publication_id, EXTRACT(year FROM article_t.issue_date);\n        ',
+            reverse_sql='',
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2016-10-12 20:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_assistant', '0006_publicationyearcount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='article',
+            name='cited_count',
+            field=models.IntegerField(db_index=True, default=0),
+        ),
+        migrations.AddField(
+            model_name='article',
+            name='references_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(
+            sql='\n            UPDATE main_assistant_article article_t\n            SET cited_count = helper_table.count\n            FROM (SELECT reference_t.referred_id as id, COUNT(reference_t.id) as count\n                  FROM main_assistant_reference reference_t\n                  GROUP BY reference_t.referred_id) helper_table\n            WHERE helper_table.id = article_t.id;\n            UPDATE main_assistant_article article_t\n            SET references_count = helper_table.count\n            FROM (SELECT reference_t.referring_id as id, COUNT(reference_t.id) as count\n                  FROM main_assistant_reference reference_t\n                  GROUP BY reference_t.referring_id) helper_table\n            WHERE helper_table.id = article_t.id;\n        ',
+            reverse_sql='',
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2016-10-14 09:51
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_assistant', '0007_article_citation_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleMetrics',
+            fields=[
+                ('article', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='metrics', serialize=False, to='main_assistant.Article')),
+                ('pagerank', models.FloatField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AuthorMetrics',
+            fields=[
+                ('author', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='metrics', serialize=False, to='main_assistant.Author')),
+                ('h_index', models.IntegerField(db_index=True)),
+                ('citations', models.IntegerField(db_index=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PublicationMetrics',
+            fields=[
+                ('publication', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='metrics', serialize=False, to='main_assistant.Publication')),
+                ('pagerank', models.FloatField(db_index=True)),
+                ('citations', models.IntegerField(db_index=True)),
+            ],
+        ),
+    ]
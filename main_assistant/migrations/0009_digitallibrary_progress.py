@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2016-10-16 11:27
+from __future__ import unicode_literals
+
+import struct
+
+from django.db import migrations, models
+
+# the format of DigitalLibrary.progress when this migration was written, the bounds of sorted, disjoint,
+# non-adjacent intervals [start, end) as little-endian int64
+BOUND_FORMAT = '<{}q'
+
+
+def merged_bounds(blocks):
+    bounds = []
+    for start, size in sorted(blocks):
+        end = start + size
+        if bounds and start <= bounds[-1]:
+            bounds[-1] = max(bounds[-1], end)
+        elif size > 0:
+            bounds.extend((start, end))
+    return bounds
+
+
+def blocks_to_progress(apps, schema_editor):
+    DigitalLibrary = apps.get_model('main_assistant', 'DigitalLibrary')
+    DownloadBlock = apps.get_model('main_assistant', 'DownloadBlock')
+    for library in DigitalLibrary.objects.all():
+        bounds = merged_bounds(DownloadBlock.objects.filter(library=library).values_list('start', 'size').iterator())
+        library.progress = struct.pack(BOUND_FORMAT.format(len(bounds)), *bounds)
+        library.save(update_fields=['progress'])
+
+
+def progress_to_blocks(apps, schema_editor):
+    DigitalLibrary = apps.get_model('main_assistant', 'DigitalLibrary')
+    DownloadBlock = apps.get_model('main_assistant', 'DownloadBlock')
+    for library in DigitalLibrary.objects.all():
+        progress = bytes(library.progress or b'')
+        bounds = struct.unpack(BOUND_FORMAT.format(len(progress) // 8), progress)
+        DownloadBlock.objects.bulk_create([DownloadBlock(start=bounds[i], size=bounds[i + 1] - bounds[i],
+                                                         library=library)
+                                           for i in range(0, len(bounds), 2)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_assistant', '0008_bibliometric_metrics'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='digitallibrary',
+            name='progress',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(blocks_to_progress, progress_to_blocks),
+        migrations.RemoveField(
+            model_name='downloadblock',
+            name='library',
+        ),
+        migrations.DeleteModel(
+            name='DownloadBlock',
+        ),
+    ]
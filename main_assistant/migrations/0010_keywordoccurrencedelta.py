@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2016-10-17 14:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_assistant', '0009_digitallibrary_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeywordOccurrenceDelta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('keyword', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrence_deltas', to='main_assistant.Keyword')),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2016-10-19 10:12
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_assistant', '0010_keywordoccurrencedelta'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='CREATE INDEX main_assistant_article_location_md5 ON main_assistant_article (md5(location));',
+            reverse_sql='DROP INDEX main_assistant_article_location_md5;',
+        ),
+    ]
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2016-10-20 09:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_assistant', '0011_article_location_md5'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='article',
+            name='cited_count',
+            field=models.IntegerField(default=0),
+        ),
+        # the order of an author's most cited articles, see author_browser.views.author_articles
+        migrations.RunSQL(
+            sql='CREATE INDEX main_assistant_article_cited_count_id '
+                'ON main_assistant_article (cited_count DESC, id);',
+            reverse_sql='DROP INDEX main_assistant_article_cited_count_id;',
+        ),
+        # the articles of an author, read from the index alone
+        migrations.RunSQL(
+            sql='CREATE INDEX main_assistant_article_authors_author_id_article_id '
+                'ON main_assistant_article_authors (author_id, article_id);',
+            reverse_sql='DROP INDEX main_assistant_article_authors_author_id_article_id;',
+        ),
+    ]
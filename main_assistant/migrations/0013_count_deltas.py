@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2016-10-21 11:27
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main_assistant', '0012_article_citation_order'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CitedCountDelta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField()),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cited_count_deltas', to='main_assistant.Article')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='KeywordYearCountDelta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(blank=True, null=True)),
+                ('count', models.IntegerField()),
+                ('keyword', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='year_count_deltas', to='main_assistant.Keyword')),
+                ('publication', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='keyword_year_count_deltas', to='main_assistant.Publication')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PublicationYearCountDelta',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField(blank=True, null=True)),
+                ('count', models.IntegerField()),
+                ('publication', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='year_count_deltas', to='main_assistant.Publication')),
+            ],
+        ),
+    ]
@@ -1,35 +1,30 @@
-from django.db import models
+from collections import Counter
+
+from django.db import models, connection, transaction
 from django.db.models.functions import Length
 
-from .utils import convert, ChoiceEnum
+from .utils import convert, ChoiceEnum, IntervalSet
 
 
 class DigitalLibrary(models.Model):
     name = models.CharField(max_length=50, unique=True)
     total_articles = models.IntegerField()
     enabled = models.BooleanField(default=False)
+    # IntervalSet of processed article numbers, see IntervalSet.to_bytes
+    progress = models.BinaryField(default=b'')
 
     @property
-    def processed_block_articles(self):
-        return convert(DownloadBlock.objects.filter(library=self).aggregate(sum=models.Sum('size'))['sum'], int,
-                       default=0)
-        # blocks = DownloadBlock.objects.filter(library=self).order_by('-start')
-        # return blocks[0].start + blocks[0].size if len(blocks) > 0 else 0
+    def processed(self):
+        return IntervalSet.from_bytes(self.progress)
 
     @property
-    def sorted_blocks(self):
-        return DownloadBlock.objects.filter(library=self).order_by('start')
+    def processed_block_articles(self):
+        return self.processed.count
 
     class Meta:
         verbose_name_plural = "Digital libraries"
 
 
-class DownloadBlock(models.Model):
-    start = models.IntegerField()
-    size = models.IntegerField()
-    library = models.ForeignKey(DigitalLibrary, related_name='blocks')
-
-
 # a journal or a conference
 class Publication(models.Model):
     # ISSN or MD5 Hash of the name if missing
@@ -66,6 +61,31 @@ class KeywordManager(models.Manager):
     MIN_REFERENCE_COUNT = 3
     MIN_KEYWORD_LENGTH = 3
 
+    def recount_occurrences(self, first_id, last_id):
+        """Recomputes occurrence_count of keywords with ids in [first_id, last_id], discarding their pending deltas.
+
+        A single statement, so that the counted article links and the discarded deltas come from one snapshot.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                WITH discarded_t AS (
+                    DELETE FROM main_assistant_keywordoccurrencedelta
+                    WHERE keyword_id BETWEEN %s AND %s
+                ), counts_t AS (
+                    SELECT keyword_t.id, COUNT(relation_t.article_id) AS count
+                    FROM main_assistant_keyword keyword_t
+                    LEFT JOIN main_assistant_article_keywords relation_t
+                        ON keyword_t.id = relation_t.keyword_id
+                    WHERE keyword_t.id BETWEEN %s AND %s
+                    GROUP BY keyword_t.id
+                )
+                UPDATE main_assistant_keyword keyword_t
+                SET occurrence_count = counts_t.count
+                FROM counts_t
+                WHERE keyword_t.id = counts_t.id AND keyword_t.occurrence_count <> counts_t.count;
+            ''', [first_id, last_id, first_id, last_id])
+            return cursor.rowcount
+
     def qualified_keywords_values(self):
         return Keyword.objects.filter(occurrence_count__gte=self.MIN_REFERENCE_COUNT) \
             .annotate(text_len=Length('keyword')).filter(text_len__gte=self.MIN_KEYWORD_LENGTH) \
@@ -85,6 +105,34 @@ class Keyword(models.Model):
         return self.keyword
 
 
+class KeywordOccurrenceDeltaManager(models.Manager):
+    def fold(self):
+        """Adds the pending deltas to Keyword.occurrence_count in one statement. Returns the number of keywords."""
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                WITH folded_t AS (
+                    DELETE FROM main_assistant_keywordoccurrencedelta
+                    RETURNING keyword_id, delta
+                ), summed_t AS (
+                    SELECT keyword_id, SUM(delta) AS delta
+                    FROM folded_t
+                    GROUP BY keyword_id
+                )
+                UPDATE main_assistant_keyword keyword_t
+                SET occurrence_count = keyword_t.occurrence_count + summed_t.delta
+                FROM summed_t
+                WHERE keyword_t.id = summed_t.keyword_id;
+            ''')
+            return cursor.rowcount
+
+
+# append-only increments of Keyword.occurrence_count, written by ingestion instead of updating hot keyword rows
+class KeywordOccurrenceDelta(models.Model):
+    keyword = models.ForeignKey(Keyword, related_name='occurrence_deltas')
+    delta = models.IntegerField()
+    objects = KeywordOccurrenceDeltaManager()
+
+
 class Article(models.Model):
     identifier = models.CharField(max_length=255, unique=True)
     internal_identifier = models.CharField(max_length=255, db_index=True, blank=True)
@@ -96,6 +144,79 @@ class Article(models.Model):
     authors = models.ManyToManyField(Author)
     keywords = models.ManyToManyField(Keyword)
     references = models.ManyToManyField('self', through='Reference', symmetrical=False, related_name='is_referred')
+    # denormalized, maintained by ReferenceManager (cited_count through CitedCountDelta); indexed together with id
+    # by migration 0012
+    cited_count = models.IntegerField(default=0)
+    references_count = models.IntegerField(default=0)
+
+
+class CitedCountDeltaManager(models.Manager):
+    def fold(self):
+        """Adds the pending deltas to Article.cited_count in one statement. Returns the number of articles."""
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                WITH folded_t AS (
+                    DELETE FROM main_assistant_citedcountdelta
+                    RETURNING article_id, delta
+                ), summed_t AS (
+                    SELECT article_id, SUM(delta) AS delta
+                    FROM folded_t
+                    GROUP BY article_id
+                )
+                UPDATE main_assistant_article article_t
+                SET cited_count = article_t.cited_count + summed_t.delta
+                FROM summed_t
+                WHERE article_t.id = summed_t.article_id;
+            ''')
+            return cursor.rowcount
+
+
+# append-only increments of Article.cited_count, the rows of much cited articles are hot during ingestion
+class CitedCountDelta(models.Model):
+    article = models.ForeignKey(Article, related_name='cited_count_deltas')
+    delta = models.IntegerField()
+    objects = CitedCountDeltaManager()
+
+
+class ReferenceManager(models.Manager):
+    """Keeps Article.cited_count and Article.references_count up to date when creating references.
+
+    cited_count increments are appended to CitedCountDelta and folded periodically.
+    """
+
+    @staticmethod
+    def _add_to_counts(column, counts):
+        if not counts:
+            return
+        values = ','.join('(%s, %s)' for _ in range(len(counts)))
+        arguments = [value for item in counts.items() for value in item]
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                UPDATE main_assistant_article
+                SET {0} = main_assistant_article.{0} + delta_t.count
+                FROM (VALUES {1}) AS delta_t (id, count)
+                WHERE main_assistant_article.id = delta_t.id;
+            '''.format(column, values), arguments)
+
+    def update_counts(self, pairs):
+        """Adds freshly created (referring_id, referred_id) pairs to the denormalized counts."""
+        self._add_to_counts('references_count', Counter(referring_id for referring_id, referred_id in pairs))
+        cited_counts = Counter(referred_id for referring_id, referred_id in pairs)
+        CitedCountDelta.objects.bulk_create(CitedCountDelta(article_id=article_id, delta=delta)
+                                            for article_id, delta in cited_counts.items())
+
+    def bulk_create(self, objs, batch_size=None):
+        with transaction.atomic():
+            objs = super().bulk_create(objs, batch_size)
+            self.update_counts([(obj.referring_id, obj.referred_id) for obj in objs])
+        return objs
+
+    def get_or_create(self, defaults=None, **kwargs):
+        with transaction.atomic():
+            obj, created = super().get_or_create(defaults, **kwargs)
+            if created:
+                self.update_counts([(obj.referring_id, obj.referred_id)])
+        return obj, created
 
 
 class Reference(models.Model):
@@ -113,6 +234,7 @@ class Reference(models.Model):
     # the only question is if to use single or multi-column indexes
     referring = models.ForeignKey(Article, related_name='out_references', db_index=True)
     referred = models.ForeignKey(Article, related_name='in_references', db_index=True)
+    objects = ReferenceManager()
 
     class Meta():
         unique_together = ('referring', 'referred')
@@ -122,6 +244,162 @@ class Reference(models.Model):
         # ]
 
 
+class KeywordYearCountManager(models.Manager):
+    SELECT_COUNTS_SQL = '''
+        SELECT relation_t.keyword_id, article_t.publication_id,
+               EXTRACT(year FROM article_t.issue_date)::integer, COUNT(article_t.id)
+        FROM main_assistant_article article_t
+        JOIN main_assistant_article_keywords relation_t
+            ON article_t.id = relation_t.article_id
+        {}
+        GROUP BY relation_t.keyword_id, article_t.publication_id, EXTRACT(year FROM article_t.issue_date)
+    '''
+
+    def add_articles(self, article_ids, sign=1):
+        """Adds keyword occurrences of freshly ingested articles to the summary, once folded.
+
+        Must be called exactly once per article, after its keywords, publication and issue date are saved.
+        """
+        article_ids = tuple(article_ids)
+        if not article_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO main_assistant_keywordyearcountdelta (keyword_id, publication_id, year, count)
+                SELECT keyword_id, publication_id, year, %s * count
+                FROM ({}) AS counts_t (keyword_id, publication_id, year, count);
+            '''.format(self.SELECT_COUNTS_SQL.format('WHERE article_t.id IN %s')), [sign, article_ids])
+
+    def fold(self):
+        """Adds the pending KeywordYearCountDeltas to the summary in one statement."""
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                WITH folded_t AS (
+                    DELETE FROM main_assistant_keywordyearcountdelta
+                    RETURNING keyword_id, publication_id, year, count
+                )
+                INSERT INTO main_assistant_keywordyearcount (keyword_id, publication_id, year, count)
+                SELECT keyword_id, publication_id, year, SUM(count)
+                FROM folded_t
+                GROUP BY keyword_id, publication_id, year
+                ON CONFLICT (keyword_id, COALESCE(publication_id, -1), COALESCE(year, -1))
+                DO UPDATE SET count = main_assistant_keywordyearcount.count + EXCLUDED.count;
+            ''')
+
+    def remove_articles(self, article_ids):
+        """Takes articles out of the summary before their keywords, publication or issue date change."""
+        self.add_articles(article_ids, sign=-1)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                DELETE FROM main_assistant_keywordyearcountdelta;
+                DELETE FROM main_assistant_keywordyearcount;
+                INSERT INTO main_assistant_keywordyearcount (keyword_id, publication_id, year, count)
+                {};
+            '''.format(self.SELECT_COUNTS_SQL.format('')))
+
+
+class PublicationYearCountManager(models.Manager):
+    SELECT_COUNTS_SQL = '''
+        SELECT article_t.publication_id, EXTRACT(year FROM article_t.issue_date)::integer, COUNT(article_t.id)
+        FROM main_assistant_article article_t
+        {}
+        GROUP BY article_t.publication_id, EXTRACT(year FROM article_t.issue_date)
+    '''
+
+    def add_articles(self, article_ids, sign=1):
+        """Adds freshly ingested articles to the summary, once folded. Must be called exactly once per article."""
+        article_ids = tuple(article_ids)
+        if not article_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                INSERT INTO main_assistant_publicationyearcountdelta (publication_id, year, count)
+                SELECT publication_id, year, %s * count
+                FROM ({}) AS counts_t (publication_id, year, count);
+            '''.format(self.SELECT_COUNTS_SQL.format('WHERE article_t.id IN %s')), [sign, article_ids])
+
+    def fold(self):
+        """Adds the pending PublicationYearCountDeltas to the summary in one statement."""
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                WITH folded_t AS (
+                    DELETE FROM main_assistant_publicationyearcountdelta
+                    RETURNING publication_id, year, count
+                )
+                INSERT INTO main_assistant_publicationyearcount (publication_id, year, count)
+                SELECT publication_id, year, SUM(count)
+                FROM folded_t
+                GROUP BY publication_id, year
+                ON CONFLICT (COALESCE(publication_id, -1), COALESCE(year, -1))
+                DO UPDATE SET count = main_assistant_publicationyearcount.count + EXCLUDED.count;
+            ''')
+
+    def remove_articles(self, article_ids):
+        """Takes articles out of the summary before their publication or issue date change."""
+        self.add_articles(article_ids, sign=-1)
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('''
+                DELETE FROM main_assistant_publicationyearcountdelta;
+                DELETE FROM main_assistant_publicationyearcount;
+                INSERT INTO main_assistant_publicationyearcount (publication_id, year, count)
+                {};
+            '''.format(self.SELECT_COUNTS_SQL.format('')))
+
+
+# number of articles grouped by publication and year of issue
+class PublicationYearCount(models.Model):
+    publication = models.ForeignKey(Publication, related_name='year_counts', blank=True, null=True)
+    year = models.IntegerField(blank=True, null=True)
+    count = models.IntegerField(default=0)
+    objects = PublicationYearCountManager()
+
+
+# append-only increments of PublicationYearCount, folded by PublicationYearCount.objects.fold
+class PublicationYearCountDelta(models.Model):
+    publication = models.ForeignKey(Publication, related_name='year_count_deltas', blank=True, null=True)
+    year = models.IntegerField(blank=True, null=True)
+    count = models.IntegerField()
+
+
+# number of articles with a given keyword, grouped by publication and year of issue
+class KeywordYearCount(models.Model):
+    keyword = models.ForeignKey(Keyword, related_name='year_counts')
+    publication = models.ForeignKey(Publication, related_name='keyword_year_counts', blank=True, null=True)
+    year = models.IntegerField(blank=True, null=True)
+    count = models.IntegerField(default=0)
+    objects = KeywordYearCountManager()
+
+
+# append-only increments of KeywordYearCount, folded by KeywordYearCount.objects.fold
+class KeywordYearCountDelta(models.Model):
+    keyword = models.ForeignKey(Keyword, related_name='year_count_deltas')
+    publication = models.ForeignKey(Publication, related_name='keyword_year_count_deltas', blank=True, null=True)
+    year = models.IntegerField(blank=True, null=True)
+    count = models.IntegerField()
+
+
+# bibliometric indicators, recomputed in bulk by main_assistant.bibliometrics
+class AuthorMetrics(models.Model):
+    author = models.OneToOneField(Author, related_name='metrics', primary_key=True)
+    h_index = models.IntegerField(db_index=True)
+    citations = models.IntegerField(db_index=True)
+
+
+class ArticleMetrics(models.Model):
+    article = models.OneToOneField(Article, related_name='metrics', primary_key=True)
+    pagerank = models.FloatField(db_index=True)
+
+
+class PublicationMetrics(models.Model):
+    publication = models.OneToOneField(Publication, related_name='metrics', primary_key=True)
+    pagerank = models.FloatField(db_index=True)
+    citations = models.IntegerField(db_index=True)
+
+
 class SavedReference(models.Model):
     referring = models.ForeignKey(Article, related_name='out_saved_references')
     referred_location = models.CharField(max_length=2000, db_index=True)
@@ -1,8 +1,10 @@
 import asyncio
+import collections
 import functools
 import logging
 import random
 import re
+import time
 from abc import ABCMeta, abstractmethod
 from subprocess import TimeoutExpired
 from urllib.parse import urlparse
@@ -15,7 +17,9 @@ from lxml import html
 from stem import control, CircStatus
 from stem import process
 
-from main_assistant.utils import run_async, weighed_choice, delayed_ensure_future, xpath_select, convert
+from main_assistant.parsing import parse_in_pool
+from main_assistant.utils import run_async, delayed_ensure_future, convert, ExtractionSpec, XPathField, \
+    WeightedSampler, LatencySketch
 
 logger = logging.getLogger(__name__)
 
@@ -29,6 +33,117 @@ FAIL_EXCEPTION_TYPES = (
 )
 
 
+class CongestionController:
+    """AIMD limits of the concurrency and request rate towards one host, shared by all its sessions.
+
+    Every successful response raises the window by WINDOW_INCREASE / window and the rate by RATE_INCREASE / rate,
+    so roughly by WINDOW_INCREASE per window of requests and RATE_INCREASE per second; 429, 503 and timeouts cut
+    both by DECREASE_FACTOR, at most once per DECREASE_INTERVAL, as a burst of them is a single congestion event.
+
+    A timeout is more often the fault of the proxy or circuit (the source) than of the host, so it only counts
+    when corroborated within CORROBORATION_INTERVAL: the same source succeeded against the host, or timeouts came
+    from TIMEOUT_SOURCES distinct sources.
+    """
+    INITIAL_WINDOW = 4.0
+    MIN_WINDOW = 1.0
+    MAX_WINDOW = 256.0
+    WINDOW_INCREASE = 1.0
+    INITIAL_RATE = 4.0
+    MIN_RATE = 0.2
+    MAX_RATE = 200.0
+    RATE_INCREASE = 1.0
+    DECREASE_FACTOR = 0.5
+    DECREASE_INTERVAL = 1.0
+    MAX_RETRY_AFTER = 300
+    CONGESTION_STATUSES = (429, 503)
+    CORROBORATION_INTERVAL = 10.0
+    TIMEOUT_SOURCES = 3
+
+    def __init__(self, netloc):
+        self.netloc = netloc
+        self.window = self.INITIAL_WINDOW
+        self.rate = self.INITIAL_RATE
+        self.in_flight = 0
+        self._next_send = 0.0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._waiters = collections.deque()
+        # source -> time of its last success or timeout, oldest first
+        self._successes = collections.OrderedDict()
+        self._timeouts = collections.OrderedDict()
+
+    async def acquire(self):
+        while self.in_flight >= int(self.window):
+            waiter = asyncio.Future()
+            self._waiters.append(waiter)
+            await waiter
+        self.in_flight += 1
+        now = asyncio.get_event_loop().time()
+        send_at = max(now, self._next_send, self._paused_until)
+        self._next_send = send_at + 1 / self.rate
+        if send_at > now:
+            try:
+                await asyncio.sleep(send_at - now)
+            except asyncio.CancelledError:
+                self.in_flight -= 1
+                self._wake_waiters()
+                raise
+
+    def release(self, result, succeeded, source=None):
+        """Ends a request made through source (a proxy or circuit), with its response or exception."""
+        self.in_flight -= 1
+        now = asyncio.get_event_loop().time()
+        if self.is_congestion(result, source, now):
+            if now - self._last_decrease >= self.DECREASE_INTERVAL:
+                self._last_decrease = now
+                self.window = max(self.MIN_WINDOW, self.window * self.DECREASE_FACTOR)
+                self.rate = max(self.MIN_RATE, self.rate * self.DECREASE_FACTOR)
+                logger.debug('%s congested, window %.2f, rate %.2f/s', self.netloc, self.window, self.rate)
+            retry_after = convert(getattr(result, 'headers', {}).get('Retry-After'), int)
+            if retry_after is not None:
+                self._paused_until = max(self._paused_until, now + min(retry_after, self.MAX_RETRY_AFTER))
+        elif succeeded:
+            self.window = min(self.MAX_WINDOW, self.window + self.WINDOW_INCREASE / self.window)
+            self.rate = min(self.MAX_RATE, self.rate + self.RATE_INCREASE / self.rate)
+            self._record(self._successes, source, now)
+        # other failures are blamed on the proxy or circuit, not the host
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        free = int(self.window) - self.in_flight
+        while free > 0 and self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                free -= 1
+
+    def _record(self, events, source, now):
+        events.pop(source, None)
+        events[source] = now
+        self._prune(events, now)
+
+    def _prune(self, events, now):
+        while events and next(iter(events.values())) < now - self.CORROBORATION_INTERVAL:
+            events.popitem(last=False)
+
+    def is_congestion(self, result, source, now):
+        if not isinstance(result, asyncio.TimeoutError):
+            return getattr(result, 'status', None) in self.CONGESTION_STATUSES
+        self._record(self._timeouts, source, now)
+        self._prune(self._successes, now)
+        return source in self._successes or len(self._timeouts) >= self.TIMEOUT_SOURCES
+
+
+congestion_controllers = {}
+
+
+def get_congestion_controller(address):
+    netloc = urlparse(address).netloc
+    if netloc not in congestion_controllers:
+        congestion_controllers[netloc] = CongestionController(netloc)
+    return congestion_controllers[netloc]
+
+
 class ProxySource(metaclass=ABCMeta):
     @abstractmethod
     async def getProxies(cls):
@@ -46,8 +161,12 @@ class ProxyListsProxies(ProxySource):
 
     async def getProxies(self):
         resp = await self.web.get(self.URL)
+        return await parse_in_pool(self.parse, resp.content)
+
+    @classmethod
+    def parse(cls, content):
         ret = set()
-        for match in re.finditer(self._RE_PATTERN, str(resp.content), re.VERBOSE):
+        for match in re.finditer(cls._RE_PATTERN, str(content), re.VERBOSE):
             address = 'http://{}/'.format(match.group(1))
             ret.add(address)
         return ret
@@ -60,6 +179,9 @@ class SpysRuProxies(ProxySource):
     _XF4_TO_PORT_MAP = {'1': '3128',
                         '2': '8080',
                         '3': '80'}
+    _SPEC = ExtractionSpec(rows='//table[count(./tr)>20]/tr',
+                           ip=XPathField('./td[1]', extract_text=True, regex=r'(?<=\s)(?:\d{1,3}\.){3}\d{1,3}'),
+                           speed=XPathField('./td[7]/font/table/@width', convert=int, default=0))
 
     def __init__(self, web):
         self.web = web
@@ -74,17 +196,17 @@ class SpysRuProxies(ProxySource):
                 'xf2': '0',
                 'xf4': xf4}
             resp = await self.web.get(self.URL)
-            tree = html.fromstring(resp.content)
-            rows = tree.xpath('//table[count(./tr)>20]/tr')
-            for i in range(3, len(rows) - 1):
-                row = rows[i]
-                tds = row.xpath('./td')
-                speed = int(xpath_select(tds[6], './font/table/@width'))
-                if speed < self._MIN_SPEED:
-                    continue
-                ip = re.search(r'\s((?:\d{1,3}\.){3}\d{1,3})', tds[0].text_content()).group(1)
-                address = 'http://{}:{}/'.format(ip, self._XF4_TO_PORT_MAP[xf4])
-                ret.add(address)
+            ret |= await parse_in_pool(self.parse, resp.content, self._XF4_TO_PORT_MAP[xf4])
+        return ret
+
+    @classmethod
+    def parse(cls, content, port):
+        ret = set()
+        for record in cls._SPEC.extract_all(html.fromstring(content))[3:-1]:
+            if record['ip'] is None or record['speed'] < cls._MIN_SPEED:
+                continue
+            address = 'http://{}:{}/'.format(record['ip'], port)
+            ret.add(address)
         return ret
 
 
@@ -104,10 +226,14 @@ class GatherProxyProxies(ProxySource):
 
     async def getProxies(self):
         resp = await self.web.get(self.URL)
+        return await parse_in_pool(self.parse, resp.content)
+
+    @classmethod
+    def parse(cls, content):
         ret = set()
-        for match in re.finditer(self._RE_PATTERN, str(resp.content), re.VERBOSE):
+        for match in re.finditer(cls._RE_PATTERN, str(content), re.VERBOSE):
             type = match.group(4)
-            if self._ANONYMOUS and not (type == 'Anonymous' or type == 'Elite'):
+            if cls._ANONYMOUS and not (type == 'Anonymous' or type == 'Elite'):
                 continue
             # resp_time = int(match.group(3))
             # if resp_time > self._MAX_RESPONSE_TIME:
@@ -122,52 +248,59 @@ class ProxynovaProxies(ProxySource):
     _ANONYMOUS = False
     _MIN_SPEED = 5
     _RE_PATTERN = r'''((?:\d{1,3}\.){3}(?:\d{1,3}))'''
+    _SPEC = ExtractionSpec(rows='//table[@id="tbl_proxy_list"]/tbody/tr',
+                           ip=XPathField('td[1]', extract_text=True, regex=_RE_PATTERN),
+                           port=XPathField('td[2]', extract_text=True),
+                           # whatever "speed" is
+                           speed=XPathField('td[4]/div[@class="progress-bar"]/@data-value', strip=True,
+                                            convert=float, default=0),
+                           type=XPathField('td[7]', extract_text=True))
 
     def __init__(self, web):
         self.web = web
 
     async def getProxies(self):
         resp = await self.web.get(self.URL)
-        tree = html.fromstring(resp.content)
+        return await parse_in_pool(self.parse, resp.content)
+
+    @classmethod
+    def parse(cls, content):
         ret = set()
-        for row in tree.xpath('//table[@id="tbl_proxy_list"]/tbody/tr'):
-            tds = row.xpath('td')
-            if len(tds) >= 6:
-                # check speed, whatever "speed" is
-                speed = convert(xpath_select(tds[3], 'div[@class="progress-bar"]/@data-value', strip=True), float,
-                                default=0)
-                if speed < self._MIN_SPEED:
-                    continue
-                # check if anonymous
-                type = tds[6].text_content().strip()
-                if self._ANONYMOUS and not (type == 'Anonymous' or type == 'Elite'):
-                    continue
-                ip = tds[0].text_content().strip()
-                ip = re.search(self._RE_PATTERN, ip).group(1)
-                port = tds[1].text_content().strip()
-                address = 'http://{}:{}/'.format(ip, port)
-                ret.add(address)
+        for record in cls._SPEC.extract_all(html.fromstring(content)):
+            if record['ip'] is None or not record['port'] or record['speed'] < cls._MIN_SPEED:
+                continue
+            # check if anonymous
+            if cls._ANONYMOUS and not (record['type'] == 'Anonymous' or record['type'] == 'Elite'):
+                continue
+            address = 'http://{}:{}/'.format(record['ip'], record['port'])
+            ret.add(address)
         return ret
 
 
 class FreeproxylistProxies(ProxySource):
     URL = 'http://free-proxy-list.net/'
     _ANONYMOUS = False
+    _SPEC = ExtractionSpec(rows='//table[@id="proxylisttable"]/tbody/tr',
+                           ip=XPathField('./td[1]/text()', strip=True),
+                           port=XPathField('./td[2]/text()', strip=True),
+                           type=XPathField('./td[5]/text()', strip=True))
 
     def __init__(self, web):
         self.web = web
 
     async def getProxies(self):
         resp = await self.web.get(self.URL)
-        tree = html.fromstring(resp.content)
+        return await parse_in_pool(self.parse, resp.content)
+
+    @classmethod
+    def parse(cls, content):
         ret = set()
-        for row in tree.xpath('//table[@id="proxylisttable"]/tbody/tr'):
-            ip = xpath_select(row, './td[1]/text()', strip=True)
-            port = xpath_select(row, './td[2]/text()', strip=True)
-            type = xpath_select(row, './td[5]/text()', strip=True)
-            if self._ANONYMOUS and not (type == 'anonymous' or type == 'elite proxy'):
+        for record in cls._SPEC.extract_all(html.fromstring(content)):
+            if record['ip'] is None or record['port'] is None:
+                continue
+            if cls._ANONYMOUS and not (record['type'] == 'anonymous' or record['type'] == 'elite proxy'):
                 continue
-            address = 'http://{}:{}/'.format(ip.strip(), port.strip())
+            address = 'http://{}:{}/'.format(record['ip'], record['port'])
             ret.add(address)
         return ret
 
@@ -188,7 +321,9 @@ class WebAccessService(metaclass=ABCMeta):
                 async with aiohttp.ClientSession.get(selected_session, *args,
                                                      **kwargs) as resp:
                     resp.session = selected_session
+                    headers_received = time.time()
                     resp.content = await resp.read()
+                    resp.body_duration = time.time() - headers_received
                     return resp
         finally:
             if session is None:
@@ -231,8 +366,23 @@ class DirectWebAccess(WebAccessService):
         raise NotImplementedError()
 
 
+class SharedConnectorSession(aiohttp.ClientSession):
+    """ClientSession on a connector owned by somebody else; close leaves the connector and its connections open."""
+
+    def close(self):
+        self.detach()
+
+
 class ProxyWebAccess(WebAccessService):
-    """Wraps one proxy in a class that that provides access through that proxy."""
+    """Wraps one proxy in a class that that provides access through that proxy.
+
+    All sessions share one pool of at most POOL_SIZE keep-alive connections to the proxy, closed by close
+    when the proxy is evicted or given up. The request limit does not grow past POOL_SIZE, so that requests it lets
+    through never wait for a connection (which would count as latency).
+
+    The latency and transfer rate of successful requests scale the request limit into the selection weight, so that
+    a proxy answering in 200ms is picked far more often than one taking 20s per page.
+    """
     BAD_PROXY_EXCEPTIONS = (
         ConnectionResetError, aiohttp.ProxyConnectionError, aiohttp.HttpProxyError, aiohttp.errors.ContentEncodingError,
         aiohttp.errors.TransferEncodingError)
@@ -244,10 +394,24 @@ class ProxyWebAccess(WebAccessService):
     REDUCE_RATIO_THRESHOLD = 0.08
     MAX_REQUEST_INCREMENT = 5
     AGING_FACTOR = 0.95
-
-    def __init__(self, *args, proxy, test_url='http://google.com/', **kwargs):
+    POOL_SIZE = 32
+    KEEPALIVE_TIMEOUT = 30
+    # a saved state measured this recently is trusted without a test
+    STATE_FRESHNESS = 10 * 60
+    LATENCY_SMOOTHING = 0.2
+    # a proxy fetching a page of REFERENCE_PAGE_SIZE bytes in REFERENCE_LATENCY seconds weighs its request limit
+    REFERENCE_LATENCY = 1.0
+    REFERENCE_PAGE_SIZE = 100 * 1024
+    MIN_LATENCY = 0.001
+    MAX_SPEEDUP = 10.0
+    # smaller bodies arrive in a few packets, the time they take tells nothing about the bandwidth
+    MIN_RATE_SAMPLE_SIZE = 32 * 1024
+
+    def __init__(self, *args, proxy, test_url='http://google.com/', state=None, **kwargs):
         super().__init__(*args, **kwargs)
         self._proxy = proxy
+        self._connector = None
+        self._listeners = []
         self._test_url = test_url
         self._max_requests = self.MAX_REQUEST_INCREMENT
         self._request_semaphore = asyncio.Semaphore(value=0)
@@ -255,7 +419,59 @@ class ProxyWebAccess(WebAccessService):
         self._unsuccessful_requests = 0
         self._most_successful_requests = 0
         self._delay_exponent = self.DELAY_EXPONENT
-        asyncio.ensure_future(self._test())
+        self._tested = None
+        self._updated = 0
+        self._latency = None
+        self._latency_sketch = LatencySketch()
+        self._bytes_per_second = None
+        if state is None:
+            asyncio.ensure_future(self._test())
+        else:
+            self._restore(state)
+
+    def _restore(self, state):
+        """Resumes from a state saved by another process or before a restart."""
+        self._successful_requests = state['successful_requests']
+        self._unsuccessful_requests = state['unsuccessful_requests']
+        self._most_successful_requests = state['most_successful_requests']
+        self._delay_exponent = state['delay_exponent']
+        self._tested = state['tested']
+        self._updated = state['updated']
+        self._latency = state.get('latency')
+        self._latency_sketch = LatencySketch(state.get('latency_sketch'))
+        self._bytes_per_second = state.get('bytes_per_second')
+        if state['max_requests'] > 0 and time.time() - self._updated < self.STATE_FRESHNESS:
+            max_requests = min(state['max_requests'], self.POOL_SIZE)
+            for i in range(max_requests):
+                self._request_semaphore.release()
+            self._set_max_requests(max_requests)
+            delayed_ensure_future(self._measure_rate(), self.MEASURE_PERIOD)
+        elif state['max_requests'] > 0:
+            asyncio.ensure_future(self._test())
+        elif self._delay_exponent <= self.MAX_EXPONENT:
+            # the backoff of a failing proxy goes on where it stopped
+            delay = self.DELAY_BASE ** self._delay_exponent - (time.time() - (self._tested or 0))
+            delayed_ensure_future(self._test(), max(delay, 0))
+
+    def state(self):
+        return {
+            'max_requests': self._max_requests,
+            'successful_requests': self._successful_requests,
+            'unsuccessful_requests': self._unsuccessful_requests,
+            'most_successful_requests': self._most_successful_requests,
+            'delay_exponent': self._delay_exponent,
+            'tested': self._tested,
+            'updated': self._updated,
+            'latency': self._latency,
+            'latency_sketch': self._latency_sketch.to_dict(),
+            'bytes_per_second': self._bytes_per_second,
+            'weight': self.weight,
+        }
+
+    @property
+    def updated(self):
+        """Time of the last test or rate measurement."""
+        return self._updated
 
     def _assess_result(self, result):
         if result is None \
@@ -276,7 +492,7 @@ class ProxyWebAccess(WebAccessService):
             self._most_successful_requests = max(self._most_successful_requests, self._successful_requests)
             if error_ratio < self.MAINTAIN_RATIO_THRESHOLD \
                     and self._successful_requests >= self._most_successful_requests:
-                new_max_requests = self._max_requests + self.MAX_REQUEST_INCREMENT
+                new_max_requests = min(self._max_requests + self.MAX_REQUEST_INCREMENT, self.POOL_SIZE)
             elif error_ratio < self.REDUCE_RATIO_THRESHOLD:
                 new_max_requests = self._max_requests
                 # aging element
@@ -295,6 +511,9 @@ class ProxyWebAccess(WebAccessService):
         self._max_requests = new_max_requests
         self._successful_requests = 0
         self._unsuccessful_requests = 0
+        self._updated = time.time()
+        # the latency has moved the weight even if the request limit has not changed
+        self._notify()
         if self._max_requests == 0:
             delayed_ensure_future(self._test(), self.DELAY_BASE ** self._delay_exponent)
         else:
@@ -306,11 +525,12 @@ class ProxyWebAccess(WebAccessService):
             result = await self._get(self._test_url)
         except Exception as e:
             result = e
+        self._tested = self._updated = time.time()
         if self._assess_result(result):
             # logger.debug('test of proxy %s succeeded', self._proxy)
-            self._max_requests = self.MAX_REQUEST_INCREMENT
-            for i in range(self._max_requests):
+            for i in range(self.MAX_REQUEST_INCREMENT):
                 self._request_semaphore.release()
+            self._set_max_requests(self.MAX_REQUEST_INCREMENT)
             self._successful_requests = 0
             self._unsuccessful_requests = 0
             self._most_successful_requests = 0
@@ -321,11 +541,53 @@ class ProxyWebAccess(WebAccessService):
             self._delay_exponent += 1
             if self._delay_exponent <= self.MAX_EXPONENT:
                 delayed_ensure_future(self._test(), self.DELAY_BASE ** self._delay_exponent)
+            else:
+                self.close()
+
+    def _set_max_requests(self, max_requests):
+        changed = max_requests != self._max_requests
+        self._max_requests = max_requests
+        if changed:
+            self._notify()
+
+    def _notify(self):
+        for listener in self._listeners:
+            listener(self)
+
+    def add_listener(self, listener):
+        """Registers listener(proxy_access), called when performance changes and periodically as weight moves."""
+        self._listeners.append(listener)
+
+    def _record_transfer(self, duration, size, body_duration):
+        """Records a successful request: duration until the whole body was read, body_duration that of the body."""
+        duration = max(duration, self.MIN_LATENCY)
+        if self._latency is None:
+            self._latency = duration
+        else:
+            self._latency += self.LATENCY_SMOOTHING * (duration - self._latency)
+        self._latency_sketch.add(duration)
+        if size >= self.MIN_RATE_SAMPLE_SIZE:
+            rate = size / max(body_duration, self.MIN_LATENCY)
+            if self._bytes_per_second is None:
+                self._bytes_per_second = rate
+            else:
+                self._bytes_per_second += self.LATENCY_SMOOTHING * (rate - self._bytes_per_second)
 
     @property
     def performance(self):
         return self._max_requests
 
+    @property
+    def weight(self):
+        """Request limit scaled by the speed of the proxy relative to REFERENCE_LATENCY, up to MAX_SPEEDUP."""
+        if self._max_requests <= 0 or self._latency is None:
+            return self._max_requests
+        page_time = self._latency
+        if self._bytes_per_second:
+            # the latency of small pages hides a low bandwidth
+            page_time = max(page_time, self.REFERENCE_PAGE_SIZE / self._bytes_per_second)
+        return self._max_requests * min(self.MAX_SPEEDUP, self.REFERENCE_LATENCY / page_time)
+
     @property
     def proxy(self):
         return self._proxy
@@ -338,14 +600,22 @@ class ProxyWebAccess(WebAccessService):
         if self.user_agent is not None and 'User-Agent' not in headers:
             skip_auto.append('User-Agent')
             headers['User-Agent'] = self.user_agent() if callable(self.user_agent) else self.user_agent
-        connector = aiohttp.ProxyConnector(proxy=self._proxy, force_close=False, limit=1)
-        session = aiohttp.ClientSession(connector=connector, skip_auto_headers=skip_auto, headers=headers)
+        if self._connector is None or self._connector.closed:
+            self._connector = aiohttp.ProxyConnector(proxy=self._proxy, force_close=False, limit=self.POOL_SIZE,
+                                                     keepalive_timeout=self.KEEPALIVE_TIMEOUT)
+        session = SharedConnectorSession(connector=self._connector, skip_auto_headers=skip_auto, headers=headers)
         session.proxy = self._proxy
         session.get = functools.partial(self.get, session=session)
         return session
 
+    def close(self):
+        if self._connector is not None:
+            self._connector.close()
+            self._connector = None
+
     async def get(self, address, *args, **kwargs):
         result = None
+        start = time.time()
         try:
             self._request_semaphore.acquire()
             result = await self._get(address, *args, **kwargs)
@@ -359,6 +629,7 @@ class ProxyWebAccess(WebAccessService):
         finally:
             if self._assess_result(result):
                 self._successful_requests += 1
+                self._record_transfer(time.time() - start, len(result.content), result.body_duration)
             else:
                 self._unsuccessful_requests += 1
             self._request_semaphore.release()
@@ -368,20 +639,38 @@ class ProxyWebAccess(WebAccessService):
 
 
 class ProxyListService(WebAccessService):
+    """Pool of public proxies scraped from proxy list websites.
+
+    With a health_store, the state of the proxies and the blacklist are shared with the other processes every
+    SYNC_PERIOD and a new process starts from the saved states; the lists are scraped by one process at a time.
+    """
     UPDATE_PERIOD = 15 * 60
     UPDATE_TIMEOUT = 3 * 60
     RAND_RANGE = 5 * 60
+    SYNC_PERIOD = 30
     TEST_URL = 'http://google.com/'
     DEFAULT_TIMEOUT = 15
 
-    def __init__(self, timeout=DEFAULT_TIMEOUT):
+    def __init__(self, timeout=DEFAULT_TIMEOUT, health_store=None):
         super().__init__(timeout)
+        self._health_store = health_store
+        self._blacklisted = set()
+        self._synced = 0
         self.proxies_available_event = asyncio.Event()
         self._proxies = {}
+        # weights of the proxies, kept up to date by their listeners
+        self._sampler = WeightedSampler()
+        self._listeners = []
         directAccess = DirectWebAccess()
         self._proxy_lists = [GatherProxyProxies(directAccess), FreeproxylistProxies(directAccess),
                              ProxynovaProxies(directAccess), SpysRuProxies(self), ProxyListsProxies(self)]
-        asyncio.ensure_future(self._refresh_proxies())
+        asyncio.ensure_future(self._start())
+
+    async def _start(self):
+        if self._health_store is not None:
+            # warm start from the states saved by the other processes
+            await self._sync_health()
+        await self._refresh_proxies()
 
     async def _refresh_proxylist(self, proxylist):
         try:
@@ -391,17 +680,63 @@ class ProxyListService(WebAccessService):
             raise
         logger.info('Got %d proxies from %s', len(proxies), proxylist.URL)
         for proxy in proxies:
-            if proxy not in self._proxies:
-                self._proxies[proxy] = ProxyWebAccess(proxy=proxy, test_url=self.TEST_URL, timeout=self.timeout)
-                self.proxies_available_event.set()
-                self.proxies_available_event.clear()
+            if proxy not in self._proxies and proxy not in self._blacklisted:
+                self._add_proxy(ProxyWebAccess(proxy=proxy, test_url=self.TEST_URL, timeout=self.timeout))
+
+    def _add_proxy(self, proxy_access):
+        self._proxies[proxy_access.proxy] = proxy_access
+        proxy_access.add_listener(self._performance_changed)
+        self._performance_changed(proxy_access)
+
+    def _performance_changed(self, proxy_access):
+        if self._proxies.get(proxy_access.proxy) is not proxy_access:
+            return
+        self._sampler.set(proxy_access.proxy, proxy_access.weight)
+        for listener in self._listeners:
+            listener(proxy_access.proxy, proxy_access.weight)
+        if proxy_access.performance > 0:
+            self.proxies_available_event.set()
+            self.proxies_available_event.clear()
+
+    async def _sync_health(self):
+        """Saves the states changed since the last sync and adopts the proxies and blacklist of other processes."""
+        loop = asyncio.get_event_loop()
+        synced = time.time()
+        try:
+            states = {proxy: proxy_access.state() for proxy, proxy_access in self._proxies.items()
+                      if proxy_access.updated > self._synced}
+            await loop.run_in_executor(None, self._health_store.save, states)
+            shared, self._blacklisted = await loop.run_in_executor(None, self._health_store.load)
+        except Exception:
+            logger.exception('Could not synchronize the proxy health')
+        else:
+            self._synced = synced
+            for proxy in self._blacklisted & self._proxies.keys():
+                self._evict(proxy)
+            for proxy, state in shared.items():
+                if proxy not in self._proxies:
+                    self._add_proxy(ProxyWebAccess(proxy=proxy, test_url=self.TEST_URL, timeout=self.timeout,
+                                                   state=state))
+        delayed_ensure_future(self._sync_health(), self.SYNC_PERIOD)
+
+    def subscribe(self, listener):
+        """Registers listener(proxy, weight), called with every proxy now and on every change later.
+
+        An evicted proxy is reported with weight 0.
+        """
+        self._listeners.append(listener)
+        for proxy, proxy_access in self._proxies.items():
+            listener(proxy, proxy_access.weight)
 
     async def _refresh_proxies(self):
-        logger.info('Getting proxies from proxy list websites')
-        coros = []
-        for proxylist in self._proxy_lists:
-            coros.append(self._refresh_proxylist(proxylist))
-        await asyncio.gather(*coros, return_exceptions=True)
+        loop = asyncio.get_event_loop()
+        if self._health_store is None \
+                or await loop.run_in_executor(None, self._health_store.acquire_lists_refresh, self.UPDATE_PERIOD):
+            logger.info('Getting proxies from proxy list websites')
+            coros = []
+            for proxylist in self._proxy_lists:
+                coros.append(self._refresh_proxylist(proxylist))
+            await asyncio.gather(*coros, return_exceptions=True)
         delayed_ensure_future(self._refresh_proxies(),
                               self.UPDATE_PERIOD + random.randrange(-self.RAND_RANGE, self.RAND_RANGE))
 
@@ -422,21 +757,31 @@ class ProxyListService(WebAccessService):
         return await self._get(address, *args, **kwargs)
 
     def blacklist(self, session):
-        self._proxies.pop(session.proxy, None)
+        self._blacklisted.add(session.proxy)
+        self._evict(session.proxy)
+        if self._health_store is not None:
+            asyncio.get_event_loop().run_in_executor(None, self._health_store.blacklist, session.proxy)
+
+    def _evict(self, proxy):
+        proxy_access = self._proxies.pop(proxy, None)
+        if proxy_access is not None:
+            proxy_access.close()
+            self._sampler.remove(proxy)
+            for listener in self._listeners:
+                listener(proxy, 0)
 
     async def _random_proxy(self):
-        qualified_proxies = [k for k, v in self._proxies.items() if v.performance > 0]
-        while len(qualified_proxies) == 0:
+        while not self._sampler:
             await self.proxies_available_event.wait()
-            qualified_proxies = [k for k, v in self._proxies.items() if v.performance > 0]
-        return weighed_choice(qualified_proxies, lambda x: self._proxies[x].performance)
+        return self._sampler.sample()
 
 
 class ProxySessionService(WebAccessService):
+    """Sessions through proxies of a ProxyListService, picked by their weights using rng (a random.Random)."""
     MAX_RETRIES = 1024
 
     def __init__(self, proxy_service, *args, proxy_change_after=2, blacklist_exception_types=(),
-                 blacklist_response_codes=(), good_response_codes=(200,), **kwargs):
+                 blacklist_response_codes=(), good_response_codes=(200,), rng=None, **kwargs):
         super().__init__(*args, **kwargs)
         self._proxy_service = proxy_service
         self.proxy_change_after = proxy_change_after
@@ -444,6 +789,9 @@ class ProxySessionService(WebAccessService):
         self._blacklist_response_codes = blacklist_response_codes
         self._good_response_codes = good_response_codes
         self._blacklisted_proxies = set()
+        # weights of the proxies not blacklisted, subscribed to on first use
+        self._sampler = None
+        self._rng = rng
         self._netloc_to_sessions = {}
 
     async def get_session(self, address, *args, **kwargs):
@@ -466,24 +814,29 @@ class ProxySessionService(WebAccessService):
         netloc = urlparse(address).netloc
         self._netloc_to_sessions[netloc].append(session)
 
+    def _performance_changed(self, proxy, weight):
+        if proxy not in self._blacklisted_proxies:
+            self._sampler.set(proxy, weight)
+
     async def _random_proxy(self):
-        proxies = self._proxy_service.proxies
-        qualified_proxies = [k for k, v in proxies.items() if v.performance > 0 and k not in self._blacklisted_proxies]
-        while len(qualified_proxies) == 0:
+        if self._sampler is None:
+            self._sampler = WeightedSampler(rng=self._rng)
+            self._proxy_service.subscribe(self._performance_changed)
+        while not self._sampler:
             await self._proxy_service.proxies_available_event.wait()
-            proxies = self._proxy_service.proxies
-            qualified_proxies = [k for k, v in proxies.items()
-                                 if v.performance > 0 and k not in self._blacklisted_proxies]
-        return weighed_choice(qualified_proxies, lambda x: proxies[x].performance)
+        return self._sampler.sample()
 
     async def get(self, address, *args, **kwargs):
+        controller = get_congestion_controller(address)
         session = await self.get_session(address)
         result = None
         retries = 0
         while retries < self.MAX_RETRIES:
             retries += 1
             blacklist_proxy = False
+            succeeded = False
             result = None
+            await controller.acquire()
             try:
                 # logger.debug('GET %s', address)
                 result = await session.get(address, *args, timeout=self.timeout, **kwargs)
@@ -491,12 +844,15 @@ class ProxySessionService(WebAccessService):
                     blacklist_proxy = True
                 elif result is not None and hasattr(result,
                                                     'content') and result.status in self._good_response_codes:
+                    succeeded = True
                     break
             except self._blacklist_exception_types as e:
                 result = e
                 blacklist_proxy = True
             except FAIL_EXCEPTION_TYPES as e:
                 result = e
+            finally:
+                controller.release(result, succeeded, session.proxy)
             if blacklist_proxy:
                 self.blacklist(session)
                 # logger.debug('Query to %s failed, retrying, blacklisted proxy %s', address, session.proxy)
@@ -522,6 +878,8 @@ class ProxySessionService(WebAccessService):
 
     def blacklist(self, session):
         self._blacklisted_proxies.add(session.proxy)
+        if self._sampler is not None:
+            self._sampler.remove(session.proxy)
 
 
 class BaseTorService(WebAccessService):
@@ -558,6 +916,9 @@ class BaseTorService(WebAccessService):
         stem.util.log.get_logger().setLevel(logging.ERROR)
         self._exit_nodes = None
         self._relay_nodes = None
+        # fingerprints weighed by bandwidth
+        self._exit_sampler = WeightedSampler()
+        self._relay_sampler = WeightedSampler()
         self._selected_circuit_id = 0
         self._circuit_ids = {}
         self._circuit_creation_semaphore = asyncio.Semaphore(value=self.MAX_SIMULTANEOUS_CIRCUIT_REQUESTS)
@@ -591,6 +952,14 @@ class BaseTorService(WebAccessService):
     def exit_nodes(self):
         return list(self._exit_nodes)
 
+    @property
+    def relay_sampler(self):
+        return self._relay_sampler
+
+    @property
+    def exit_sampler(self):
+        return self._exit_sampler
+
     def _destroy(self):
         if not self._destroyed:
             self._destroyed = True
@@ -622,8 +991,7 @@ class BaseTorService(WebAccessService):
                     circuit_id = random.choice(tuple(self._circuit_ids.keys()))
                     logger.warning('selected_circuit_id not set, picked a random id: %s', circuit_id)
                 else:
-                    path = [weighed_choice(self._relay_nodes, lambda x: x.bandwidth).fingerprint,
-                            weighed_choice(self._exit_nodes, lambda x: x.bandwidth).fingerprint]
+                    path = [self._relay_sampler.sample(), self._exit_sampler.sample()]
                     circuit_id = self._controller.new_circuit(path, await_build=True)
                     logger.error('No circuits available, created a new 2-hop one: %s', circuit_id)
             self._controller.attach_stream(stream_event.id, circuit_id)
@@ -654,6 +1022,8 @@ class BaseTorService(WebAccessService):
                     self._relay_nodes.append(desc)
         self._exit_nodes.sort(key=lambda x: x.bandwidth, reverse=True)
         self._relay_nodes.sort(key=lambda x: x.bandwidth, reverse=True)
+        self._exit_sampler = WeightedSampler((node.fingerprint, node.bandwidth) for node in self._exit_nodes)
+        self._relay_sampler = WeightedSampler((node.fingerprint, node.bandwidth) for node in self._relay_nodes)
         delayed_ensure_future(self._get_tor_statuses(), 60 * 60)
 
     async def _random_circuit(self):
@@ -678,8 +1048,8 @@ class BaseTorService(WebAccessService):
                     # select a random (weighed) path
                     path = []
                     for i in range(length - 1):
-                        path.append(weighed_choice(self._relay_nodes, lambda x: x.bandwidth).fingerprint)
-                    path.append(weighed_choice(self._exit_nodes, lambda x: x.bandwidth).fingerprint)
+                        path.append(self._relay_sampler.sample())
+                    path.append(self._exit_sampler.sample())
                 # create a circuit
                 new_id = self._controller.new_circuit(path, await_build=False)
                 await asyncio.wait_for(self._wait_for_circuit(new_id), self.CIRCUIT_WAIT_TIMEOUT)
@@ -760,9 +1130,8 @@ class TorSessionService(WebAccessService):
         asyncio.ensure_future(self._restore_circuit_count())
 
     async def _restore_circuit_count(self):
-        relay_nodes = self._tor_service.relay_nodes
-        exit_nodes = [node for node in self._tor_service.exit_nodes if
-                      node.fingerprint not in self._blacklisted_exit_nodes]
+        relay_sampler = self._tor_service.relay_sampler
+        exit_sampler = self._tor_service.exit_sampler
         self._acceptable_circuits = tuple(k for k, v in self._tor_service.circuit_ids.items() if
                                           v.path[-1][0] not in self._blacklisted_exit_nodes)
         diff = self._optimal_circuit_number - len(self._acceptable_circuits)
@@ -770,8 +1139,7 @@ class TorSessionService(WebAccessService):
             self._restoring = True
             coros = []
             for i in range(diff):
-                path = [weighed_choice(relay_nodes, lambda x: x.bandwidth).fingerprint,
-                        weighed_choice(exit_nodes, lambda x: x.bandwidth).fingerprint]
+                path = [relay_sampler.sample(), exit_sampler.sample(exclude=self._blacklisted_exit_nodes)]
                 coros.append(self._tor_service.create_circuit(path=path))
             await asyncio.gather(*coros, return_exceptions=True)
             self._restoring = False
@@ -798,6 +1166,7 @@ class TorSessionService(WebAccessService):
         return random.choice(self._acceptable_circuits)
 
     async def get(self, address, *args, **kwargs):
+        controller = get_congestion_controller(address)
         session = await self.get_session(address)
         result = None
         retries = 0
@@ -805,12 +1174,15 @@ class TorSessionService(WebAccessService):
             retries += 1
             change_circuit = False
             blacklist_endpoint = False
+            succeeded = False
             result = None
+            await controller.acquire()
             try:
                 result = await session.get(address, *args, timeout=self.timeout, **kwargs)
                 if result.status in self._blacklist_response_codes:
                     blacklist_endpoint = True
                 elif result is not None and hasattr(result, 'content') and result.status in self._good_response_codes:
+                    succeeded = True
                     break
             except self._blacklist_exception_types as e:
                 result = e
@@ -820,6 +1192,8 @@ class TorSessionService(WebAccessService):
                 result = e
                 if retries % self.circuit_reset_after == 0:
                     change_circuit = True
+            finally:
+                controller.release(result, succeeded, session.circuit_id)
             if blacklist_endpoint:
                 self.blacklist(session)
                 logger.debug('Query to %s failed, retrying, blacklisted exit node of circuit %s', address,
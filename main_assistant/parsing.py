@@ -0,0 +1,40 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from billiard.process import current_process as current_pool_process
+from django.conf import settings
+
+parser_pool = None
+parser_pool_pid = None
+
+
+def may_have_children():
+    """False in daemonic processes, e.g. the workers of Celery's prefork pool, which cannot start parser processes."""
+    return not multiprocessing.current_process().daemon and not current_pool_process().daemon
+
+
+def get_parser_pool():
+    """Returns the parser pool of this process: processes, or threads where it may not have children.
+
+    The scraping workers of Celery's prefork pool are daemonic, so they parse in threads. Those are kept apart from
+    the default executor, which serves lease, archive and proxy health calls that must not wait behind parsing.
+    """
+    global parser_pool, parser_pool_pid
+    if parser_pool_pid != os.getpid():
+        # a pool inherited through fork belongs to the parent
+        workers = settings.SCRAPER_PARSE_WORKERS or os.cpu_count() or 1
+        parser_pool = ProcessPoolExecutor(max_workers=workers) if may_have_children() \
+            else ThreadPoolExecutor(max_workers=workers)
+        parser_pool_pid = os.getpid()
+    return parser_pool
+
+
+async def parse_in_pool(parser, *args):
+    """Runs parser(*args) in a parser process, keeping lxml work off the event loop.
+
+    The parser has to be picklable (a module level function or a classmethod), take and return plain data,
+    and must not touch the database. In processes which may not have children it runs in a parser thread.
+    """
+    return await asyncio.get_event_loop().run_in_executor(get_parser_pool(), parser, *args)
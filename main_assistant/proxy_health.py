@@ -0,0 +1,58 @@
+import json
+import time
+
+from django_redis import get_redis_connection
+
+HEALTH_KEY = 'proxy_health'
+BLACKLIST_KEY = 'proxy_blacklist'
+LISTS_REFRESH_KEY = 'proxy_lists_refresh'
+# states of proxies no process has measured for this long are dropped
+STATE_TIMEOUT = 7 * 24 * 60 * 60
+BLACKLIST_TIMEOUT = 24 * 60 * 60
+
+
+class ProxyHealthStore:
+    """States of the proxies (see ProxyWebAccess.state) and the proxy blacklist in Redis.
+
+    Shared by the ProxyListServices of all worker processes, so that a process starts with the proxies the others
+    have found and measured, and a proxy blacklisted by one of them is dropped by all for BLACKLIST_TIMEOUT.
+    """
+
+    def __init__(self):
+        self._redis = get_redis_connection('default')
+
+    def load(self):
+        """Returns proxy -> state of the proxies not blacklisted, and the set of blacklisted proxies."""
+        now = time.time()
+        with self._redis.pipeline() as pipe:
+            pipe.hgetall(HEALTH_KEY)
+            pipe.zrangebyscore(BLACKLIST_KEY, now - BLACKLIST_TIMEOUT, '+inf')
+            raw_states, raw_blacklisted = pipe.execute()
+        blacklisted = {proxy.decode() for proxy in raw_blacklisted}
+        states = {}
+        stale = []
+        for proxy, state in raw_states.items():
+            proxy, state = proxy.decode(), json.loads(state.decode())
+            if now - state['updated'] > STATE_TIMEOUT:
+                stale.append(proxy)
+            elif proxy not in blacklisted:
+                states[proxy] = state
+        if stale:
+            self._redis.hdel(HEALTH_KEY, *stale)
+        return states, blacklisted
+
+    def save(self, states):
+        if states:
+            self._redis.hmset(HEALTH_KEY, {proxy: json.dumps(state) for proxy, state in states.items()})
+
+    def blacklist(self, proxy):
+        now = time.time()
+        with self._redis.pipeline() as pipe:
+            pipe.zadd(BLACKLIST_KEY, **{proxy: now})
+            pipe.zremrangebyscore(BLACKLIST_KEY, 0, now - BLACKLIST_TIMEOUT)
+            pipe.hdel(HEALTH_KEY, proxy)
+            pipe.execute()
+
+    def acquire_lists_refresh(self, period):
+        """True for a single process per period, the one to scrape the proxy lists for all."""
+        return bool(self._redis.set(LISTS_REFRESH_KEY, 1, nx=True, ex=int(period)))
@@ -1,27 +1,34 @@
 import asyncio
-import functools
 import hashlib
 import logging
 import random
 import re
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 from datetime import datetime
 from urllib.parse import urljoin
 
 from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import transaction
-from django.db.models import F
+from django.db import connection, transaction
+from django.db.models import F, Max
 from django.utils.functional import SimpleLazyObject
 from lxml import etree, html
 from lxml.etree import ParserError
 from lxml.etree import XMLSyntaxError
 from user_agent import generate_user_agent
 
-from main_assistant.models import Publication, Author, Keyword, Article, Reference, SavedReference, DownloadBlock, \
-    DigitalLibrary
+from main_assistant.models import Publication, Author, Keyword, Article, Reference, SavedReference, DigitalLibrary, \
+    KeywordYearCount, PublicationYearCount
+from main_assistant.archive import archived
+from main_assistant.db_executor import get_database_executor
+from main_assistant.ingestion import ArticleWriter, insert_references, resolve_saved_references_after
+from main_assistant.known_documents import find_known_document
+from main_assistant.leases import LeaseScheduler, lease_indexes
 from main_assistant.network import ProxySessionService, ProxyListService
-from main_assistant.utils import run_async, xpath_select, convert, get_url_param, remove_url_params
+from main_assistant.parsing import parse_in_pool
+from main_assistant.proxy_health import ProxyHealthStore
+from main_assistant.utils import run_async, xpath_select, convert, get_url_param, remove_url_params, IntervalSet
 
 logger = logging.getLogger(__name__)
 
@@ -44,7 +51,7 @@ class ContentDistortedException(Exception):
             setattr(self, k, v)
 
 
-proxyListService = SimpleLazyObject(ProxyListService)
+proxyListService = SimpleLazyObject(lambda: ProxyListService(health_store=ProxyHealthStore()))
 
 
 # proxyListService = ProxyListService()
@@ -52,31 +59,15 @@ proxyListService = SimpleLazyObject(ProxyListService)
 
 class BaseProvider(metaclass=ABCMeta):
     """Base interface for publication search engines."""
+    # article numbers are leased to workers in ranges of this size, see LeaseScheduler
+    ARTICLES_PER_LEASE = 10000
+    MAX_LEASES_ACTIVE = 2
 
     @classmethod
     def get_or_create(cls):
         instance, created = DigitalLibrary.objects.get_or_create(name=cls.PROVIDER_NAME, defaults={'total_articles': 0})
         return instance
 
-    @classmethod
-    def merge_download_blocks(cls, digital_library):
-        with transaction.atomic():
-            digital_library = digital_library or cls.get_or_create()
-            blocks = digital_library.sorted_blocks
-            if blocks:
-                i = 1
-                previous = blocks[0]
-                while i < len(blocks):
-                    current = blocks[i]
-                    if previous.start + previous.size >= current.start:
-                        previous.size = max(previous.start + previous.size,
-                                            current.start + current.size) - previous.start
-                        previous.save()
-                        current.delete()
-                    else:
-                        previous = current
-                    i += 1
-
     @classmethod
     @abstractmethod
     def update_status(cls):
@@ -94,83 +85,135 @@ class BaseProvider(metaclass=ABCMeta):
 
     @classmethod
     async def download_block_coroutine(cls, start, size):
+        # articles of the block get greater ids, their pending references are resolved once the block is done
+        watermark = await get_database_executor().run(latest_article_id)
         coroutines_group = []
         for i in range(size):
             coroutines_group.append(cls.download_article(start + i))
         results = await asyncio.gather(*coroutines_group, return_exceptions=True)
-        await asyncio.get_event_loop().run_in_executor(None, cls.mark_as_processed, start, size)
+        # buffered articles have to be saved before the block counts as processed
+        await cls.get_writer().flush()
+        await get_database_executor().run(cls.mark_as_processed, start, size)
+        await get_database_executor().run(cls.resolve_saved_references, watermark)
         unsuccessful = sum(1 for res in results if isinstance(res, BaseException))
         logger.info('%s has finished the processing of block: (%d, %d), unsuccessful: %d', cls.__name__, start,
                     start + size, unsuccessful)
         return results
 
     @classmethod
-    async def download_articles_coroutine(cls):
-
-        def split_generator(current, diff):
-            end = current + diff
-            while current < end:
-                size = min(cls.ARTICLES_PER_COROUTINE, end - current)
-                yield cls.download_block_coroutine(current, size)
-                current += size
-
-        def group_generator():
-            instance = cls.get_or_create()
-            current = 0
-            # holes
-            for block in instance.sorted_blocks:
-                # space before current block
-                diff = block.start - current
-                if diff > 0:
-                    yield from split_generator(current, diff)
-                # update end marker
-                current = block.start + block.size
-            # new ones
-            diff = instance.total_articles - current
-            if diff > 0:
-                yield from split_generator(current, diff)
-
-        # generator = group_generator()
-        pending = set()
-
-        async def await_one():
-            nonlocal pending
-            try:
-                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
-            except Exception:
-                logger.exception('Exception while processing block:')
-
-        for group in group_generator():
-            pending.add(group)
-            if len(pending) >= cls.MAX_COROUTINES_ACTIVE:
-                await await_one()
-        while pending:
-            await await_one()
-
-    @classmethod
-    def download_articles(cls):
-        lock_name = '{}_scraping_task_lock'.format(cls.__name__)
-        acquire_lock = lambda: cache.add(lock_name, 'true')
-        release_lock = lambda: cache.delete(lock_name)
-        if acquire_lock():
-            logger.info('Starting scraping task for %s', cls.__name__)
-            try:
-                if cls.update_status():
-                    run_async(cls.download_articles_coroutine())
-            finally:
-                release_lock()
-            logger.info('Completed scraping task for %s', cls.__name__)
+    async def download_range_coroutine(cls, scheduler, lease, semaphore, reprocess=False):
+        loop = asyncio.get_event_loop()
+
+        async def download_block(start, size):
+            async with semaphore:
+                if not lease.lost:
+                    return await cls.download_block_coroutine(start, size)
+
+        try:
+            # another worker may have finished parts of the range before the lease was acquired
+            instance = await get_database_executor().run(cls.get_or_create)
+            processed = IntervalSet() if reprocess else instance.processed
+            blocks = []
+            for start, size in processed.gaps(lease.start, min(lease.end, instance.total_articles)):
+                end = start + size
+                while start < end:
+                    blocks.append(download_block(start, min(cls.ARTICLES_PER_COROUTINE, end - start)))
+                    start += cls.ARTICLES_PER_COROUTINE
+            lease.start_renewal()
+            results = await asyncio.gather(*blocks, return_exceptions=True)
+        except Exception as e:
+            results = [e]
+        failures = [result for result in results if isinstance(result, BaseException)]
+        for failure in failures:
+            logger.error('Exception while processing range %d of %s', lease.index, cls.__name__, exc_info=failure)
+        # failed blocks are not marked as processed, the range is returned for a retry
+        if failures:
+            await loop.run_in_executor(None, scheduler.fail, lease)
         else:
-            logger.warning('Could not start scraping task for  %s - already running', cls.__name__)
+            await loop.run_in_executor(None, scheduler.release, lease)
+        return not failures
+
+    @classmethod
+    async def download_articles_coroutine(cls, reprocess=False):
+        """Downloads the article numbers missing from the library's progress, or all of them if reprocess is set.
+
+        Reprocessed articles replace the saved ones; reprocessing runs lease ranges apart from the regular ones.
+        Returns the indexes of the ranges skipped (leased by another worker) or failed.
+        """
+        loop = asyncio.get_event_loop()
+        instance = await get_database_executor().run(cls.get_or_create)
+        processed = IntervalSet() if reprocess else instance.processed
+        scheduler = LeaseScheduler(cls.PROVIDER_NAME + (':reprocess' if reprocess else ''), cls.ARTICLES_PER_LEASE)
+        semaphore = asyncio.Semaphore(cls.MAX_COROUTINES_ACTIVE)
+        ranges = {}
+        incomplete = []
+        # the writer of this run, get_writer returns it until the run ends
+        writer, cls._writer = cls.get_writer(), ArticleWriter(cls.PROVIDER_NAME, replace=reprocess)
+        try:
+            # holes and new ones, ranges leased by other workers are skipped
+            for index in lease_indexes(processed.gaps(0, instance.total_articles), cls.ARTICLES_PER_LEASE):
+                lease = await loop.run_in_executor(None, scheduler.acquire, index)
+                if lease is None:
+                    incomplete.append(index)
+                    continue
+                logger.debug('%s has leased range %d', cls.__name__, index)
+                future = asyncio.ensure_future(cls.download_range_coroutine(scheduler, lease, semaphore, reprocess))
+                ranges[future] = index
+                pending = [f for f in ranges if not f.done()]
+                if len(pending) >= cls.MAX_LEASES_ACTIVE:
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            if ranges:
+                await asyncio.wait(ranges)
+        finally:
+            cls._writer = writer
+        incomplete += [index for future, index in ranges.items() if future.exception() or not future.result()]
+        return sorted(incomplete)
+
+    @classmethod
+    def download_articles(cls, reprocess=False):
+        """Returns the indexes of the ranges left incomplete, see download_articles_coroutine."""
+        logger.info('Starting scraping task for %s', cls.__name__)
+        incomplete = []
+        if cls.update_status():
+            incomplete = run_async(cls.download_articles_coroutine(reprocess))
+        logger.info('Completed scraping task for %s, ranges left incomplete: %s', cls.__name__, incomplete)
+        return incomplete
 
     @classmethod
     def mark_as_processed(cls, start, size):
+        cls.get_or_create()
         with transaction.atomic():
-            block = DownloadBlock()
-            block.library = cls.get_or_create()
-            block.start = start
-            block.size = size
-            block.save()
+            # blocks finish concurrently, the row lock serializes the read-modify-write of the progress
+            instance = DigitalLibrary.objects.select_for_update().get(name=cls.PROVIDER_NAME)
+            processed = instance.processed
+            processed.add(start, size)
+            instance.progress = processed.to_bytes()
+            instance.save(update_fields=['progress'])
+
+    @classmethod
+    def get_writer(cls):
+        """Write-behind buffer of the provider; add_single_document implementations may pass it scraped_articles."""
+        if '_writer' not in cls.__dict__:
+            cls._writer = ArticleWriter(cls.PROVIDER_NAME)
+        return cls._writer
+
+    @classmethod
+    def parse_document(cls, content, url):
+        """Extracts plain data (e.g. a scraped_article) from the content (bytes) of the page fetched from url.
+
+        Implemented by providers which parse their pages through parse. Runs in a parser process, see parse_in_pool:
+        it must not touch the database, and its result must be picklable.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    async def parse(cls, response):
+        return await parse_in_pool(cls.parse_document, response.content, str(response.url))
+
+    @classmethod
+    def internal_identifier_from_url(cls, url):
+        """Internal identifier of the document at url without fetching it, None if the URL does not tell."""
+        return None
 
     @classmethod
     @abstractmethod
@@ -183,28 +226,28 @@ class BaseProvider(metaclass=ABCMeta):
         raise NotImplementedError
 
     @classmethod
-    def process_saved_references(cls, article, internal_identifier):
-        saved_references = SavedReference.objects.filter(referred_location=internal_identifier,
-                                                         referred_location_is_internal_identifier=True,
-                                                         referring__publication__digital_library__name=cls.PROVIDER_NAME)
-        references = []
-        for saved_reference in saved_references:
-            referring = saved_reference.referring
-            references.append(Reference(referring=referring, referred=article))
-        Reference.objects.bulk_create(references)
-        saved_references.delete()
+    def resolve_saved_references(cls, after_id):
+        """Turns SavedReferences pointing at articles added after after_id into references in one statement."""
+        with transaction.atomic(), connection.cursor() as cursor:
+            pairs = resolve_saved_references_after(cursor, after_id, cls.get_or_create().pk)
+            Reference.objects.update_counts(pairs)
+        return pairs
+
+    @classmethod
+    def update_year_counts(cls, articles):
+        """To be called by add_single_document implementations once the articles' keywords are saved."""
+        article_ids = [article.pk for article in articles]
+        KeywordYearCount.objects.add_articles(article_ids)
+        PublicationYearCount.objects.add_articles(article_ids)
 
     @classmethod
     async def add_reference(cls, article, url):
-        loop = asyncio.get_event_loop()
         ref = None
         try:
             document = await document_from_url(url)
             if document:
-                ref = await loop.run_in_executor(None,
-                                                 functools.partial(Reference.objects.get_or_create,
-                                                                   referring=article,
-                                                                   referred=document))
+                ref = await get_database_executor().run(Reference.objects.get_or_create, referring=article,
+                                                        referred=document)
         except Exception:
             logger.exception(
                 "Exception thrown while processing a reference with url: {}\n from document {}:".format(
@@ -213,18 +256,31 @@ class BaseProvider(metaclass=ABCMeta):
         return ref
 
 
+for provider_class in BaseProvider.__subclasses__():
+    provider_class.web = archived(provider_class.web)
+
 providers_map = {provider.PROVIDER_NAME: provider for provider in BaseProvider.__subclasses__()}
 url_providers_map = {provider.URL_PATTERN: provider for provider in BaseProvider.__subclasses__()}
 
 
+def known_document_from_url(url):
+    for pattern, provider in url_providers_map.items():
+        if re.search(pattern, url):
+            return find_known_document(url, provider.PROVIDER_NAME, provider.internal_identifier_from_url(url))
+    return find_known_document(url)
+
+
 async def document_from_url(url):
-    loop = asyncio.get_event_loop()
+    # references to saved articles need no fetch
+    article = await get_database_executor().run(known_document_from_url, url)
+    if article is not None:
+        return article
     web = random.choice([provider.web for provider in BaseProvider.__subclasses__()])
     while True:
         try:
             r = await web.get(url)
             final_url = r.url
-            provider = await loop.run_in_executor(None, select_provider, final_url)
+            provider = await get_database_executor().run(select_provider, final_url)
             if provider:
                 return await provider.add_referenced_document(r)
             else:
@@ -239,15 +295,75 @@ async def document_from_url(url):
             raise
 
 
+def latest_article_id():
+    return Article.objects.aggregate(Max('id'))['id__max'] or 0
+
+
 def select_provider(url):
     for pattern, provider in url_providers_map.items():
         if re.search(pattern, url) and provider.get_or_create().enabled:
             return provider
 
 
+SWEEP_CHUNK_SIZE = 1000
+SWEEP_CONCURRENCY = 16
+SWEEP_CURSOR_KEY = 'saved_reference_sweep_cursor'
+
+
+def saved_references_chunk(after_id, size):
+    """Returns the last id and location -> [(id, referring id)] of the next URL SavedReferences after after_id."""
+    rows = list(SavedReference.objects.filter(id__gt=after_id, referred_location_is_internal_identifier=False)
+                .order_by('id').values_list('id', 'referring_id', 'referred_location')[:size])
+    groups = OrderedDict()
+    for saved_id, referring_id, location in rows:
+        groups.setdefault(location, []).append((saved_id, referring_id))
+    return (rows[-1][0] if rows else after_id), groups
+
+
+def save_swept_references(resolved):
+    """Creates references for (referred id, [(saved reference id, referring id)]) and deletes the SavedReferences."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        pairs = insert_references(cursor, {(referring_id, referred_id)
+                                           for referred_id, saved in resolved for _, referring_id in saved})
+        Reference.objects.update_counts(pairs)
+        SavedReference.objects.filter(id__in=[saved_id for _, saved in resolved for saved_id, _ in saved]).delete()
+
+
+async def sweep_saved_references(chunk_size=SWEEP_CHUNK_SIZE, concurrency=SWEEP_CONCURRENCY):
+    """Resolves SavedReferences to URLs chunk by chunk, fetching every location of a chunk once.
+
+    The id of the last handled SavedReference is kept in the cache, an interrupted sweep resumes after it.
+    References to internal identifiers are left to BaseProvider.resolve_saved_references.
+    """
+    executor = get_database_executor()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def resolve(location):
+        async with semaphore:
+            try:
+                return await document_from_url(location)
+            except Exception:
+                # logged by document_from_url, the SavedReferences stay for the next sweep
+                return None
+
+    after_id = cache.get(SWEEP_CURSOR_KEY, 0)
+    next_chunk = asyncio.ensure_future(executor.run(saved_references_chunk, after_id, chunk_size))
+    while True:
+        last_id, groups = await next_chunk
+        if not groups:
+            break
+        # the next chunk is read while this one is being resolved
+        next_chunk = asyncio.ensure_future(executor.run(saved_references_chunk, last_id, chunk_size))
+        locations = list(groups)
+        documents = await asyncio.gather(*[resolve(location) for location in locations])
+        resolved = [(document.pk, groups[location]) for location, document in zip(locations, documents) if document]
+        if resolved:
+            await executor.run(save_swept_references, resolved)
+        cache.set(SWEEP_CURSOR_KEY, last_id, timeout=None)
+        logger.info('Reference sweep resolved %d of %d locations up to SavedReference %d', len(resolved),
+                    len(locations), last_id)
+    cache.delete(SWEEP_CURSOR_KEY)
+
+
 def saved_reference_sweep():
-    # TODO test, run
-    for saved_ref in SavedReference.objects.all():
-        ref = run_async(BaseProvider.add_reference(saved_ref.referring, saved_ref.referred_location))
-        if isinstance(ref, Reference):
-            saved_ref.delete()
+    run_async(sweep_saved_references())
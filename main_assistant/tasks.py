@@ -1,20 +1,34 @@
+import ast
+
 from celery import shared_task
 from celery.task.control import inspect
+from django.conf import settings
 
 from main_assistant.models import DigitalLibrary
 
 
-def scheduled_or_active_count(sought_task):
-    count = 0
-    for item in inspect().scheduled().items():
-        for task in item[1]:
-            if task['name'] == sought_task.name:
-                count += 1
-    for item in inspect().active().items():
-        for task in item[1]:
-            if task['name'] == sought_task.name:
-                count += 1
-    return count
+def task_args(task):
+    """Arguments of a task reported by inspect, as a list; None if the repr cannot be parsed (e.g. truncated)."""
+    args = task.get('args')
+    if not isinstance(args, str):
+        return list(args) if args is not None else None
+    try:
+        return list(ast.literal_eval(args))
+    except (ValueError, SyntaxError, TypeError):
+        return None
+
+
+def scheduled_or_active_count(sought_task, args=None):
+    """Number of sought_task instances, with the given args if any, held by workers: waiting for their eta,
+    prefetched or running.
+    """
+    control = inspect()
+    # scheduled entries describe the task under 'request', the others are the task descriptions themselves
+    tasks = [entry['request'] for entries in (control.scheduled() or {}).values() for entry in entries]
+    for held in (control.reserved(), control.active()):
+        tasks += [task for entries in (held or {}).values() for task in entries]
+    return sum(1 for task in tasks
+               if task.get('name') == sought_task.name and (args is None or task_args(task) == list(args)))
 
 
 @shared_task
@@ -34,8 +48,10 @@ def update_articles(selected_provider_names):
 def update_articles_periodic():
     enabled_dls = DigitalLibrary.objects.filter(enabled=True)
     enabled_provider_names = [dl.name for dl in enabled_dls]
+    # workers scraping the same library share the work through leases on article number ranges
     for provider_name in enabled_provider_names:
-        if not scheduled_or_active_count(download):
+        running = scheduled_or_active_count(download, (provider_name,))
+        for _ in range(settings.SCRAPING_TASKS_PER_LIBRARY - running):
             download.delay(provider_name)
 
 
@@ -49,3 +65,25 @@ def update_index_periodic():
 def trigger_reference_sweep():
     from main_assistant.services import saved_reference_sweep
     saved_reference_sweep()
+
+
+@shared_task
+def rebuild_citation_graph_periodic():
+    from main_assistant.citation_graph import build_citation_graph
+    build_citation_graph()
+
+
+@shared_task
+def update_bibliometrics_periodic():
+    from main_assistant.bibliometrics import update_bibliometrics
+    update_bibliometrics()
+
+
+@shared_task
+def fold_count_deltas_periodic():
+    from main_assistant.models import KeywordOccurrenceDelta, CitedCountDelta, KeywordYearCount, \
+        PublicationYearCount
+    KeywordOccurrenceDelta.objects.fold()
+    CitedCountDelta.objects.fold()
+    KeywordYearCount.objects.fold()
+    PublicationYearCount.objects.fold()
@@ -1,42 +1,48 @@
+import asyncio
+import random
+import time
 from datetime import date
+from types import SimpleNamespace
 
 from django.db import transaction
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase
 
 # Create your tests here.
 from unittest.mock import patch, PropertyMock, call
 
+import numpy as np
 from lxml import html
+from scipy import sparse
 
-from main_assistant.models import DigitalLibrary, DownloadBlock, Keyword, Author, Reference, Article
+from main_assistant.models import DigitalLibrary, Keyword, Author, Reference, Article, Publication, \
+    KeywordYearCount, PublicationYearCount
+from main_assistant.bibliometrics import h_indexes, pagerank
+from main_assistant.ingestion import ArticleWriter
+from main_assistant.leases import lease_indexes
+from main_assistant.network import CongestionController, ProxyWebAccess
 from main_assistant.services import BaseProvider
+from main_assistant.tasks import scheduled_or_active_count, download
 
 # TODO split when becomes too large
 # TODO remove network access
 # just love nondeterministic tests
 # TODO split db tests
-from main_assistant.utils import run_async
+from main_assistant.utils import run_async, PrefixIndex, IntervalSet, BloomFilter, normalize_url, ExtractionSpec, \
+    XPathField, WeightedSampler, LatencySketch
 
 
 class BaseProviderTests(TestCase):
-    def test_merge_download_blocks(self):
+    def test_mark_as_processed(self):
         with transaction.atomic():
             library = DigitalLibrary(name='TestDLibrary', total_articles=0)
             library.save()
-            blocks = [DownloadBlock(start=1024, size=1024, library=library),
-                      DownloadBlock(start=2048, size=1024, library=library),
-                      DownloadBlock(start=4096, size=1024, library=library),
-                      DownloadBlock(start=5120, size=1024, library=library)]
-            DownloadBlock.objects.bulk_create(blocks)
-        self.assertEqual(4, DownloadBlock.objects.filter(library=library).count())
-        with transaction.atomic():
-            BaseProvider.merge_download_blocks(library)
-        self.assertEqual(2, DownloadBlock.objects.filter(library=library).count())
-        blocks = library.sorted_blocks
-        self.assertEqual(2048, blocks[0].size)
-        self.assertEqual(2048, blocks[1].size)
-        self.assertEqual(1024, blocks[0].start)
-        self.assertEqual(4096, blocks[1].start)
+        with patch.object(BaseProvider, 'PROVIDER_NAME', create=True, new_callable=PropertyMock,
+                          return_value='TestDLibrary'):
+            for start in (1024, 4096, 2048, 5120):
+                BaseProvider.mark_as_processed(start, 1024)
+        library.refresh_from_db()
+        self.assertEqual([(1024, 2048), (4096, 2048)], list(library.processed))
+        self.assertEqual(4096, library.processed_block_articles)
 
     def test_schedule(self):
         with patch('main_assistant.services.download') as mock_update_articles:
@@ -54,13 +60,9 @@ class BaseProviderTests(TestCase):
 
     def test_schedule_download(self):
         with transaction.atomic():
-            library = DigitalLibrary(name='TestDLibrary', total_articles=7186)
+            library = DigitalLibrary(name='TestDLibrary', total_articles=7186,
+                                     progress=IntervalSet([1024, 3072, 4096, 6144]).to_bytes())
             library.save()
-            blocks = [DownloadBlock(start=1024, size=1024, library=library),
-                      DownloadBlock(start=2048, size=1024, library=library),
-                      DownloadBlock(start=4096, size=1024, library=library),
-                      DownloadBlock(start=5120, size=1024, library=library), ]
-            DownloadBlock.objects.bulk_create(blocks)
         with patch.object(BaseProvider, 'get_or_create') as mock_get_or_create:
             with patch('main_assistant.services.download') as mock_update_articles:
                 with patch.object(BaseProvider, 'ARTICLES_PER_TASK', create=True, new_callable=PropertyMock,
@@ -76,3 +78,313 @@ class BaseProviderTests(TestCase):
                             mock_update_articles.delay.assert_has_calls(expected_calls)
 
 
+class YearCountTests(TestCase):
+    def setUp(self):
+        library = DigitalLibrary.objects.create(name='TestDLibrary', total_articles=0)
+        self.publication = Publication.objects.create(identifier='1234-5678', location='', is_journal=True,
+                                                      digital_library=library)
+        self.keywords = [Keyword.objects.create(keyword=keyword) for keyword in ('neural network', 'security')]
+        self.articles = []
+        for number, (issue_date, keywords) in enumerate([(date(2015, 3, 1), self.keywords),
+                                                         (date(2015, 9, 1), self.keywords[:1]),
+                                                         (date(2016, 1, 1), self.keywords[1:]),
+                                                         (None, self.keywords[:1])]):
+            article = Article.objects.create(identifier=str(number), title='', location='', issue_date=issue_date,
+                                             publication=self.publication if issue_date else None)
+            article.keywords.add(*keywords)
+            self.articles.append(article)
+
+    def keyword_counts(self):
+        KeywordYearCount.objects.fold()
+        return {(count.keyword_id, count.publication_id, count.year): count.count
+                for count in KeywordYearCount.objects.all()}
+
+    def publication_counts(self):
+        PublicationYearCount.objects.fold()
+        return {(count.publication_id, count.year): count.count for count in PublicationYearCount.objects.all()}
+
+    def expected_counts(self):
+        neural, security = (keyword.id for keyword in self.keywords)
+        publication = self.publication.id
+        return ({(neural, publication, 2015): 2, (security, publication, 2015): 1,
+                 (security, publication, 2016): 1, (neural, None, None): 1},
+                {(publication, 2015): 2, (publication, 2016): 1, (None, None): 1})
+
+    def test_add_articles(self):
+        ids = [article.id for article in self.articles]
+        for article_ids in (ids[:2], ids[2:], []):
+            KeywordYearCount.objects.add_articles(article_ids)
+            PublicationYearCount.objects.add_articles(article_ids)
+        self.assertEqual(self.expected_counts(), (self.keyword_counts(), self.publication_counts()))
+
+    def test_remove_articles(self):
+        ids = [article.id for article in self.articles]
+        KeywordYearCount.objects.add_articles(ids)
+        PublicationYearCount.objects.add_articles(ids)
+        KeywordYearCount.objects.remove_articles(ids[1:3])
+        PublicationYearCount.objects.remove_articles(ids[1:3])
+        neural, security = (keyword.id for keyword in self.keywords)
+        publication = self.publication.id
+        self.assertEqual({(neural, publication, 2015): 1, (security, publication, 2015): 1,
+                          (security, publication, 2016): 0, (neural, None, None): 1}, self.keyword_counts())
+        self.assertEqual({(publication, 2015): 1, (publication, 2016): 0, (None, None): 1}, self.publication_counts())
+
+    def test_rebuild(self):
+        # a stale summary, missing most of the articles
+        KeywordYearCount.objects.add_articles([self.articles[0].id])
+        PublicationYearCount.objects.add_articles([self.articles[0].id])
+        KeywordYearCount.objects.rebuild()
+        PublicationYearCount.objects.rebuild()
+        self.assertEqual(self.expected_counts(), (self.keyword_counts(), self.publication_counts()))
+
+
+class ScheduledOrActiveCountTests(SimpleTestCase):
+    def test_count(self):
+        name = download.name
+        with patch('main_assistant.tasks.inspect') as mock_inspect:
+            control = mock_inspect.return_value
+            control.scheduled.return_value = {
+                'worker1': [{'eta': '2016-10-20T10:00:00', 'priority': 6,
+                             'request': {'name': name, 'args': "['TestDLibrary']", 'kwargs': '{}'}}],
+            }
+            control.reserved.return_value = {'worker1': [{'name': name, 'args': "('TestDLibrary',)"}]}
+            control.active.return_value = {
+                'worker1': [{'name': name, 'args': "['TestDLibrary']"}, {'name': name, 'args': "['OtherLibrary']"},
+                            {'name': 'other.task', 'args': "['TestDLibrary']"}],
+                'worker2': [{'name': name, 'args': "['TestDLib..."}],
+            }
+            self.assertEqual(3, scheduled_or_active_count(download, ('TestDLibrary',)))
+            self.assertEqual(5, scheduled_or_active_count(download))
+            control.scheduled.return_value = control.reserved.return_value = control.active.return_value = None
+            self.assertEqual(0, scheduled_or_active_count(download, ('TestDLibrary',)))
+
+
+class ArticleWriterTests(SimpleTestCase):
+    def test_failed_batch(self):
+        executor = SimpleNamespace(run=asyncio.coroutine(lambda function, *args: function(*args)))
+        saved = []
+
+        def write(documents):
+            if not saved:
+                saved.append(None)
+                raise ConnectionError()
+            saved.extend(documents)
+
+        writer = ArticleWriter('TestDLibrary', batch_size=2)
+        with patch('main_assistant.ingestion.get_database_executor', return_value=executor), \
+                patch.object(writer, 'write', side_effect=write):
+            run_async(writer.add('a'))
+            with self.assertRaises(ConnectionError):
+                run_async(writer.add('b'))
+            self.assertEqual(2, len(writer))
+            run_async(writer.add('c'))
+            run_async(writer.flush())
+        self.assertEqual([None, 'a', 'b', 'c'], saved)
+        self.assertEqual(0, len(writer))
+
+
+class PrefixIndexTests(SimpleTestCase):
+    def test_search(self):
+        entries = [{'id': 1, 'keyword': 'neural network', 'count': 50},
+                   {'id': 2, 'keyword': 'network security', 'count': 80},
+                   {'id': 3, 'keyword': 'Neuron', 'count': 3},
+                   {'id': 4, 'keyword': 'graph-based networks', 'count': 10}]
+        index = PrefixIndex(entries, 'keyword', 'count', 3)
+        self.assertEqual([2, 1, 4], [entry['id'] for entry in index.search('net')])
+        self.assertEqual([2, 1, 4], [entry['id'] for entry in index.search('ne')])
+        self.assertEqual([2, 1], [entry['id'] for entry in index.search('n', 2)])
+        self.assertEqual([1], [entry['id'] for entry in index.search('NEURAL  net')])
+        self.assertEqual([4], [entry['id'] for entry in index.search('graph-based n')])
+        self.assertEqual([], index.search('security x'))
+        self.assertEqual([], index.search(''))
+
+    def test_search_blocks(self):
+        rng = random.Random(3)
+        words = ['net', 'network', 'neural', 'graph', 'security', 'learning', 'deep']
+        entries = [{'id': i, 'keyword': ' '.join(rng.choice(words) for _ in range(rng.randint(1, 3))),
+                    'count': rng.randrange(100)} for i in range(300)]
+        with patch.object(PrefixIndex, 'BLOCK_SIZE', 4):
+            index = PrefixIndex(entries, 'keyword', 'count', 10)
+        for prefix in ('n', 'net', 'netw', 'neural n', 'deep learning', 'x'):
+            expected = sorted((entry for entry in entries
+                               if any(suffix.startswith(prefix) for suffix in
+                                      (' '.join(entry['keyword'].split()[i:]) for i in range(3)))),
+                              key=lambda entry: (-entry['count'], entry['id']))[:10]
+            self.assertEqual([entry['id'] for entry in expected], [entry['id'] for entry in index.search(prefix)])
+
+
+class IntervalSetTests(SimpleTestCase):
+    def test_add(self):
+        processed = IntervalSet()
+        for start, size in [(10, 5), (30, 5), (15, 5), (0, 3), (25, 10), (2, 1)]:
+            processed.add(start, size)
+        self.assertEqual([(0, 3), (10, 10), (25, 10)], list(processed))
+        self.assertEqual(23, processed.count)
+        self.assertIn(19, processed)
+        self.assertNotIn(20, processed)
+        processed.add(1, 30)
+        self.assertEqual([(0, 35)], list(processed))
+        self.assertEqual(35, processed.count)
+
+    def test_gaps(self):
+        processed = IntervalSet([1024, 3072, 4096, 6144])
+        self.assertEqual([(0, 1024), (3072, 1024), (6144, 1042)], list(processed.gaps(0, 7186)))
+        self.assertEqual([(3072, 1024)], list(processed.gaps(2000, 5000)))
+
+    def test_serialization(self):
+        processed = IntervalSet([0, 7, 100, 2 ** 40])
+        restored = IntervalSet.from_bytes(processed.to_bytes())
+        self.assertEqual(list(processed), list(restored))
+        self.assertEqual(processed.count, restored.count)
+        self.assertEqual(0, IntervalSet.from_bytes(b'').count)
+
+
+class BloomFilterTests(SimpleTestCase):
+    def test_membership(self):
+        known = BloomFilter(1000)
+        for i in range(1000):
+            known.add('location:http://example.com/{}'.format(i))
+        self.assertTrue(all('location:http://example.com/{}'.format(i) in known for i in range(1000)))
+        false_positives = sum('location:http://example.org/{}'.format(i) in known for i in range(1000))
+        self.assertLess(false_positives, 50)
+        self.assertEqual(1000, len(known))
+
+    def test_normalize_url(self):
+        self.assertEqual('http://example.com/a?b=2&c=1', normalize_url('HTTP://Example.com:80/a?c=1&b=2#top'))
+        self.assertEqual('https://example.com:8443/', normalize_url('https://example.com:8443'))
+
+
+class ExtractionSpecTests(SimpleTestCase):
+    def test_extract_all(self):
+        spec = ExtractionSpec(rows='//tr', ip=XPathField('td[1]', extract_text=True, regex=r'[\d.]+'),
+                              port=XPathField('td[2]/text()', convert=int), flags=XPathField('td/b/text()', index=None))
+        tree = html.fromstring('<table><tr><td> ip 1.2.3.4 </td><td>80</td><td><b>a</b><b>b</b></td></tr>'
+                               '<tr><td>none</td><td>x</td></tr></table>')
+        self.assertEqual([{'ip': '1.2.3.4', 'port': 80, 'flags': ['a', 'b']}, {'ip': None, 'port': None, 'flags': []}],
+                         spec.extract_all(tree))
+
+
+class WeightedSamplerTests(SimpleTestCase):
+    def test_updates(self):
+        sampler = WeightedSampler([('a', 1), ('b', 0), ('c', 3)])
+        self.assertEqual(4, sampler.total)
+        self.assertNotIn('b', sampler)
+        for key in range(10):
+            sampler.set(key, key)
+        sampler.set('c', 0)
+        sampler.remove(5)
+        self.assertEqual(1 + 45 - 5, sampler.total)
+        self.assertEqual(9, len(sampler))
+        sampler.set('d', 2)
+        self.assertEqual(2, sampler.weight('d'))
+        self.assertEqual(1 + 45 - 5 + 2, sampler.total)
+
+    def test_sample(self):
+        sampler = WeightedSampler([('a', 1), ('b', 1000)])
+        self.assertEqual({'a'}, {sampler.sample(exclude={'b'}) for _ in range(20)})
+        sampler.remove('a')
+        self.assertEqual({'b'}, {sampler.sample() for _ in range(20)})
+        with self.assertRaises(IndexError):
+            sampler.sample(exclude={'b'})
+        self.assertEqual(1000, sampler.weight('b'))
+
+    def test_seeded(self):
+        items = [(key, weight) for weight, key in enumerate('abcdefgh', 1)]
+        draws = [[sampler.sample() for _ in range(50)]
+                 for sampler in (WeightedSampler(items, random.Random(7)), WeightedSampler(items, random.Random(7)))]
+        self.assertEqual(draws[0], draws[1])
+
+
+class LatencySketchTests(SimpleTestCase):
+    def test_percentiles(self):
+        sketch = LatencySketch()
+        self.assertIsNone(sketch.percentile(0.5))
+        for latency in range(1, 101):
+            sketch.add(latency / 10)
+        self.assertAlmostEqual(5.0, sketch.percentile(0.5), delta=0.25)
+        self.assertAlmostEqual(9.9, sketch.percentile(0.99), delta=0.5)
+        restored = LatencySketch({str(bucket): count for bucket, count in sketch.to_dict().items()})
+        self.assertEqual(sketch.percentile(0.9), restored.percentile(0.9))
+        self.assertEqual(100, len(restored))
+
+
+class LeaseIndexesTests(SimpleTestCase):
+    def test_lease_indexes(self):
+        gaps = IntervalSet([3, 5, 1024, 3072, 4096, 6144]).gaps(0, 10000)
+        self.assertEqual([0, 1, 3, 4, 6, 7, 8, 9], list(lease_indexes(gaps, 1000)))
+
+
+class ProxyWebAccessTests(SimpleTestCase):
+    def proxy_access(self):
+        state = {'max_requests': 10, 'successful_requests': 0, 'unsuccessful_requests': 0,
+                 'most_successful_requests': 0, 'delay_exponent': ProxyWebAccess.DELAY_EXPONENT, 'tested': time.time(),
+                 'updated': time.time()}
+        with patch('main_assistant.network.delayed_ensure_future'), patch.object(ProxyWebAccess, '_measure_rate'):
+            return ProxyWebAccess(proxy='http://127.0.0.1:3128', state=state)
+
+    def test_weight(self):
+        small_pages, large_pages, slow_transfers = self.proxy_access(), self.proxy_access(), self.proxy_access()
+        self.assertEqual(10, small_pages.weight)
+        for _ in range(20):
+            small_pages._record_transfer(0.2, 2 * 1024, 0.001)
+            large_pages._record_transfer(0.2, 200 * 1024, 0.1)
+            slow_transfers._record_transfer(2.2, 200 * 1024, 2.0)
+        # small pages tell the latency only, they do not make a proxy look slow
+        self.assertIsNone(small_pages.state()['bytes_per_second'])
+        self.assertAlmostEqual(50, small_pages.weight, delta=1)
+        self.assertAlmostEqual(small_pages.weight, large_pages.weight)
+        self.assertAlmostEqual(10 / 2.2, slow_transfers.weight, delta=0.1)
+        fast = self.proxy_access()
+        for _ in range(20):
+            fast._record_transfer(0.01, 200 * 1024, 0.005)
+        self.assertAlmostEqual(10 * ProxyWebAccess.MAX_SPEEDUP, fast.weight)
+
+
+class CongestionControllerTests(SimpleTestCase):
+    def test_aimd(self):
+        controller = CongestionController('example.com')
+        window = controller.window
+        run_async(controller.acquire())
+        controller.release(SimpleNamespace(status=200, headers={}), True, 'proxy0')
+        self.assertAlmostEqual(window + 1 / window, controller.window)
+        window = controller.window
+        # the proxy has just succeeded, so its timeout is the host's
+        run_async(controller.acquire())
+        controller.release(asyncio.TimeoutError(), False, 'proxy0')
+        self.assertAlmostEqual(window / 2, controller.window)
+        # a second congestion signal right after the first one does not cut again
+        run_async(controller.acquire())
+        controller.release(SimpleNamespace(status=429, headers={'Retry-After': '5'}), False, 'proxy0')
+        self.assertAlmostEqual(window / 2, controller.window)
+        self.assertEqual(0, controller.in_flight)
+
+    def test_timeouts(self):
+        controller = CongestionController('example.com')
+        window = controller.window
+        for source in range(CongestionController.TIMEOUT_SOURCES):
+            self.assertAlmostEqual(window, controller.window)
+            # timeouts of a single source are blamed on it
+            for _ in range(2):
+                run_async(controller.acquire())
+                controller.release(asyncio.TimeoutError(), False, source)
+        self.assertAlmostEqual(window / 2, controller.window)
+
+
+class BibliometricsTests(SimpleTestCase):
+    def test_h_indexes(self):
+        # author 0 wrote articles 0-3, author 1 articles 4 and 5, author 2 article 0 too
+        article_authors = sparse.csr_matrix((np.ones(7), ([0, 1, 2, 3, 4, 5, 0], [0, 0, 0, 0, 1, 1, 2])),
+                                            shape=(6, 4))
+        citations = np.array([5, 5, 3, 0, 10, 1])
+        h, totals = h_indexes(article_authors, citations)
+        self.assertEqual(list(h), [3, 1, 1, 0])
+        self.assertEqual(list(totals), [13, 11, 5, 0])
+
+    def test_pagerank(self):
+        # 0 -> 2, 1 -> 2, 2 -> 0; article 3 does not exist
+        cites = sparse.csr_matrix((np.ones(3), ([0, 1, 2], [2, 2, 0])), shape=(4, 4))
+        ranks = pagerank(cites, np.array([True, True, True, False]))
+        self.assertAlmostEqual(ranks.sum(), 1)
+        self.assertEqual(ranks[3], 0)
+        self.assertGreater(ranks[2], ranks[0])
+        self.assertGreater(ranks[0], ranks[1])
@@ -4,5 +4,6 @@ from . import views
 
 urlpatterns = [
     url(r'^status$', views.status, name='status'),
+    url(r'^status/proxies$', views.proxy_status, name='proxy_status'),
     url(r'^$', views.index, name='index'),
 ]
@@ -1,13 +1,20 @@
 import asyncio
+import bisect
 import collections
+import functools
+import hashlib
+import heapq
 import inspect
+import math
 import random
 import re
+import struct
 from enum import Enum
-from urllib.parse import urlparse, urlunparse, urlencode, parse_qs
+from urllib.parse import urlparse, urlunparse, urlencode, parse_qs, parse_qsl
 
 import django.db.models.query
-from lxml.etree import XPathEvalError
+from lxml import etree
+from lxml.etree import XPathError
 from rest_framework import status
 from rest_framework.response import Response
 
@@ -24,18 +31,169 @@ def delayed_ensure_future(coroutine, delay):
     return asyncio.ensure_future(delay_coroutine(coroutine))
 
 
-def weighed_choice(choices, weight_fun):
-    if not choices:
-        raise IndexError('choices is empty')
-    weight_map = {choice_index: weight_fun(choice) for choice_index, choice in enumerate(choices)}
-    total = sum(weight for weight in weight_map.values())
-    r = random.uniform(0, total)
-    summed = 0
-    for choice_index, choice in enumerate(choices):
-        summed += weight_map[choice_index]
-        if r <= summed:
-            return choice
-    return random.choice(choices)
+class WeightedSampler:
+    """Keys drawn at random with probabilities proportional to their positive weights.
+
+    Weights are summed in a Fenwick tree over slots, so set, remove and sample take O(log n) whatever the number
+    of keys; slots of removed keys are reused. Draws use rng, a random.Random, or the random module by default.
+    """
+    MAX_REJECTIONS = 8
+
+    def __init__(self, items=(), rng=None):
+        self._rng = rng or random
+        self._keys = []
+        self._weights = []
+        self._slots = {}
+        self._free = []
+        for key, weight in dict(items).items():
+            if weight > 0:
+                self._slots[key] = len(self._keys)
+                self._keys.append(key)
+                self._weights.append(weight)
+        # built in linear time, every node adds its sum to its parent
+        self._tree = [0] + self._weights
+        for index in range(1, len(self._tree)):
+            parent = index + (index & -index)
+            if parent < len(self._tree):
+                self._tree[parent] += self._tree[index]
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def weight(self, key):
+        slot = self._slots.get(key)
+        return 0 if slot is None else self._weights[slot]
+
+    @property
+    def total(self):
+        return self._prefix(len(self._weights))
+
+    def _prefix(self, index):
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def _add(self, slot, delta):
+        index = slot + 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def _allocate(self, key):
+        if self._free:
+            slot = self._free.pop()
+            self._keys[slot] = key
+        else:
+            slot = len(self._keys)
+            self._keys.append(key)
+            self._weights.append(0)
+            index = slot + 1
+            # the new node sums the slots (index - lowbit(index), index], the new one has no weight yet
+            self._tree.append(self._prefix(index - 1) - self._prefix(index - (index & -index)))
+        self._slots[key] = slot
+        return slot
+
+    def set(self, key, weight):
+        """Sets the weight of key, a weight <= 0 removes it."""
+        if weight <= 0:
+            self.remove(key)
+            return
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._allocate(key)
+        self._add(slot, weight - self._weights[slot])
+        self._weights[slot] = weight
+
+    def remove(self, key):
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._add(slot, -self._weights[slot])
+            self._weights[slot] = 0
+            self._keys[slot] = None
+            self._free.append(slot)
+
+    def _draw(self):
+        total = self.total
+        if not self._slots or total <= 0:
+            raise IndexError('sampler is empty')
+        value = self._rng.random() * total
+        # descends to the slot whose cumulative weight range holds value
+        index = 0
+        step = 1 << len(self._weights).bit_length()
+        while step:
+            if index + step < len(self._tree) and self._tree[index + step] <= value:
+                index += step
+                value -= self._tree[index]
+            step >>= 1
+        if index < len(self._keys) and self._weights[index] > 0:
+            return self._keys[index]
+        # value landed past the last key by a float rounding error
+        return self._rng.choice(list(self._slots))
+
+    def sample(self, exclude=()):
+        """Draws a key which is not in exclude, raises IndexError if there is none."""
+        for _ in range(self.MAX_REJECTIONS):
+            key = self._draw()
+            if key not in exclude:
+                return key
+        # most of the weight is excluded, the excluded keys are taken out for one draw
+        excluded = [(key, self.weight(key)) for key in exclude if key in self._slots]
+        for key, weight in excluded:
+            self.remove(key)
+        try:
+            return self._draw()
+        finally:
+            for key, weight in excluded:
+                self.set(key, weight)
+
+
+class LatencySketch:
+    """Histogram of positive values in logarithmic buckets, answering percentiles within RESOLUTION relative error.
+
+    All counts are halved whenever they sum up to MAX_COUNT, so that old values fade out.
+    """
+    RESOLUTION = 0.05
+    MAX_COUNT = 1000
+    MIN_VALUE = 1e-6
+
+    def __init__(self, buckets=None):
+        # keys of buckets loaded from JSON are strings
+        self._buckets = {int(bucket): count for bucket, count in (buckets or {}).items()}
+        self._count = sum(self._buckets.values())
+
+    def __len__(self):
+        return self._count
+
+    def add(self, value):
+        bucket = math.floor(math.log(max(value, self.MIN_VALUE)) / math.log1p(self.RESOLUTION))
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+        self._count += 1
+        if self._count >= self.MAX_COUNT:
+            self._buckets = {bucket: count // 2 for bucket, count in self._buckets.items() if count > 1}
+            self._count = sum(self._buckets.values())
+
+    def percentile(self, fraction):
+        if not self._count:
+            return None
+        rank = fraction * self._count
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                break
+        # geometric middle of the bucket
+        return (1 + self.RESOLUTION) ** (bucket + 0.5)
+
+    def to_dict(self):
+        return dict(self._buckets)
 
 
 async def backoff(coroutine, timeout, retries, backoff_for, on_fail=None, fail_exception_types=None):
@@ -57,9 +215,21 @@ async def backoff(coroutine, timeout, retries, backoff_for, on_fail=None, fail_e
         retries -= 1
 
 
+@functools.lru_cache(maxsize=1024)
+def _compile_xpath(path, namespaces):
+    return etree.XPath(path, namespaces=dict(namespaces) if namespaces else None)
+
+
+def compile_xpath(path, namespaces=None):
+    """etree.XPath of path, compiled once per path and namespaces."""
+    return _compile_xpath(path, tuple(sorted(namespaces.items())) if namespaces else None)
+
+
 def xpath_select(element, path, index=0, default=None, extract_text=False, strip=None, regex=None, namespaces=None):
     try:
-        resultset = element.xpath(path, namespaces=namespaces)
+        if isinstance(path, str):
+            path = compile_xpath(path, namespaces)
+        resultset = path(element)
         result = resultset[index]
         if extract_text:
             result = result.text_content()
@@ -68,10 +238,239 @@ def xpath_select(element, path, index=0, default=None, extract_text=False, strip
         if regex:
             result = re.search(regex, result).group()
         return result
-    except (ValueError, TypeError, IndexError, AttributeError, XPathEvalError):
+    except (ValueError, TypeError, IndexError, AttributeError, XPathError):
         return default
 
 
+class XPathField:
+    """Declaration of one extracted field, with the arguments of xpath_select and a conversion of the result.
+
+    With index=None all results are extracted into a list. A result which cannot be converted becomes default.
+    """
+
+    def __init__(self, path, index=0, default=None, extract_text=False, strip=None, regex=None, convert=None,
+                 namespaces=None):
+        self.path = compile_xpath(path, namespaces)
+        self.index = index
+        self.default = default
+        self.extract_text = extract_text
+        self.strip = strip
+        self.regex = re.compile(regex) if isinstance(regex, str) else regex
+        self.convert = convert
+
+    def _process(self, result):
+        if self.extract_text:
+            result = result.text_content()
+        if self.strip is True or self.extract_text and self.strip is not False:
+            result = result.strip()
+        if self.regex:
+            result = self.regex.search(result).group()
+        if self.convert:
+            result = self.convert(result)
+        return result
+
+    def extract(self, element):
+        try:
+            resultset = self.path(element)
+            if self.index is None:
+                return [self._process(result) for result in resultset]
+            return self._process(resultset[self.index])
+        except (ValueError, TypeError, IndexError, AttributeError, XPathError):
+            return self.default
+
+
+class ExtractionSpec:
+    """Named XPathFields compiled once, typically as a class attribute, and extracted into a dict in one call.
+
+    If rows is given, extract_all extracts a record from every element it matches.
+    """
+
+    def __init__(self, rows=None, namespaces=None, **fields):
+        self.rows = compile_xpath(rows, namespaces) if rows else None
+        self.fields = fields
+
+    def extract(self, element):
+        return {name: field.extract(element) for name, field in self.fields.items()}
+
+    def extract_all(self, element):
+        return [self.extract(row) for row in self.rows(element)]
+
+
+class PrefixIndex:
+    """Sorted array of word-initial suffixes of entry texts, answering case insensitive prefix queries.
+
+    Entries are dicts holding their text under text_key and their weight under weight_key; matches are returned
+    by descending weight. The best entries of aligned blocks of BLOCK_SIZE suffixes are merged up a segment tree,
+    so the suffixes matching a prefix are ranked from O(log n) precomputed lists and the two partial blocks at the
+    ends of their range, however many there are.
+    """
+    WORD_PATTERN = re.compile(r'\w+')
+    BLOCK_SIZE = 256
+
+    def __init__(self, entries, text_key, weight_key, limit):
+        self._entries = list(entries)
+        self._weight_key = weight_key
+        self._limit = limit
+        suffixes = []
+        for position, entry in enumerate(self._entries):
+            words = self.WORD_PATTERN.findall(entry[text_key].lower())
+            for i in range(len(words)):
+                suffixes.append((' '.join(words[i:]), position))
+        suffixes.sort()
+        self._suffixes = [suffix for suffix, position in suffixes]
+        self._positions = [position for suffix, position in suffixes]
+        block_count = -(-len(self._positions) // self.BLOCK_SIZE)
+        self._tree_size = 1
+        while self._tree_size < block_count:
+            self._tree_size *= 2
+        self._tree = [[] for _ in range(2 * self._tree_size)]
+        for block in range(block_count):
+            start = block * self.BLOCK_SIZE
+            self._tree[self._tree_size + block] = self._best(self._positions[start:start + self.BLOCK_SIZE], limit)
+        for node in range(self._tree_size - 1, 0, -1):
+            self._tree[node] = self._best(self._tree[2 * node] + self._tree[2 * node + 1], limit)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _best(self, positions, limit):
+        """Positions of the best distinct entries among positions, best first."""
+        return heapq.nlargest(limit, set(positions), key=lambda position: (self._entries[position][self._weight_key],
+                                                                           -position))
+
+    def search(self, text, limit=None):
+        limit = self._limit if limit is None else min(limit, self._limit)
+        prefix = ' '.join(self.WORD_PATTERN.findall(text.lower())) if text else ''
+        if not prefix:
+            return []
+        start = bisect.bisect_left(self._suffixes, prefix)
+        end = bisect.bisect_left(self._suffixes, prefix + '\U0010ffff', lo=start)
+        first_block, last_block = -(-start // self.BLOCK_SIZE), end // self.BLOCK_SIZE
+        if first_block >= last_block:
+            candidates = self._positions[start:end]
+        else:
+            candidates = self._positions[start:first_block * self.BLOCK_SIZE] \
+                + self._positions[last_block * self.BLOCK_SIZE:end]
+            # the nodes covering the whole blocks [first_block, last_block)
+            low, high = first_block + self._tree_size, last_block + self._tree_size
+            while low < high:
+                if low & 1:
+                    candidates += self._tree[low]
+                    low += 1
+                if high & 1:
+                    high -= 1
+                    candidates += self._tree[high]
+                low >>= 1
+                high >>= 1
+        return [self._entries[position] for position in self._best(candidates, limit)]
+
+
+class IntervalSet:
+    """Set of integers kept as sorted, disjoint, non-adjacent half-open intervals [start, end).
+
+    The bounds live in one flat sorted list (start, end, start, end, ...), so an integer is in the set
+    when the number of bounds not greater than it is odd.
+    """
+    BOUND_FORMAT = '<{}q'
+
+    def __init__(self, bounds=None):
+        self._bounds = list(bounds or [])
+        self._count = sum(self._bounds[i + 1] - self._bounds[i] for i in range(0, len(self._bounds), 2))
+
+    @classmethod
+    def from_bytes(cls, data):
+        data = bytes(data or b'')
+        return cls(struct.unpack(cls.BOUND_FORMAT.format(len(data) // 8), data))
+
+    def to_bytes(self):
+        return struct.pack(self.BOUND_FORMAT.format(len(self._bounds)), *self._bounds)
+
+    @property
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return len(self._bounds) // 2
+
+    def __iter__(self):
+        """Yields (start, size) of the intervals in order."""
+        for i in range(0, len(self._bounds), 2):
+            yield self._bounds[i], self._bounds[i + 1] - self._bounds[i]
+
+    def __contains__(self, number):
+        return bisect.bisect_right(self._bounds, number) % 2 == 1
+
+    def add(self, start, size):
+        if size <= 0:
+            return
+        end = start + size
+        # a bound equal to start or end is an adjacent interval, which is merged as well
+        i = bisect.bisect_left(self._bounds, start)
+        j = bisect.bisect_right(self._bounds, end)
+        merged_start = start if i % 2 == 0 else self._bounds[i - 1]
+        merged_end = end if j % 2 == 0 else self._bounds[j]
+        covered = self._bounds[i - i % 2:j + j % 2]
+        self._count += merged_end - merged_start - sum(covered[k + 1] - covered[k] for k in range(0, len(covered), 2))
+        self._bounds[i:j] = ([start] if i % 2 == 0 else []) + ([end] if j % 2 == 0 else [])
+
+    def gaps(self, start, end):
+        """Yields (start, size) of the runs of numbers in [start, end) missing from the set."""
+        i = bisect.bisect_right(self._bounds, start)
+        current = start if i % 2 == 0 else self._bounds[i]
+        i += i % 2
+        while current < end:
+            gap_end = min(self._bounds[i], end) if i < len(self._bounds) else end
+            if gap_end > current:
+                yield current, gap_end - current
+            if i + 1 >= len(self._bounds):
+                break
+            current = self._bounds[i + 1]
+            i += 2
+
+
+class BloomFilter:
+    """Set membership filter in a bit array, with no false negatives and about error_rate false positives
+    while it holds at most capacity keys.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = capacity
+        self._size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hash_count = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def _positions(self, key):
+        # double hashing, the two halves of one digest give all the hash functions
+        first, second = struct.unpack('<QQ', hashlib.md5(key.encode()).digest())
+        return ((first + i * second) % self._size for i in range(self._hash_count))
+
+    def add(self, key):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def __contains__(self, key):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """Lowercases scheme and host, drops default ports and the fragment, sorts query parameters."""
+    parts = urlparse(url)
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname or ''
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc = '{}:{}'.format(netloc, parts.port)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunparse((scheme, netloc, parts.path or '/', parts.params, query, ''))
+
+
 def remove_url_params(url, params):
     """Removes a list of params from """
     u = urlparse(url)
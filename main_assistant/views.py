@@ -1,8 +1,13 @@
 from django.http import HttpResponse
 from django.shortcuts import render
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
 
+from main_assistant.db_executor import published_stats
 from main_assistant.models import Article, Publication, Keyword, Author, Reference, SavedReference
+from main_assistant.proxy_health import ProxyHealthStore
 from main_assistant.services import url_providers_map
+from main_assistant.utils import LatencySketch
 
 
 def index(request):
@@ -15,6 +20,11 @@ def status(request):
         processed, total = provider.download_status()
         response_str += '<p>' + provider.__name__ + ' has downloaded ' + str(processed) + '/' + str(total) + '</p>'
     response_str += '<hr/>'
+    for process, stats in sorted(published_stats().items()):
+        response_str += ('<p> {}: database executor running {running}/{workers}, queued {queued}/{max_queued}, '
+                         'waiting {waiting}, average wait {average_wait_time:.3f}s, max wait {max_wait_time:.3f}s, '
+                         'average queue time {average_queue_time:.3f}s </p>').format(process, **stats)
+    response_str += '<hr/>'
     response_str += '<p> {} articles in database </p>'.format(Article.objects.count())
     response_str += '<p> {} publications in database </p>'.format(Publication.objects.count())
     response_str += '<p> {} keywords in database </p>'.format(Keyword.objects.count())
@@ -22,3 +32,27 @@ def status(request):
     response_str += '<p> {} references in database </p>'.format(Reference.objects.count())
     response_str += '<p> {} saved references in database </p>'.format(SavedReference.objects.count())
     return HttpResponse(response_str)
+
+
+@api_view(['GET'])
+def proxy_status(request):
+    """Health of the proxies as last saved by the scraping processes, by descending selection weight."""
+    states, blacklisted = ProxyHealthStore().load()
+    proxies = []
+    for proxy, state in states.items():
+        sketch = LatencySketch(state.get('latency_sketch'))
+        proxies.append({
+            'proxy': proxy,
+            'weight': state.get('weight', state['max_requests']),
+            'max_requests': state['max_requests'],
+            'latency': state.get('latency'),
+            'latency_p50': sketch.percentile(0.5),
+            'latency_p90': sketch.percentile(0.9),
+            'latency_p99': sketch.percentile(0.99),
+            'bytes_per_second': state.get('bytes_per_second'),
+            'delay_exponent': state['delay_exponent'],
+            'tested': state['tested'],
+            'updated': state['updated'],
+        })
+    proxies.sort(key=lambda proxy: proxy['weight'], reverse=True)
+    return Response({'proxies': proxies, 'blacklisted': sorted(blacklisted)})
@@ -3,6 +3,7 @@ import asyncio
 import copy
 import json
 import logging
+import math
 import re
 import time
 from abc import ABCMeta, abstractmethod
@@ -12,6 +13,7 @@ from decimal import Decimal
 
 import elasticsearch
 from django.db import transaction
+from django.db.models import Avg
 from haystack import connections
 from haystack.constants import DJANGO_CT
 from haystack.exceptions import NotHandled
@@ -19,7 +21,7 @@ from haystack.utils import get_model_ct
 from lxml import html
 from user_agent import generate_user_agent
 
-from main_assistant.models import Keyword, Article, RankingType, Ranking, Publication
+from main_assistant.models import Keyword, Article, RankingType, Ranking, Publication, PublicationMetrics
 from main_assistant.network import DirectWebAccess
 from main_assistant.utils import convert, xpath_select
 
@@ -648,3 +650,17 @@ def suggest_articles(text, algorithm=mlt_art_search()):
 
 def suggest_publications(text, algorithm=mlt_pub_search()):
     return algorithm(text)
+
+
+def rerank_by_influence(publications):
+    """Scales the text similarity of suggested publications by their citation PageRank, relative to the average."""
+    publications = list(publications)
+    ranks = dict(PublicationMetrics.objects.filter(publication_id__in=[p.pk for p in publications])
+                 .values_list('publication_id', 'pagerank'))
+    average = PublicationMetrics.objects.aggregate(average=Avg('pagerank'))['average']
+    if not average:
+        return publications
+    for publication in publications:
+        publication.value *= 1 + math.log1p(ranks.get(publication.pk, 0) / average)
+    publications.sort(key=lambda x: x.value, reverse=True)
+    return publications
@@ -9,7 +9,7 @@ from rest_framework.response import Response
 from main_assistant.models import Publication
 from main_assistant.utils import RangeHeaderPaginator, run_async
 from paper_analyzer.serializers import ArticleResultSerializer, JournalResultSerializer, RankingSerializer
-from paper_analyzer.services import ranking_source, suggest_publications, suggest_articles
+from paper_analyzer.services import ranking_source, suggest_publications, suggest_articles, rerank_by_influence
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +21,10 @@ def search_publications(request, format=None):
     text = request.data['text']
     if not text:
         return Response(status=status.HTTP_400_BAD_REQUEST)
-    return RangeHeaderPaginator(suggest_publications(text), JournalResultSerializer).get_response(request)
+    publications = suggest_publications(text)
+    if request.data.get('rerank') == 'influence':
+        publications = rerank_by_influence(publications)
+    return RangeHeaderPaginator(publications, JournalResultSerializer).get_response(request)
 
 
 @api_view(['POST'])
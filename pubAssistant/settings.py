@@ -232,11 +232,38 @@ CELERYBEAT_SCHEDULE = {
         'task': 'main_assistant.tasks.update_articles_periodic',
         'schedule': timedelta(hours=4),
     },
+    'trending-keywords-update': {
+        'task': 'hype_cycle_graph.tasks.update_trending_keywords_periodic',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'citation-graph-rebuild': {
+        'task': 'main_assistant.tasks.rebuild_citation_graph_periodic',
+        'schedule': crontab(hour=2, minute=0),
+    },
+    'bibliometrics-update': {
+        'task': 'main_assistant.tasks.update_bibliometrics_periodic',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'count-deltas-fold': {
+        'task': 'main_assistant.tasks.fold_count_deltas_periodic',
+        'schedule': timedelta(minutes=5),
+    },
+    'autocomplete-refresh': {
+        'task': 'hype_cycle_graph.tasks.refresh_autocomplete_periodic',
+        'schedule': timedelta(hours=6),
+    },
     # 'update-index': {
     #     'task': 'main_assistant.tasks.update_index_periodic',
     #     'schedule': crontab(day_of_week='sunday', hour=1, minute=0),
     # },
 }
+# number of download tasks kept scheduled for every enabled digital library
+SCRAPING_TASKS_PER_LIBRARY = int(os.getenv('SCRAPING_TASKS_PER_LIBRARY', 4))
+# database threads of every scraping process, mind the connection limit of the database, and calls queued for them
+SCRAPER_DB_WORKERS = int(os.getenv('SCRAPER_DB_WORKERS', 8))
+SCRAPER_DB_QUEUE = int(os.getenv('SCRAPER_DB_QUEUE', 32))
+# parser processes of every scraping process (threads in Celery's prefork workers), 0 for one per core
+SCRAPER_PARSE_WORKERS = int(os.getenv('SCRAPER_PARSE_WORKERS', 0))
 CELERY_CREATE_MISSING_QUEUES = False
 CELERY_DEFAULT_QUEUE = 'default'
 CELERY_QUEUES = (
@@ -287,3 +314,10 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = '/var/pubassistant/static/'
 MEDIA_ROOT = '/var/pubassistant/media/'
+
+# In-memory citation graph (main_assistant.citation_graph)
+CITATION_GRAPH_DIR = os.getenv('CITATION_GRAPH_DIR', '/var/pubassistant/citation_graph/')
+CITATION_GRAPH_ENABLED = bool(os.getenv('CITATION_GRAPH_ENABLED', False))
+# fetched pages are archived here if set, 'record' or 'replay', see main_assistant.archive
+RESPONSE_ARCHIVE_DIR = os.getenv('RESPONSE_ARCHIVE_DIR', '')
+RESPONSE_ARCHIVE_MODE = os.getenv('RESPONSE_ARCHIVE_MODE', 'record')